@@ -0,0 +1,280 @@
+import asyncio
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.database import DB_MAX_OVERFLOW, DB_POOL_SIZE
+
+# Default: sebanyak koneksi yang bisa diberikan pool DB proses ini, supaya
+# request yang lolos tidak menumpuk menunggu koneksi.
+ADMISSION_GLOBAL_LIMIT = int(os.getenv("ADMISSION_GLOBAL_LIMIT", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+ADMISSION_SHOWTIME_LIMIT = int(os.getenv("ADMISSION_SHOWTIME_LIMIT", "50"))
+ADMISSION_QUEUE_MAX = int(os.getenv("ADMISSION_QUEUE_MAX", "10000"))
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", "1"))
+ADMISSION_TICKET_TTL_SECONDS = float(os.getenv("ADMISSION_TICKET_TTL_SECONDS", "15"))
+# Tiket harus diulang paling lambat Retry-After + grace; lewat dari itu
+# tiket gugur supaya tidak menahan slot untuk client yang sudah pergi.
+ADMISSION_TICKET_GRACE_SECONDS = float(os.getenv("ADMISSION_TICKET_GRACE_SECONDS", "2"))
+
+
+class Ticket:
+    def __init__(self, scope: Optional[str], position: int, seq: int, expires_at: float):
+        self.id = uuid.uuid4().hex
+        self.scope = scope
+        # Urutan global (FIFO lintas jadwal) dan nomor urut di antrean jadwalnya.
+        self.seq = seq
+        self.position = position
+        self.expires_at = expires_at
+        # Jumlah request dengan tiket ini yang sedang menunggu di acquire_async.
+        self.waiting = 0
+
+    def alive(self, now: float) -> bool:
+        return self.waiting > 0 or self.expires_at > now
+
+
+class AdmissionController:
+    """
+    Ruang tunggu virtual di depan endpoint transaksi (cart/checkout).
+
+    Jumlah request yang sedang diproses dibatasi secara global dan per
+    jadwal (scope). Request yang tidak kebagian slot mendapat tiket di
+    antrean FIFO per jadwal; client mengulang request dengan header
+    X-Queue-Ticket dan dilayani sesuai urutan tiket begitu slot kosong.
+    Tiket yang tidak diulang dalam Retry-After + ADMISSION_TICKET_GRACE_SECONDS
+    (maksimal ADMISSION_TICKET_TTL_SECONDS) gugur saat sampai di kepala
+    antrean, jadi tidak menahan slot yang kosong.
+
+    Tiap request hanya memeriksa kepala antrean per jadwal (bukan seluruh
+    antrean); pembersihan penuh hanya dilakukan saat antrean penuh.
+
+    Semua batas dan antrean berlaku per proses: dengan N worker uvicorn,
+    total request yang diproses bisa mencapai N x limit, dan tiket hanya
+    dikenali oleh proses yang menerbitkannya. Batas global karena itu
+    disamakan dengan pool DB proses ini, bukan kapasitas server DB.
+    """
+
+    def __init__(self, global_limit: int = ADMISSION_GLOBAL_LIMIT,
+                 showtime_limit: int = ADMISSION_SHOWTIME_LIMIT,
+                 queue_max: int = ADMISSION_QUEUE_MAX,
+                 wait_seconds: float = ADMISSION_WAIT_SECONDS,
+                 ticket_ttl: float = ADMISSION_TICKET_TTL_SECONDS,
+                 ticket_grace: float = ADMISSION_TICKET_GRACE_SECONDS):
+        self.global_limit = global_limit
+        self.showtime_limit = showtime_limit
+        self.queue_max = queue_max
+        self.wait_seconds = wait_seconds
+        self.ticket_ttl = ticket_ttl
+        self.ticket_grace = ticket_grace
+        self._lock = threading.Lock()
+        self._tickets: Dict[str, Ticket] = {}
+        # Antrean per scope (None = checkout, hanya terikat batas global).
+        self._queues: Dict[Optional[str], "OrderedDict[str, Ticket]"] = {}
+        self._next_position: Dict[Optional[str], int] = {}
+        self._seq = 0
+        self._active = 0
+        self._active_by_scope: Dict[str, int] = {}
+        # Request async yang sedang menunggu slot; dibangunkan oleh release().
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        # Rata-rata lama proses satu request (EWMA), untuk estimasi tunggu.
+        self._service_time = 0.05
+        self.admitted = 0
+        self.rejected = 0
+
+    def _has_room(self, scope: Optional[str]) -> bool:
+        if self._active >= self.global_limit:
+            return False
+        return scope is None or self._active_by_scope.get(scope, 0) < self.showtime_limit
+
+    def _remove(self, ticket: Ticket):
+        del self._tickets[ticket.id]
+        queue = self._queues[ticket.scope]
+        del queue[ticket.id]
+        if not queue:
+            del self._queues[ticket.scope]
+            del self._next_position[ticket.scope]
+
+    def _head(self, scope: Optional[str], now: float) -> Optional[Ticket]:
+        # Tiket gugur dibuang saat sampai di kepala antrean.
+        queue = self._queues.get(scope)
+        while queue:
+            ticket = next(iter(queue.values()))
+            if ticket.alive(now):
+                return ticket
+            self._remove(ticket)
+        return None
+
+    def _purge(self, now: float):
+        for ticket in [t for t in self._tickets.values() if not t.alive(now)]:
+            self._remove(ticket)
+
+    def _first_eligible(self, now: float) -> Optional[Ticket]:
+        # Tiket terdepan (urutan FIFO global) dari jadwal yang masih punya slot.
+        first = None
+        for scope in list(self._queues):
+            if not self._has_room(scope):
+                continue
+            head = self._head(scope, now)
+            if head is not None and (first is None or head.seq < first.seq):
+                first = head
+        return first
+
+    def _try_admit(self, scope: Optional[str], ticket: Optional[Ticket], now: float) -> bool:
+        if not self._has_room(scope):
+            return False
+        first = self._first_eligible(now)
+        if first is not None and first is not ticket:
+            return False
+        if ticket is not None:
+            self._remove(ticket)
+        self._active += 1
+        if scope is not None:
+            self._active_by_scope[scope] = self._active_by_scope.get(scope, 0) + 1
+        self.admitted += 1
+        return True
+
+    def _position(self, ticket: Ticket, now: float) -> int:
+        # Perkiraan: tiket di tengah antrean yang gugur baru dibuang saat jadi kepala.
+        head = self._head(ticket.scope, now)
+        return ticket.position - head.position + 1 if head is not None else 1
+
+    def _estimated_wait(self, position: int, scope: Optional[str]) -> float:
+        slots = self.global_limit if scope is None else min(self.global_limit, self.showtime_limit)
+        return position * self._service_time / max(slots, 1)
+
+    def _lookup(self, scope: Optional[str], ticket_id: Optional[str], now: float) -> Optional[Ticket]:
+        ticket = self._tickets.get(ticket_id) if ticket_id else None
+        if ticket is not None and not ticket.alive(now):
+            self._remove(ticket)
+            return None
+        if ticket is not None and ticket.scope != scope:
+            # Tiket milik jadwal lain tidak bisa dipakai menyalip antrean.
+            return None
+        return ticket
+
+    def _enqueue(self, scope: Optional[str], now: float) -> Ticket:
+        if len(self._tickets) >= self.queue_max:
+            self._purge(now)
+        if len(self._tickets) >= self.queue_max:
+            self.rejected += 1
+            raise HTTPException(503, "Antrean penuh, silakan coba beberapa saat lagi")
+        self._seq += 1
+        position = self._next_position.get(scope, 0)
+        self._next_position[scope] = position + 1
+        ticket = Ticket(scope, position, self._seq, now + self.ticket_grace)
+        self._tickets[ticket.id] = ticket
+        self._queues.setdefault(scope, OrderedDict())[ticket.id] = ticket
+        return ticket
+
+    def _queued(self, scope: Optional[str], ticket: Ticket) -> HTTPException:
+        with self._lock:
+            now = time.monotonic()
+            position = self._position(ticket, now)
+            wait = self._estimated_wait(position, scope)
+            retry_after = max(1, min(math.ceil(wait), int(self.ticket_ttl // 2) or 1))
+            ticket.expires_at = now + min(retry_after + self.ticket_grace, self.ticket_ttl)
+            ticket.waiting -= 1
+            self.rejected += 1
+
+        return HTTPException(
+            429,
+            detail={
+                "message": "Sedang ramai, Anda masuk antrean",
+                "ticket": ticket.id,
+                "posisi": position,
+                "estimasi_tunggu_detik": round(wait, 1)
+            },
+            headers={"Retry-After": str(retry_after), "X-Queue-Ticket": ticket.id}
+        )
+
+    async def acquire_async(self, scope: Optional[str], ticket_id: Optional[str] = None):
+        """
+        Masuk ke slot scope ini, atau tunggu di event loop (tanpa memakai
+        thread) paling lama wait_seconds. Gagal -> 429 berisi tiket antrean.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.wait_seconds
+        with self._lock:
+            ticket = self._lookup(scope, ticket_id, time.monotonic())
+            if ticket is not None:
+                ticket.waiting += 1
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self._try_admit(scope, ticket, now):
+                    return
+                if ticket is None:
+                    ticket = self._enqueue(scope, now)
+                    ticket.waiting += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    break
+                # Slot ditahan tiket yang client-nya belum kembali: cek lagi
+                # begitu tiket itu gugur, jangan tunggu release() berikutnya.
+                first = self._first_eligible(now)
+                if first is not None and first.waiting == 0:
+                    remaining = min(remaining, max(first.expires_at - now, 0.01))
+                waiter = (loop, asyncio.Event())
+                self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter[1].wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+            except BaseException:
+                with self._lock:
+                    ticket.waiting -= 1
+                raise
+            finally:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+        raise self._queued(scope, ticket)
+
+    def release(self, scope: Optional[str], started_at: float):
+        elapsed = time.monotonic() - started_at
+        with self._lock:
+            self._active -= 1
+            if scope is not None:
+                left = self._active_by_scope.get(scope, 1) - 1
+                if left:
+                    self._active_by_scope[scope] = left
+                else:
+                    self._active_by_scope.pop(scope, None)
+            self._service_time = 0.9 * self._service_time + 0.1 * elapsed
+            waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    @asynccontextmanager
+    async def admit(self, scope: Optional[str], ticket_id: Optional[str] = None):
+        await self.acquire_async(scope, ticket_id)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(scope, started_at)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._purge(time.monotonic())
+            return {
+                "global_limit": self.global_limit,
+                "showtime_limit": self.showtime_limit,
+                "aktif": self._active,
+                "aktif_per_jadwal": dict(self._active_by_scope),
+                "antrean": len(self._tickets),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "rata_rata_proses_detik": round(self._service_time, 4)
+            }
+
+
+admission = AdmissionController()
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Optional
+
+NOW_PLAYING_TTL_SECONDS = float(os.getenv("NOW_PLAYING_TTL_SECONDS", "30"))
+ORDER_CACHE_SIZE = int(os.getenv("ORDER_CACHE_SIZE", "10000"))
+# Status order diubah worker pembayaran / pembatalan di proses lain dan
+# invalidate hanya sampai ke cache proses itu, jadi semua entry berumur pendek.
+ORDER_CACHE_TTL_SECONDS = float(os.getenv("ORDER_CACHE_TTL_SECONDS", "2"))
+
+
+class CachedPayload:
+    """Response JSON yang sudah diserialisasi beserta ETag-nya."""
+
+    def __init__(self, body: bytes, status_code: int = 200):
+        self.body = body
+        self.status_code = status_code
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+
+class NowPlayingCache:
+    """
+    Cache in-memory untuk response /now_playing.
+
+    Response disimpan per tanggal (berganti otomatis saat hari berganti).
+    Setiap penulisan film/jadwal memanggil invalidate(); generation dipakai
+    supaya hasil query yang dimulai sebelum invalidate tidak ikut tersimpan.
+    invalidate() hanya sampai ke proses yang menangani penulisan, jadi entry
+    juga kedaluwarsa setelah ttl detik agar worker lain ikut diperbarui.
+    """
+
+    def __init__(self, ttl: float = NOW_PLAYING_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tanggal: Optional[date] = None
+        self._entry: Optional[CachedPayload] = None
+        self._stored_at = 0.0
+        self._generation = 0
+
+    def get(self, tanggal: date) -> tuple[Optional[CachedPayload], int]:
+        with self._lock:
+            if (self._entry is not None and self._tanggal == tanggal
+                    and time.monotonic() - self._stored_at < self.ttl):
+                return self._entry, self._generation
+            return None, self._generation
+
+    def store(self, tanggal: date, payload: dict, generation: int, status_code: int = 200) -> CachedPayload:
+        body = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+        entry = CachedPayload(body, status_code)
+        with self._lock:
+            if generation == self._generation:
+                self._tanggal = tanggal
+                self._entry = entry
+                self._stored_at = time.monotonic()
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._tanggal = None
+            self._entry = None
+
+
+now_playing_cache = NowPlayingCache()
+
+
+class OrderCache:
+    """
+    Cache LRU + TTL untuk order yang baru dibuat/dibaca (polling tiket).
+
+    Checkout mengisi cache langsung setelah commit. Perubahan status dan
+    pembatalan memanggil invalidate(), yang meninggalkan tombstone berisi
+    stamp; hasil query get_order yang dimulai sebelum invalidate (stamp
+    lebih lama) tidak boleh menimpa tombstone tersebut.
+
+    Invalidate bersifat per proses (PENDING -> PAID/FAILED, refund,
+    pembatalan), jadi ttl dibuat pendek: worker lain paling lama ttl detik
+    melayani status yang sudah basi. Polling tiket tetap tertampung cache.
+    """
+
+    def __init__(self, max_size: int = ORDER_CACHE_SIZE, ttl: float = ORDER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # code -> (expires_at, stamp, data); data None = tombstone
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._stamp = 0
+        self._cleared_at = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def begin(self) -> int:
+        """Stamp sebelum membaca DB; dioper ke put() untuk isi dari hasil query."""
+        with self._lock:
+            return self._stamp
+
+    def get(self, code: str) -> Optional[dict]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is None or entry[2] is None or entry[0] <= now:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(code)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, code: str, data: dict, since: Optional[int] = None):
+        """Simpan order. since=None berarti data otoritatif (langsung dari checkout)."""
+        with self._lock:
+            current = self._entries.get(code)
+            if since is not None and (since < self._cleared_at or (current is not None and current[1] > since)):
+                return
+            self._stamp += 1
+            self._entries[code] = (time.monotonic() + self.ttl, self._stamp, data)
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, code: str):
+        with self._lock:
+            self._stamp += 1
+            self._entries[code] = (time.monotonic() + self.ttl, self._stamp, None)
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._stamp += 1
+            self._cleared_at = self._stamp
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": sum(1 for e in self._entries.values() if e[2] is not None),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+order_cache = OrderCache()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Cek header If-None-Match (boleh berisi beberapa tag / weak tag)."""
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
@@ -0,0 +1,102 @@
+import datetime
+import logging
+
+from fastapi import HTTPException
+from sqlalchemy import case, func, update
+from sqlalchemy.orm import Session
+
+from app.cache import now_playing_cache, order_cache
+from app.gate import gate_rosters
+from app.models import Cart, Jadwal, JadwalOccupancy, Order, OrderSeat
+from app.payments import PAID, PENDING
+from app.seat_state import seat_states
+
+logger = logging.getLogger(__name__)
+
+REFUNDED = "REFUNDED"
+CANCELLED = "CANCELLED"
+
+
+def cancel_schedule(db: Session, jadwal: Jadwal) -> dict:
+    """
+    Batalkan satu jadwal dalam satu transaksi dengan statement set-based:
+    order PAID -> REFUNDED (refund_amount = final_price), order PENDING ->
+    CANCELLED, hapus carts dan counter okupansi, lalu tandai jadwal dengan
+    cancelled_at. Jadwal dan order_seats tidak dihapus supaya riwayat order
+    dan jejak refund tetap utuh. Jumlah statement tetap, tidak tergantung
+    jumlah order/kursi.
+
+    Baris jadwal dikunci FOR UPDATE lebih dulu; checkout memegang kunci
+    bersama (FOR SHARE) pada jadwal yang sama sampai commit, jadi tidak ada
+    order PAID baru yang lolos setelah refund dihitung.
+    """
+    jadwal_id = jadwal.id
+    jadwal_code = jadwal.code
+
+    cancelled_at = (
+        db.query(Jadwal.cancelled_at).filter(Jadwal.id == jadwal_id).with_for_update().scalar()
+    )
+    if cancelled_at is not None:
+        db.rollback()
+        raise HTTPException(400, f"Jadwal {jadwal_code} sudah dibatalkan")
+
+    order_codes = [
+        code for (code,) in
+        db.query(Order.code).filter(Order.jadwal_id == jadwal_id, Order.status.in_([PAID, PENDING]))
+    ]
+
+    # Satu UPDATE: status & refund ditentukan per baris dengan CASE.
+    updated = db.execute(
+        update(Order)
+        .where(Order.jadwal_id == jadwal_id, Order.status.in_([PAID, PENDING]))
+        .values(
+            refund_amount=case((Order.status == PAID, Order.final_price), else_=0),
+            status=case((Order.status == PAID, REFUNDED), else_=CANCELLED)
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    refunded, total_refund = (
+        db.query(func.count(Order.id), func.coalesce(func.sum(Order.refund_amount), 0))
+        .filter(Order.jadwal_id == jadwal_id, Order.status == REFUNDED)
+        .one()
+    )
+
+    seats = db.query(func.count(OrderSeat.id)).filter(OrderSeat.jadwal_id == jadwal_id).scalar()
+    carts = db.query(Cart).filter(Cart.jadwal_id == jadwal_id).delete(synchronize_session=False)
+    db.query(JadwalOccupancy).filter(JadwalOccupancy.jadwal_id == jadwal_id).delete(synchronize_session=False)
+    db.query(Jadwal).filter(Jadwal.id == jadwal_id).update(
+        {Jadwal.cancelled_at: datetime.datetime.now()}, synchronize_session=False
+    )
+    db.commit()
+
+    now_playing_cache.invalidate()
+    seat_states.invalidate(jadwal_id)
+    gate_rosters.invalidate(jadwal_code)
+    for code in order_codes:
+        order_cache.invalidate(code)
+
+    return {
+        "jadwal_code": jadwal_code,
+        "order_direfund": refunded,
+        "order_dibatalkan": updated - refunded,
+        "total_refund": int(total_refund),
+        "kursi_dilepas": seats,
+        "cart_dihapus": carts
+    }
+
+
+def cancel_schedule_in_background(bind, jadwal_id: int):
+    """Versi BackgroundTasks: session sendiri di bind yang sama dengan request."""
+    db = Session(bind=bind)
+    try:
+        jadwal = db.query(Jadwal).filter(Jadwal.id == jadwal_id, Jadwal.cancelled_at.is_(None)).first()
+        if jadwal is None:
+            return
+        result = cancel_schedule(db, jadwal)
+        logger.info("Pembatalan jadwal %s selesai: %s", result["jadwal_code"], result)
+    except Exception:
+        db.rollback()
+        logger.exception("Gagal membatalkan jadwal id %s", jadwal_id)
+    finally:
+        db.close()
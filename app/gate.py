@@ -0,0 +1,83 @@
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models import Jadwal, Order, OrderSeat
+from app.payments import ORDER_LUNAS
+
+
+class GateRoster:
+    """
+    Daftar tiket valid (order lunas) satu jadwal untuk validasi O(1) di pintu
+    studio: kode order -> (order id, kursi), plus kode yang sudah check-in.
+    """
+
+    def __init__(self, jadwal_id: int, jadwal_code: str):
+        self.jadwal_id = jadwal_id
+        self.jadwal_code = jadwal_code
+        self.orders: Dict[str, Tuple[int, List[str]]] = {}
+        self.checked_in: Dict[str, datetime] = {}
+        self.loaded_at = datetime.now()
+
+    def add(self, order_id: int, code: str, seats: List[str], checked_in_at: Optional[datetime]):
+        self.orders[code] = (order_id, seats)
+        if checked_in_at is not None:
+            self.checked_in[code] = checked_in_at
+
+
+def load_roster(db: Session, jadwal: Jadwal) -> GateRoster:
+    """Satu query join orders + order_seats untuk semua order lunas jadwal ini."""
+    roster = GateRoster(jadwal.id, jadwal.code)
+    rows = (
+        db.query(Order.id, Order.code, Order.checked_in_at, OrderSeat.row, OrderSeat.col)
+        .outerjoin(OrderSeat, OrderSeat.order_id == Order.id)
+        .filter(Order.jadwal_id == jadwal.id, ORDER_LUNAS)
+        .order_by(Order.id, OrderSeat.row, OrderSeat.col)
+        .all()
+    )
+    for order_id, code, checked_in_at, row, col in rows:
+        if code not in roster.orders:
+            roster.add(order_id, code, [], checked_in_at)
+        if row is not None:
+            roster.orders[code][1].append(f"{row}-{col}")
+    return roster
+
+
+class GateRosterCache:
+    """Roster per jadwal, dimuat sekali (preload) lalu dipakai semua scan."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._by_code: Dict[str, GateRoster] = {}
+
+    def lookup(self, jadwal_code: str) -> Optional[GateRoster]:
+        with self.lock:
+            return self._by_code.get(jadwal_code)
+
+    def load(self, db: Session, jadwal: Jadwal) -> GateRoster:
+        roster = load_roster(db, jadwal)
+        with self.lock:
+            self._by_code[jadwal.code] = roster
+        return roster
+
+    def get(self, db: Session, jadwal_code: str) -> Optional[GateRoster]:
+        roster = self.lookup(jadwal_code)
+        if roster is not None:
+            return roster
+        jadwal = db.query(Jadwal).filter(Jadwal.code == jadwal_code, Jadwal.cancelled_at.is_(None)).first()
+        if jadwal is None:
+            return None
+        return self.load(db, jadwal)
+
+    def invalidate(self, jadwal_code: str):
+        with self.lock:
+            self._by_code.pop(jadwal_code, None)
+
+    def clear(self):
+        with self.lock:
+            self._by_code.clear()
+
+
+gate_rosters = GateRosterCache()
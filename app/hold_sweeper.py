@@ -0,0 +1,78 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import distinct
+from sqlalchemy.orm import Session
+
+from app.holds import SWEEP_INTERVAL_SECONDS, hold_metrics
+from app.models import Cart
+from app.occupancy import bump_occupancy
+from app.seat_state import seat_states
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_expired_holds(db: Session, now: Optional[datetime] = None) -> int:
+    """
+    Hapus semua item cart yang sudah kedaluwarsa, satu DELETE per jadwal
+    (memakai index expires_at), sekalian mengurangi counter held.
+    Mengembalikan jumlah baris yang dihapus.
+    """
+    now = now or datetime.now()
+    jadwal_ids = [
+        jid for (jid,) in
+        db.query(distinct(Cart.jadwal_id)).filter(Cart.expires_at <= now)
+    ]
+
+    total = 0
+    for jadwal_id in jadwal_ids:
+        deleted = (
+            db.query(Cart)
+            .filter(Cart.jadwal_id == jadwal_id, Cart.expires_at <= now)
+            .delete(synchronize_session=False)
+        )
+        if deleted:
+            bump_occupancy(db, jadwal_id, held=-deleted)
+            total += deleted
+    db.commit()
+
+    for jadwal_id in jadwal_ids:
+        seat_states.expire(jadwal_id, now)
+    hold_metrics.add("expired", total)
+    return total
+
+
+class HoldSweeper:
+    """Thread latar yang menjalankan sweep_expired_holds secara berkala."""
+
+    def __init__(self, session_factory, interval: int = SWEEP_INTERVAL_SECONDS):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="hold-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            db = self.session_factory()
+            try:
+                sweep_expired_holds(db)
+            except Exception:
+                db.rollback()
+                logger.exception("Gagal menghapus hold kursi yang kedaluwarsa")
+            finally:
+                db.close()
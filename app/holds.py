@@ -0,0 +1,43 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import or_
+
+from app.models import Cart
+
+HOLD_MINUTES = int(os.getenv("CART_HOLD_MINUTES", "15"))
+SWEEP_INTERVAL_SECONDS = int(os.getenv("CART_SWEEP_SECONDS", "30"))
+
+
+def hold_expiry(now: Optional[datetime] = None) -> datetime:
+    """Waktu kedaluwarsa hold kursi baru (tanpa mikrodetik, sama seperti DATETIME MySQL)."""
+    now = now or datetime.now()
+    return (now + timedelta(minutes=HOLD_MINUTES)).replace(microsecond=0)
+
+
+def active_hold(now: datetime):
+    """Filter item cart yang belum kedaluwarsa. expires_at NULL = data lama, tetap aktif."""
+    return or_(Cart.expires_at.is_(None), Cart.expires_at > now)
+
+
+def is_expired(item: Cart, now: datetime) -> bool:
+    return item.expires_at is not None and item.expires_at <= now
+
+
+class HoldMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"created": 0, "released": 0, "expired": 0, "converted": 0}
+
+    def add(self, key: str, n: int = 1):
+        with self._lock:
+            self.counts[key] += n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+hold_metrics = HoldMetrics()
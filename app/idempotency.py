@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+
+
+class IdempotencyEntry:
+    """Satu request ber-Idempotency-Key: sedang diproses atau sudah punya hasil."""
+
+    def __init__(self, fingerprint: Any, expires_at: float):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.done = threading.Event()
+        self.status_code: Optional[int] = None
+        self.body: Any = None
+        self.abandoned = False
+
+
+class IdempotencyStore:
+    """
+    Store in-process untuk hasil request ber-Idempotency-Key dengan TTL.
+
+    Request pertama untuk suatu key menjadi pemilik entry dan menjalankan
+    logikanya; duplikat yang datang bersamaan menunggu event entry tersebut
+    lalu memakai hasil yang sama, tanpa menyentuh DB lagi.
+    """
+
+    def __init__(self, ttl: int = IDEMPOTENCY_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, IdempotencyEntry]" = OrderedDict()
+
+    def _purge(self, now: float):
+        # Entry terurut menurut expires_at (TTL sama untuk semua key).
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now or not entry.done.is_set():
+                break
+            del self._entries[key]
+
+    def begin(self, key: tuple, fingerprint: Any) -> tuple[IdempotencyEntry, bool]:
+        """Ambil entry untuk key. Nilai kedua True kalau pemanggil adalah pemiliknya."""
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            entry = self._entries.get(key)
+            if entry is not None and (entry.abandoned or (entry.done.is_set() and entry.expires_at <= now)):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                return entry, False
+            entry = IdempotencyEntry(fingerprint, now + self.ttl)
+            self._entries[key] = entry
+            return entry, True
+
+    def complete(self, key: tuple, entry: IdempotencyEntry, status_code: int, body: Any):
+        with self._lock:
+            entry.status_code = status_code
+            entry.body = body
+            entry.expires_at = time.monotonic() + self.ttl
+            if self._entries.get(key) is entry:
+                self._entries.move_to_end(key)
+        entry.done.set()
+
+    def abandon(self, key: tuple, entry: IdempotencyEntry):
+        """Request gagal tanpa hasil yang layak disimpan: key boleh dicoba lagi."""
+        with self._lock:
+            entry.abandoned = True
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+checkout_idempotency = IdempotencyStore()
@@ -1,11 +1,28 @@
 
 # app/main.py
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.routers import admin_film, admin_jadwal, user_catalog, user_transaction, analisis
-from app.database import engine, Base
+from app.routers import admin_film, admin_jadwal, admin_promo, user_catalog, user_transaction, analisis, gate
+from app.database import engine, Base, SessionLocal
+from app.hold_sweeper import HoldSweeper
+from app.payments import payment_processor
+from app.order_code import start_order_codes, stop_order_codes
 import app.models
 Base.metadata.create_all(bind=engine)
 
+hold_sweeper = HoldSweeper(SessionLocal)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    hold_sweeper.start()
+    start_order_codes(engine)
+    payment_processor.resume_pending(SessionLocal)
+    yield
+    hold_sweeper.stop()
+    payment_processor.shutdown()
+    stop_order_codes()
+
 app = FastAPI(
     title="Movie Booking System",
     description="""Sistem ini menyediakan serangkaian endpoint untuk mengelola seluruh alur pemesanan tiket bioskop secara digital, dengan modul utama:
@@ -13,17 +30,22 @@ app = FastAPI(
      **User**: Melihat katalog film, memesan tiket, dan melihat riwayat transaksi.
      Serta terdapat modul analisis untuk menganalisis keseluruhan Movie Booking System melalui database yang tersedia.
      """,
-    version="2.1.0"
+    version="2.1.0",
+    lifespan=lifespan
 )
 
 # Admin
 app.include_router(admin_film.router,  tags=["Admin - Film, Studio, dan Memberships"])
 app.include_router(admin_jadwal.router, tags=["Admin - Jadwal"])
+app.include_router(admin_promo.router, tags=["Admin - Promo"])
 
 # User
 app.include_router(user_catalog.router,     tags=["User - Katalog"])           
 app.include_router(user_transaction.router, tags=["User - Cart & Checkout"])
 
+# Pintu studio
+app.include_router(gate.router, tags=["Gate - Check-in"])
+
 # Analisis
 app.include_router(analisis.router, tags=["Analisis Data"])
 
@@ -0,0 +1,74 @@
+"""
+Migrasi skema untuk database yang dibuat sebelum kolom/tabel baru ada.
+
+Base.metadata.create_all hanya membuat tabel yang belum ada; kolom dan
+index baru di tabel lama tidak ikut ditambahkan. Script ini membandingkan
+app.models dengan skema database lalu menambahkan yang kurang (ALTER TABLE
+ADD COLUMN / CREATE INDEX), membuat tabel baru, dan mengisi counter
+jadwal_occupancy kalau masih kosong. Aman dijalankan berulang.
+
+Jalankan sekali sebelum proses API versi baru di-start:
+
+    python -m app.migrate
+"""
+from typing import List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+from app.database import Base, engine
+from app.models import Jadwal, JadwalOccupancy
+from app.occupancy import reconcile_occupancy
+
+
+def migrate(bind: Engine) -> List[str]:
+    """Tambahkan tabel, kolom, dan index yang belum ada. Mengembalikan DDL yang dijalankan."""
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    preparer = bind.dialect.identifier_preparer
+    statements = []
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                ddl = CreateColumn(column).compile(dialect=bind.dialect)
+                statements.append(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}")
+        indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                statements.append(str(CreateIndex(index).compile(dialect=bind.dialect)))
+
+    with bind.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+
+    new_tables = [t.name for t in Base.metadata.sorted_tables if t.name not in existing_tables]
+    Base.metadata.create_all(bind=bind)
+    statements += [f"CREATE TABLE {name}" for name in new_tables]
+
+    # Counter okupansi kosong (tabel baru, atau sudah dibuat create_all saat
+    # start) padahal jadwal sudah ada: hitung dari order_seats & carts.
+    db = Session(bind=bind)
+    try:
+        if db.query(JadwalOccupancy.jadwal_id).first() is None and db.query(Jadwal.id).first() is not None:
+            reconcile_occupancy(db)
+            statements.append("reconcile jadwal_occupancy")
+    finally:
+        db.close()
+    return statements
+
+
+def main():
+    statements = migrate(engine)
+    for statement in statements:
+        print(statement)
+    print("Skema sudah terbaru." if not statements else f"\nDONE: {len(statements)} perubahan skema")
+
+
+if __name__ == "__main__":
+    main()
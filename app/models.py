@@ -1,6 +1,6 @@
 from sqlalchemy import (
-    ForeignKey, create_engine, Column, Integer, String, Date, Time,
-    UniqueConstraint, text
+    ForeignKey, create_engine, Column, Integer, String, Date, Time, DateTime,
+    Boolean, UniqueConstraint, Index, text
 )
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from faker import Faker
@@ -73,6 +73,9 @@ class Jadwal(Base):
     studio_code = Column(String(20))
     tanggal = Column(Date)
     jam = Column(Time)
+    # Jadwal yang dibatalkan tidak dihapus (order & kursinya tetap jadi jejak refund).
+    cancelled_at = Column(DateTime)
+    __table_args__ = (Index("ix_jadwal_tanggal_jam", "tanggal", "jam"),)
 
 
 class Order(Base):
@@ -93,6 +96,15 @@ class Order(Base):
     change = Column(Integer)
     transaction_date = Column(Date)
     hari = Column(String(10))
+    # PENDING -> PAID / FAILED. Order CASH dan data lama langsung PAID.
+    status = Column(String(10), default="PAID", server_default="PAID")
+    payment_ref = Column(String(64))
+    # Lease worker pembayaran yang sedang memproses order PENDING ini.
+    payment_lease_until = Column(DateTime)
+    checked_in_at = Column(DateTime)
+    refund_amount = Column(Integer)
+    # Riwayat order per member (keyset pagination pada id).
+    __table_args__ = (Index("ix_orders_membership_id_id", "membership_id", "id"),)
 
 
 class OrderSeat(Base):
@@ -119,10 +131,54 @@ class Cart(Base):
     row = Column(String(3))
     col = Column(Integer)
     price = Column(Integer)    
+    expires_at = Column(DateTime, index=True)
     
     __table_args__ = (UniqueConstraint("membership_id", "jadwal_id", "row", "col"),)
 
 
+class JadwalOccupancy(Base):
+    __tablename__ = "jadwal_occupancy"
+    jadwal_id = Column(Integer, primary_key=True)
+    sold = Column(Integer, default=0, nullable=False)
+    held = Column(Integer, default=0, nullable=False)
+    # Naik setiap kali kursi jadwal ini berubah (lihat bump_occupancy); dipakai
+    # proses lain untuk tahu SeatState di cache-nya sudah basi.
+    version = Column(Integer, default=0, nullable=False)
+
+
+class OrderWorker(Base):
+    """Slot worker id generator kode order yang sedang dipinjam proses (lihat app.order_code)."""
+    __tablename__ = "order_workers"
+    worker_id = Column(Integer, primary_key=True, autoincrement=False)
+    owner = Column(String(100))
+    lease_until = Column(DateTime)
+
+
+class PromoRule(Base):
+    """
+    Aturan promo deklaratif. Kolom kondisi yang NULL berarti "semua";
+    kalau beberapa aturan cocok, priority tertinggi yang dipakai.
+    Tanggal/hari dicocokkan dengan tanggal tayang jadwal.
+    """
+    __tablename__ = "promo_rules"
+    id = Column(Integer, primary_key=True)
+    code = Column(String(30), unique=True)
+    name = Column(String(100))
+    discount = Column(Integer)
+    priority = Column(Integer, default=0)
+    min_seats = Column(Integer)
+    tanggal = Column(Date)
+    day_of_month = Column(Integer)
+    weekdays = Column(String(20))          # "5,6" = Sabtu & Minggu (Senin = 0)
+    membership_codes = Column(String(255)) # "MEM001,MEM002"
+    movie_codes = Column(String(255))      # "MOV001,MOV003"
+    active = Column(Boolean, default=True)
+    # Naik otomatis di setiap UPDATE lewat ORM; dipakai engine promo di
+    # worker lain untuk tahu aturan sudah berubah.
+    revision = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": revision}
+
+
 def price(dur):
     if dur >= 180:
         return 50000
@@ -223,6 +279,12 @@ def main():
                 j += 1
     db.commit()
 
+    print("Generating Promo Rules...")
+    from app.promo import SEED_RULES, compile_rules, ensure_default_rules
+    ensure_default_rules(db)
+    db.commit()
+    promos = compile_rules(db, SEED_RULES)
+
     print("Generating Orders...")
     methods = ["QRIS", "Debit", "Gopay", "ShopeePay", "CASH"]
     hari_map = {0: "Senin", 1: "Selasa", 2: "Rabu", 3: "Kamis", 4: "Jumat", 5: "Sabtu", 6: "Minggu"}
@@ -253,14 +315,7 @@ def main():
 
         if not seats: continue
 
-        promo = "NO PROMO"
-        disc = 0
-        if jd.tanggal.day == 12:
-            promo = "SUPER 12.12"
-            disc = 30
-        elif len(seats) >= 5:
-            promo = "BULK 5+"
-            disc = 20
+        promo, disc = promos.evaluate(len(seats), jd.tanggal, mem.code, jd.movie_id)
 
         tot = mv.price * len(seats)
         fin = tot - int(tot * disc / 100)
@@ -305,6 +360,10 @@ def main():
     progress.close()
     print("\nDONE:", done, "orders")
 
+    from app.occupancy import reconcile_occupancy
+    print("Menghitung counter okupansi...")
+    reconcile_occupancy(db)
+
 
 if __name__ == "__main__":
     main()
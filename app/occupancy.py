@@ -0,0 +1,117 @@
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import Cart, Jadwal, JadwalOccupancy, OrderSeat
+
+
+def _count_actual(db: Session, jadwal_ids=None) -> Dict[int, Tuple[int, int]]:
+    """Hitung (sold, held) langsung dari order_seats dan carts, per jadwal."""
+    sold_q = db.query(OrderSeat.jadwal_id, func.count(OrderSeat.id)).group_by(OrderSeat.jadwal_id)
+    held_q = db.query(Cart.jadwal_id, func.count(Cart.id)).group_by(Cart.jadwal_id)
+    if jadwal_ids is not None:
+        sold_q = sold_q.filter(OrderSeat.jadwal_id.in_(jadwal_ids))
+        held_q = held_q.filter(Cart.jadwal_id.in_(jadwal_ids))
+
+    actual: Dict[int, List[int]] = {}
+    for jid, n in sold_q:
+        actual.setdefault(jid, [0, 0])[0] = n
+    for jid, n in held_q:
+        actual.setdefault(jid, [0, 0])[1] = n
+    return {jid: (v[0], v[1]) for jid, v in actual.items()}
+
+
+def bump_occupancy(db: Session, jadwal_id: int, sold: int = 0, held: int = 0):
+    """
+    Ubah counter sold/held satu jadwal di dalam transaksi yang sedang
+    berjalan. Dipanggil sebelum db.commit() oleh endpoint cart/checkout.
+    Jika baris counter belum ada, nilainya diisi dari tabel sumber.
+    """
+    updated = (
+        db.query(JadwalOccupancy)
+        .filter(JadwalOccupancy.jadwal_id == jadwal_id)
+        .update(
+            {
+                JadwalOccupancy.sold: JadwalOccupancy.sold + sold,
+                JadwalOccupancy.held: JadwalOccupancy.held + held,
+                JadwalOccupancy.version: JadwalOccupancy.version + 1,
+            },
+            synchronize_session=False,
+        )
+    )
+    if updated:
+        return
+
+    db.flush()
+    actual_sold, actual_held = _count_actual(db, [jadwal_id]).get(jadwal_id, (0, 0))
+    try:
+        with db.begin_nested():
+            db.add(JadwalOccupancy(jadwal_id=jadwal_id, sold=actual_sold, held=actual_held, version=1))
+    except IntegrityError:
+        # Request lain baru saja membuat barisnya.
+        bump_occupancy(db, jadwal_id, sold, held)
+
+
+def occupancy_versions(db: Session, jadwal_ids: List[int]) -> Dict[int, int]:
+    """Versi counter per jadwal (0 kalau barisnya belum ada)."""
+    versions = {jid: 0 for jid in jadwal_ids}
+    rows = db.query(JadwalOccupancy.jadwal_id, JadwalOccupancy.version).filter(
+        JadwalOccupancy.jadwal_id.in_(jadwal_ids)
+    )
+    for jid, version in rows:
+        versions[jid] = version or 0
+    return versions
+
+
+def reconcile_occupancy(db: Session, fix: bool = True) -> dict:
+    """
+    Hitung ulang semua counter dari order_seats & carts secara bulk dan
+    laporkan selisihnya. Jika fix=True, counter yang meleset diperbaiki.
+    """
+    actual = _count_actual(db)
+    # Jadwal yang dibatalkan tidak punya counter lagi (kursinya sudah direfund).
+    jadwal_ids = [jid for (jid,) in db.query(Jadwal.id).filter(Jadwal.cancelled_at.is_(None))]
+    counters = {
+        c.jadwal_id: (c.sold, c.held)
+        for c in db.query(JadwalOccupancy.jadwal_id, JadwalOccupancy.sold, JadwalOccupancy.held)
+    }
+
+    drift = []
+    to_update = []
+    to_insert = []
+    for jid in jadwal_ids:
+        real = actual.get(jid, (0, 0))
+        stored = counters.get(jid)
+        if stored == real:
+            continue
+        drift.append({
+            "jadwal_id": jid,
+            "sold_counter": stored[0] if stored else None,
+            "sold_actual": real[0],
+            "held_counter": stored[1] if stored else None,
+            "held_actual": real[1],
+        })
+        row = {"jadwal_id": jid, "sold": real[0], "held": real[1]}
+        (to_update if stored else to_insert).append(row)
+
+    existing = set(jadwal_ids)
+    orphans = [jid for jid in counters if jid not in existing]
+
+    if fix:
+        if to_update:
+            db.bulk_update_mappings(JadwalOccupancy, to_update)
+        if to_insert:
+            db.bulk_insert_mappings(JadwalOccupancy, to_insert)
+        if orphans:
+            db.query(JadwalOccupancy).filter(JadwalOccupancy.jadwal_id.in_(orphans)).delete(synchronize_session=False)
+        db.commit()
+
+    return {
+        "jadwal_diperiksa": len(jadwal_ids),
+        "jumlah_drift": len(drift),
+        "counter_yatim": len(orphans),
+        "diperbaiki": fix,
+        "drift": drift,
+    }
@@ -0,0 +1,266 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import OrderWorker
+
+logger = logging.getLogger(__name__)
+
+# Layout 64 bit: [42 bit milidetik sejak EPOCH][10 bit worker][12 bit sequence]
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+
+ORDER_WORKER_LEASE_SECONDS = int(os.getenv("ORDER_WORKER_LEASE_SECONDS", "300"))
+
+PREFIX = "ORD-"
+CODE_WIDTH = 13  # 13 x 5 bit = 65 bit, cukup untuk 64 bit id
+
+# Crockford base32: urutan karakternya sama dengan urutan ASCII, jadi kode
+# dengan lebar tetap bisa diurutkan sebagai string sesuai waktu pembuatan.
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_PAIRS = [a + b for a in ALPHABET for b in ALPHABET]
+_DECODE = {c: i for i, c in enumerate(ALPHABET)}
+
+
+def encode_base32(value: int) -> str:
+    """Encode 64 bit id jadi 13 karakter Crockford base32 (lebar tetap)."""
+    return (
+        ALPHABET[value >> 60]
+        + _PAIRS[(value >> 50) & 0x3FF]
+        + _PAIRS[(value >> 40) & 0x3FF]
+        + _PAIRS[(value >> 30) & 0x3FF]
+        + _PAIRS[(value >> 20) & 0x3FF]
+        + _PAIRS[(value >> 10) & 0x3FF]
+        + _PAIRS[value & 0x3FF]
+    )
+
+
+def decode_base32(text: str) -> int:
+    value = 0
+    for c in text.upper():
+        value = (value << 5) | _DECODE[c]
+    return value
+
+
+def env_worker_id() -> Optional[int]:
+    """Worker id dari env ORDER_WORKER_ID, None kalau tidak di-set."""
+    raw = os.getenv("ORDER_WORKER_ID")
+    if raw is None:
+        return None
+    worker_id = int(raw)
+    if not 0 <= worker_id <= MAX_WORKER_ID:
+        raise ValueError(f"ORDER_WORKER_ID harus 0-{MAX_WORKER_ID}")
+    return worker_id
+
+
+class OrderCodeGenerator:
+    """
+    Generator kode order tanpa koordinasi (gaya snowflake): waktu + worker id
+    + sequence per milidetik. Unik antar proses selama tiap proses punya
+    worker id berbeda (dari ORDER_WORKER_ID atau WorkerLease).
+
+    Kalau sequence satu milidetik habis atau jam mundur, generator memakai
+    milidetik berikutnya alih-alih menunggu, sehingga id tetap naik monoton.
+    """
+
+    def __init__(self, worker_id: int, clock: Callable[[], float] = time.time):
+        self.worker_id = worker_id
+        if not 0 <= self.worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id harus 0-{MAX_WORKER_ID}")
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self) -> int:
+        now_ms = int(self._clock() * 1000) - EPOCH_MS
+        with self._lock:
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                self._sequence = (self._sequence + 1) & SEQUENCE_MASK
+                if self._sequence == 0:
+                    self._last_ms += 1
+            return (self._last_ms << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+    def next_code(self) -> str:
+        return PREFIX + encode_base32(self.next_id())
+
+
+def parse_order_code(code: str) -> dict:
+    """Pecah kode order buatan generator jadi waktu (ms epoch unix), worker, dan sequence."""
+    value = decode_base32(code[len(PREFIX):])
+    return {
+        "timestamp_ms": (value >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS,
+        "worker_id": (value >> SEQUENCE_BITS) & MAX_WORKER_ID,
+        "sequence": value & SEQUENCE_MASK,
+    }
+
+
+class WorkerLease:
+    """
+    Worker id unik yang dipinjam dari tabel order_workers.
+
+    pid tidak bisa dipakai sebagai worker id: pid bisa sama modulo 1024 dan
+    di container semua proses biasanya pid 1. Setiap proses meng-klaim satu
+    slot (insert, atau ambil alih slot yang lease-nya sudah habis), lalu
+    thread latar memperpanjang lease setiap lease/3 detik. Kalau perpanjangan
+    gagal (slot sudah diambil proses lain), lease ditandai hilang dan kode
+    order berikutnya meng-klaim slot baru.
+    """
+
+    def __init__(self, bind, lease_seconds: int = ORDER_WORKER_LEASE_SECONDS):
+        self.bind = bind
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.worker_id: Optional[int] = None
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def claim(self) -> int:
+        db = Session(bind=self.bind)
+        try:
+            now = datetime.now()
+            leases = dict(db.query(OrderWorker.worker_id, OrderWorker.lease_until))
+            # Slot proses yang sudah mati dipakai ulang dulu supaya id tetap kecil.
+            stale = [w for w, until in sorted(leases.items()) if until is None or until < now]
+            free = [w for w in range(MAX_WORKER_ID + 1) if w not in leases]
+            for worker_id in stale + free:
+                if self._try_claim(db, worker_id, worker_id in leases, now):
+                    self.worker_id = worker_id
+                    self._start_renewal()
+                    return worker_id
+        finally:
+            db.close()
+        raise RuntimeError(f"Semua {MAX_WORKER_ID + 1} worker id kode order sedang dipakai")
+
+    def _try_claim(self, db: Session, worker_id: int, exists: bool, now: datetime) -> bool:
+        until = now + timedelta(seconds=self.lease_seconds)
+        if exists:
+            taken = db.execute(
+                update(OrderWorker)
+                .where(OrderWorker.worker_id == worker_id)
+                .where(or_(OrderWorker.lease_until.is_(None), OrderWorker.lease_until < now))
+                .values(owner=self.owner, lease_until=until)
+            ).rowcount
+            db.commit()
+            return taken == 1
+        try:
+            db.add(OrderWorker(worker_id=worker_id, owner=self.owner, lease_until=until))
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+
+    def renew(self) -> bool:
+        """Perpanjang lease. False kalau slot sudah bukan milik proses ini."""
+        db = Session(bind=self.bind)
+        try:
+            renewed = db.execute(
+                update(OrderWorker)
+                .where(OrderWorker.worker_id == self.worker_id, OrderWorker.owner == self.owner)
+                .values(lease_until=datetime.now() + timedelta(seconds=self.lease_seconds))
+            ).rowcount
+            db.commit()
+        finally:
+            db.close()
+        if renewed != 1:
+            self.lost = True
+        return not self.lost
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self.worker_id is None:
+            return
+        db = Session(bind=self.bind)
+        try:
+            db.query(OrderWorker).filter(
+                OrderWorker.worker_id == self.worker_id, OrderWorker.owner == self.owner
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _start_renewal(self):
+        self._thread = threading.Thread(target=self._run, name="order-worker-lease", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                if not self.renew():
+                    logger.error("Lease worker id %s kode order hilang, klaim ulang", self.worker_id)
+                    return
+            except Exception:
+                logger.exception("Gagal memperpanjang lease worker id %s", self.worker_id)
+
+
+_init_lock = threading.Lock()
+_generator: Optional[OrderCodeGenerator] = None
+_lease: Optional[WorkerLease] = None
+
+
+def start_order_codes(bind) -> OrderCodeGenerator:
+    """
+    Siapkan generator proses ini: ORDER_WORKER_ID kalau di-set (harus unik
+    per proses), selain itu pinjam worker id dari tabel order_workers.
+    """
+    global _generator, _lease
+    with _init_lock:
+        if _generator is not None and (_lease is None or not _lease.lost):
+            return _generator
+        worker_id = env_worker_id()
+        if worker_id is None:
+            if _lease is not None:
+                _lease.release()
+            _lease = WorkerLease(bind)
+            worker_id = _lease.claim()
+        _generator = OrderCodeGenerator(worker_id)
+        return _generator
+
+
+def stop_order_codes():
+    global _generator, _lease
+    with _init_lock:
+        if _lease is not None:
+            _lease.release()
+        _generator = None
+        _lease = None
+
+
+def _reset_after_fork():
+    # Proses hasil fork tidak boleh memakai worker id induknya; klaim ulang
+    # saat kode order pertama dibuat.
+    global _generator, _lease, _init_lock
+    _init_lock = threading.Lock()
+    _generator = None
+    _lease = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def new_order_code(bind) -> str:
+    generator = _generator
+    if generator is None or (_lease is not None and _lease.lost):
+        generator = start_order_codes(bind)
+    return generator.next_code()
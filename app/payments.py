@@ -0,0 +1,235 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import NamedTuple, Optional, Protocol, Set
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from app.cache import order_cache
+from app.models import Order, OrderSeat
+from app.occupancy import bump_occupancy
+from app.seat_state import seat_states
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", "4"))
+PAYMENT_SIM_LATENCY = float(os.getenv("PAYMENT_SIM_LATENCY", "0.5"))
+PAYMENT_SIM_FAILURE_RATE = float(os.getenv("PAYMENT_SIM_FAILURE_RATE", "0"))
+# Harus jauh di atas lama charge() gateway: selama lease berlaku, worker
+# (proses) lain tidak akan men-charge order yang sama.
+PAYMENT_LEASE_SECONDS = float(os.getenv("PAYMENT_LEASE_SECONDS", "300"))
+
+PENDING = "PENDING"
+PAID = "PAID"
+FAILED = "FAILED"
+
+# Order yang dianggap lunas. NULL = order lama sebelum ada kolom status.
+ORDER_LUNAS = or_(Order.status.is_(None), Order.status == PAID)
+
+
+class PaymentResult(NamedTuple):
+    ok: bool
+    reference: Optional[str] = None
+    reason: Optional[str] = None
+
+
+class PaymentGateway(Protocol):
+    """Client payment gateway. charge() boleh lambat; dipanggil di luar transaksi DB."""
+
+    def charge(self, order_code: str, amount: int, method: str) -> PaymentResult:
+        ...
+
+
+class SimulatedGateway:
+    """Pengganti gateway untuk lokal/test: latency dan tingkat gagal bisa diatur."""
+
+    def __init__(self, latency: float = PAYMENT_SIM_LATENCY,
+                 failure_rate: float = PAYMENT_SIM_FAILURE_RATE,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def charge(self, order_code: str, amount: int, method: str) -> PaymentResult:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._lock:
+            failed = self._rng.random() < self.failure_rate
+        if failed:
+            return PaymentResult(False, reason=f"Pembayaran {method} ditolak (simulasi)")
+        return PaymentResult(True, reference="SIM-" + uuid.uuid4().hex[:12].upper())
+
+
+def lease_free(now: datetime):
+    """Order PENDING yang tidak sedang diproses worker mana pun."""
+    return or_(Order.payment_lease_until.is_(None), Order.payment_lease_until < now)
+
+
+def claim_payment(db: Session, order_id: int, lease_seconds: float = PAYMENT_LEASE_SECONDS) -> bool:
+    """
+    Ambil lease pembayaran order dengan UPDATE bersyarat. Hanya satu
+    pemanggil (di proses mana pun) yang mendapat True, jadi gateway tidak
+    di-charge dua kali untuk order yang sama.
+    """
+    now = datetime.now()
+    result = db.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == PENDING, lease_free(now))
+        .values(payment_lease_until=now + timedelta(seconds=lease_seconds))
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def mark_paid(db: Session, order_id: int, order_code: str, reference: Optional[str]) -> bool:
+    """PENDING -> PAID. False kalau order sudah tidak PENDING."""
+    result = db.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == PENDING)
+        .values(status=PAID, payment_ref=reference)
+    )
+    db.commit()
+    order_cache.invalidate(order_code)
+    return result.rowcount == 1
+
+
+def mark_failed(db: Session, order_id: int, order_code: str) -> bool:
+    """
+    PENDING -> FAILED dan lepaskan kursinya (order_seats, counter okupansi,
+    dan seat state). UPDATE bersyarat memastikan hanya satu pemanggil yang
+    melepas kursi walaupun ada beberapa worker.
+    """
+    result = db.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == PENDING)
+        .values(status=FAILED)
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        return False
+
+    seats = db.query(OrderSeat.jadwal_id, OrderSeat.row, OrderSeat.col).filter(OrderSeat.order_id == order_id).all()
+    db.query(OrderSeat).filter(OrderSeat.order_id == order_id).delete(synchronize_session=False)
+
+    per_jadwal = {}
+    for jadwal_id, _, _ in seats:
+        per_jadwal[jadwal_id] = per_jadwal.get(jadwal_id, 0) + 1
+    for jadwal_id, n in per_jadwal.items():
+        bump_occupancy(db, jadwal_id, sold=-n)
+    db.commit()
+
+    order_cache.invalidate(order_code)
+    for jadwal_id, row, col in seats:
+        seat_states.mark_free(jadwal_id, row, col)
+    return True
+
+
+class PaymentProcessor:
+    """
+    Pool worker pembayaran. Checkout hanya membuat order PENDING lalu
+    memanggil submit(); worker mengambil lease order (claim_payment),
+    memanggil gateway tanpa memegang transaksi, kemudian memindahkan order
+    ke PAID atau FAILED. Order yang lease-nya dipegang worker lain dilewati.
+    """
+
+    def __init__(self, gateway: PaymentGateway, workers: int = PAYMENT_WORKERS):
+        self.gateway = gateway
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._inflight: Set[Future] = set()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="payment")
+            return self._executor
+
+    def submit(self, bind, order_id: int) -> Future:
+        """Proses pembayaran order di background memakai engine/connection `bind`."""
+        future = self._pool().submit(self._process, bind, order_id)
+        with self._lock:
+            self._inflight.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._inflight.discard(future)
+
+    def _process(self, bind, order_id: int):
+        db = Session(bind=bind)
+        try:
+            if not claim_payment(db, order_id):
+                return
+            order = (
+                db.query(Order.code, Order.final_price, Order.payment_method)
+                .filter(Order.id == order_id)
+                .first()
+            )
+            db.commit()
+
+            try:
+                result = self.gateway.charge(order.code, order.final_price, order.payment_method)
+            except Exception:
+                logger.exception("Gateway error untuk order %s", order.code)
+                result = PaymentResult(False, reason="Gateway error")
+
+            if result.ok:
+                if not mark_paid(db, order_id, order.code, result.reference):
+                    # Mis. jadwal dibatalkan saat gateway sedang diproses.
+                    logger.warning("Order %s sudah tidak PENDING setelah dibayar (ref %s), perlu refund manual",
+                                   order.code, result.reference)
+            else:
+                mark_failed(db, order_id, order.code)
+        except Exception:
+            db.rollback()
+            logger.exception("Gagal memproses pembayaran order id %s", order_id)
+        finally:
+            db.close()
+
+    def resume_pending(self, session_factory) -> int:
+        """
+        Antrekan ulang order PENDING yang tertinggal (mis. setelah restart).
+        Dipanggil oleh setiap proses; order yang sedang diproses worker lain
+        (lease masih berlaku) tidak diambil, dan claim_payment menyaring sisanya.
+        """
+        db = session_factory()
+        try:
+            ids = [
+                oid for (oid,) in
+                db.query(Order.id).filter(Order.status == PENDING, lease_free(datetime.now()))
+            ]
+            bind = db.get_bind()
+        finally:
+            db.close()
+        for order_id in ids:
+            self.submit(bind, order_id)
+        return len(ids)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        with self._lock:
+            pending = list(self._inflight)
+        _, not_done = wait(pending, timeout=timeout)
+        return not not_done
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+payment_processor = PaymentProcessor(SimulatedGateway())
+
+
+def set_gateway(gateway: PaymentGateway):
+    """Ganti client gateway (mis. gateway asli di production, atau stub di test)."""
+    payment_processor.gateway = gateway
@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import Jadwal, Movie, Order, PromoRule
+
+NO_PROMO = ("NO PROMO", 0)
+
+PROMO_RULES_CHECK_SECONDS = float(os.getenv("PROMO_RULES_CHECK_SECONDS", "5"))
+
+# Dipakai selama tabel promo_rules masih kosong: sama dengan promo checkout
+# sebelum ada tabel promo_rules (hanya BULK 5+).
+DEFAULT_RULES = [
+    {"code": "BULK5", "name": "BULK 5+", "discount": 20, "priority": 10, "min_seats": 5},
+]
+
+# Seeder memberi harga order contoh dengan SUPER 12.12 juga. Aturan ini
+# tidak ikut disimpan ke promo_rules, jadi tidak berlaku di checkout.
+SEED_RULES = DEFAULT_RULES + [
+    {"code": "SUPER1212", "name": "SUPER 12.12", "discount": 30, "priority": 20, "day_of_month": 12},
+]
+
+RULE_FIELDS = [
+    "code", "name", "discount", "priority", "min_seats", "tanggal",
+    "day_of_month", "weekdays", "membership_codes", "movie_codes", "active",
+]
+
+
+def split_list(value: Optional[str]) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()] if value else []
+
+
+def rule_order(rule: dict) -> tuple:
+    """Urutan evaluasi: priority tertinggi dulu, seri diurutkan per kode (atau nama kalau tanpa kode)."""
+    return (-(rule.get("priority") or 0), rule.get("code") or rule["name"])
+
+
+def validate_rule(item):
+    """Validasi aturan promo (PromoRuleInput atau aturan skenario simulasi)."""
+    if not 0 < item.discount <= 100:
+        raise HTTPException(400, "Diskon harus 1-100 persen")
+    if item.day_of_month is not None and not 1 <= item.day_of_month <= 31:
+        raise HTTPException(400, "day_of_month harus 1-31")
+    if any(not wd.isdigit() or int(wd) > 6 for wd in split_list(item.weekdays)):
+        raise HTTPException(400, "weekdays berisi angka 0-6 dipisah koma (Senin = 0)")
+
+
+def rule_fields(rule: PromoRule) -> dict:
+    return {f: getattr(rule, f) for f in RULE_FIELDS}
+
+
+def rule_to_dict(rule: PromoRule) -> dict:
+    data = rule_fields(rule)
+    if data["tanggal"] is not None:
+        data["tanggal"] = data["tanggal"].isoformat()
+    return data
+
+
+class CompiledPromos:
+    """
+    Aturan promo yang sudah dikompilasi jadi bitmask per dimensi.
+
+    Bit ke-i mewakili aturan ke-i (urut priority tertinggi dulu). Evaluasi
+    satu cart = beberapa lookup dict + AND bitmask, lalu ambil bit terendah,
+    jadi biayanya tetap berapa pun banyaknya cart / order yang dievaluasi.
+    """
+
+    def __init__(self, rules: List[dict], movie_ids: Dict[str, int]):
+        rules = sorted(rules, key=rule_order)
+        self.rules: List[Tuple[str, int]] = [(r["name"], r["discount"]) for r in rules]
+        self.codes = [r["code"] for r in rules]
+
+        self.any_date = self.any_dom = self.any_weekday = self.any_member = self.any_movie = 0
+        self.by_date: Dict[date, int] = {}
+        self.by_dom: Dict[int, int] = {}
+        self.by_weekday: Dict[int, int] = {}
+        self.by_member: Dict[str, int] = {}
+        self.by_movie: Dict[int, int] = {}
+
+        thresholds = []
+        for i, r in enumerate(rules):
+            bit = 1 << i
+            tanggal = r.get("tanggal")
+            if tanggal is None:
+                self.any_date |= bit
+            else:
+                self.by_date[tanggal] = self.by_date.get(tanggal, 0) | bit
+
+            if r.get("day_of_month") is None:
+                self.any_dom |= bit
+            else:
+                self.by_dom[r["day_of_month"]] = self.by_dom.get(r["day_of_month"], 0) | bit
+
+            weekdays = split_list(r.get("weekdays"))
+            if not weekdays:
+                self.any_weekday |= bit
+            for wd in weekdays:
+                self.by_weekday[int(wd)] = self.by_weekday.get(int(wd), 0) | bit
+
+            members = split_list(r.get("membership_codes"))
+            if not members:
+                self.any_member |= bit
+            for code in members:
+                self.by_member[code] = self.by_member.get(code, 0) | bit
+
+            movies = split_list(r.get("movie_codes"))
+            if not movies:
+                self.any_movie |= bit
+            for code in movies:
+                # Kode film yang tidak dikenal membuat aturan tidak pernah cocok.
+                if code in movie_ids:
+                    self.by_movie[movie_ids[code]] = self.by_movie.get(movie_ids[code], 0) | bit
+
+            thresholds.append(r.get("min_seats") or 0)
+
+        # seat_masks[n] = aturan yang syarat jumlah kursinya terpenuhi oleh n kursi.
+        self.max_seats = max(thresholds, default=0)
+        self.seat_masks = [0] * (self.max_seats + 1)
+        for n in range(self.max_seats + 1):
+            for i, t in enumerate(thresholds):
+                if t <= n:
+                    self.seat_masks[n] |= 1 << i
+
+    def evaluate(self, seat_count: int, tanggal: Optional[date],
+                 membership_code: Optional[str], movie_id: Optional[int]) -> Tuple[str, int]:
+        """(nama promo, persen diskon) untuk satu cart/order."""
+        mask = self.seat_masks[min(seat_count, self.max_seats)] if self.seat_masks else 0
+        if tanggal is not None:
+            mask &= self.by_date.get(tanggal, 0) | self.any_date
+            mask &= self.by_dom.get(tanggal.day, 0) | self.any_dom
+            mask &= self.by_weekday.get(tanggal.weekday(), 0) | self.any_weekday
+        else:
+            mask &= self.any_date & self.any_dom & self.any_weekday
+        mask &= self.by_member.get(membership_code, 0) | self.any_member
+        mask &= self.by_movie.get(movie_id, 0) | self.any_movie
+        if not mask:
+            return NO_PROMO
+        return self.rules[(mask & -mask).bit_length() - 1]
+
+    def evaluate_many(self, items: Iterable[tuple]) -> List[Tuple[str, int]]:
+        """Evaluasi batch: items berisi (seat_count, tanggal, membership_code, movie_id)."""
+        evaluate = self.evaluate
+        return [evaluate(*item) for item in items]
+
+
+def compile_rules(db: Session, rules: List[dict]) -> CompiledPromos:
+    codes = {code for r in rules for code in split_list(r.get("movie_codes"))}
+    movie_ids = {}
+    if codes:
+        movie_ids = dict(db.query(Movie.code, Movie.id).filter(Movie.code.in_(codes)).all())
+    return CompiledPromos(rules, movie_ids)
+
+
+def rules_version(db: Session) -> Tuple[int, int]:
+    """(jumlah aturan, total revision): berubah setiap ada aturan ditambah/diubah."""
+    count, revisions = db.query(func.count(PromoRule.id), func.coalesce(func.sum(PromoRule.revision), 0)).one()
+    return int(count), int(revisions)
+
+
+class PromoEngine:
+    """
+    Aturan promo terkompilasi, dipakai ulang antar request.
+
+    invalidate() hanya sampai ke proses yang menangani perubahan admin, jadi
+    setiap check_interval detik engine membandingkan rules_version() dengan
+    versi yang dikompilasi dan mengompilasi ulang kalau berbeda. Worker lain
+    paling lama memakai aturan lama selama check_interval.
+    """
+
+    def __init__(self, check_interval: float = PROMO_RULES_CHECK_SECONDS):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._compiled: Optional[CompiledPromos] = None
+        self._version: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._generation = 0
+
+    def get(self, db: Session) -> CompiledPromos:
+        now = time.monotonic()
+        with self._lock:
+            if self._compiled is not None and now - self._checked_at < self.check_interval:
+                return self._compiled
+            generation = self._generation
+            compiled, version = self._compiled, self._version
+
+        current = rules_version(db)
+        if compiled is None or current != version:
+            rows = db.query(PromoRule).all()
+            rules = [rule_fields(r) for r in rows if r.active] if rows else DEFAULT_RULES
+            compiled = compile_rules(db, rules)
+
+        with self._lock:
+            if generation == self._generation:
+                self._compiled = compiled
+                self._version = current
+                self._checked_at = now
+        return compiled
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._compiled = None
+            self._version = None
+
+
+promo_engine = PromoEngine()
+
+
+def ensure_default_rules(db: Session):
+    """Isi promo_rules dengan DEFAULT_RULES kalau tabelnya masih kosong."""
+    if db.query(PromoRule.id).first() is None:
+        db.add_all([PromoRule(active=True, **rule) for rule in DEFAULT_RULES])
+        db.flush()
+
+
+def simulate_orders(db: Session, compiled: CompiledPromos) -> dict:
+    """
+    Terapkan aturan promo saat ini ke seluruh order historis (batch) dan
+    bandingkan dengan promo yang tercatat di order.
+    """
+    rows = (
+        db.query(Order.seat_count, Jadwal.tanggal, Order.membership_code, Jadwal.movie_id,
+                 Order.total_price, Order.promo_name, Order.discount)
+        .outerjoin(Jadwal, Jadwal.id == Order.jadwal_id)
+        .all()
+    )
+    results = compiled.evaluate_many((r[0] or 0, r[1], r[2], r[3]) for r in rows)
+
+    per_promo: Dict[str, dict] = {}
+    berubah = 0
+    diskon_tercatat = diskon_simulasi = 0
+    for r, (name, discount) in zip(rows, results):
+        total = r.total_price or 0
+        diskon_tercatat += int(total * (r.discount or 0) / 100)
+        diskon_simulasi += int(total * discount / 100)
+        if name != (r.promo_name or NO_PROMO[0]):
+            berubah += 1
+        stat = per_promo.setdefault(name, {"jumlah_order": 0, "total_diskon": 0})
+        stat["jumlah_order"] += 1
+        stat["total_diskon"] += int(total * discount / 100)
+
+    return {
+        "jumlah_order": len(rows),
+        "order_berubah_promo": berubah,
+        "total_diskon_tercatat": diskon_tercatat,
+        "total_diskon_simulasi": diskon_simulasi,
+        "per_promo": per_promo,
+    }
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from app.models import Jadwal, Movie, Order
+from app.payments import PAID
+from app.promo import NO_PROMO, rule_order, split_list
+
+ORDER_FRAME_TTL_SECONDS = int(os.getenv("ORDER_FRAME_TTL_SECONDS", "300"))
+
+
+class OrderColumns:
+    """Kolom order (PAID) dalam bentuk array NumPy untuk simulasi promo."""
+
+    def __init__(self, df: pd.DataFrame):
+        tanggal = pd.to_datetime(df["tanggal"])
+        self.size = len(df)
+        self.seat_count = df["seat_count"].fillna(0).to_numpy(np.int32)
+        self.final_price = df["final_price"].fillna(0).to_numpy(np.int64)
+        # Order tanpa total_price dianggap tanpa diskon (harga = final_price).
+        self.total_price = df["total_price"].fillna(df["final_price"]).fillna(0).to_numpy(np.int64)
+        self.has_promo = (df["promo_name"].fillna(NO_PROMO[0]) != NO_PROMO[0]).to_numpy()
+        self.day = tanggal.dt.day.fillna(0).to_numpy(np.int8)
+        self.weekday = tanggal.dt.weekday.fillna(-1).to_numpy(np.int8)
+        self.tanggal = tanggal.to_numpy("datetime64[D]")
+        members = df["membership_code"].astype("category")
+        self.member_categories = members.cat.categories
+        self.member = members.cat.codes.to_numpy(np.int32)
+        self.movie_id = df["movie_id"].fillna(-1).to_numpy(np.int64)
+        self.loaded_at = time.monotonic()
+
+
+def load_order_columns(db: Session) -> OrderColumns:
+    """
+    Satu query untuk semua order PAID. Tanggal promo = tanggal tayang
+    (sama seperti engine promo saat checkout); kalau jadwalnya sudah tidak
+    ada, pakai transaction_date.
+    """
+    query = (
+        db.query(
+            Order.seat_count, Order.total_price, Order.final_price, Order.promo_name,
+            Order.membership_code,
+            func.coalesce(Jadwal.tanggal, Order.transaction_date).label("tanggal"),
+            Jadwal.movie_id
+        )
+        .outerjoin(Jadwal, Jadwal.id == Order.jadwal_id)
+        .filter(or_(Order.status.is_(None), Order.status == PAID))
+    )
+    df = pd.read_sql(query.statement, db.connection())
+    return OrderColumns(df)
+
+
+class OrderColumnsCache:
+    """Kolom order dimuat sekali lalu dipakai ulang selama TTL untuk banyak simulasi."""
+
+    def __init__(self, ttl: int = ORDER_FRAME_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._columns: Optional[OrderColumns] = None
+
+    def get(self, db: Session, refresh: bool = False) -> OrderColumns:
+        with self._lock:
+            columns = self._columns
+        if refresh or columns is None or time.monotonic() - columns.loaded_at > self.ttl:
+            columns = load_order_columns(db)
+            with self._lock:
+                self._columns = columns
+        return columns
+
+
+order_columns = OrderColumnsCache()
+
+
+def discount_percent(cols: OrderColumns, rules: List[dict], movie_ids: Dict[str, int]) -> np.ndarray:
+    """
+    Persen diskon tiap order di bawah satu set aturan, dihitung vektor per
+    aturan: aturan dengan priority tertinggi yang cocok menang (seri: kode
+    terkecil), sama seperti CompiledPromos.evaluate.
+    """
+    order = sorted(range(len(rules)), key=lambda i: rule_order(rules[i]))
+    percent = np.zeros(cols.size, dtype=np.int64)
+    open_ = np.ones(cols.size, dtype=bool)
+
+    for i in order:
+        rule = rules[i]
+        mask = open_.copy()
+        if rule.get("min_seats"):
+            mask &= cols.seat_count >= rule["min_seats"]
+        if rule.get("tanggal") is not None:
+            mask &= cols.tanggal == np.datetime64(rule["tanggal"], "D")
+        if rule.get("day_of_month") is not None:
+            mask &= cols.day == rule["day_of_month"]
+        weekdays = [int(w) for w in split_list(rule.get("weekdays"))]
+        if weekdays:
+            mask &= np.isin(cols.weekday, weekdays)
+        members = split_list(rule.get("membership_codes"))
+        if members:
+            idx = cols.member_categories.get_indexer(members)
+            mask &= np.isin(cols.member, idx[idx >= 0])
+        movies = split_list(rule.get("movie_codes"))
+        if movies:
+            mask &= np.isin(cols.movie_id, [movie_ids[c] for c in movies if c in movie_ids])
+
+        percent[mask] = rule["discount"]
+        open_ &= ~mask
+
+    return percent
+
+
+def simulate_scenarios(db: Session, cols: OrderColumns, scenarios: List[dict]) -> dict:
+    """Harga ulang semua order untuk tiap skenario dan bandingkan dengan data aktual."""
+    codes = {c for s in scenarios for r in s["rules"] for c in split_list(r.get("movie_codes"))}
+    movie_ids = dict(db.query(Movie.code, Movie.id).filter(Movie.code.in_(codes)).all()) if codes else {}
+
+    aktual_pendapatan = int(cols.final_price.sum())
+    aktual_diskon = int((cols.total_price - cols.final_price).sum())
+    aktual = {
+        "jumlah_order": cols.size,
+        "pendapatan": aktual_pendapatan,
+        "biaya_diskon": aktual_diskon,
+        "order_berpromo": int(cols.has_promo.sum()),
+    }
+
+    hasil = []
+    for scenario in scenarios:
+        start = time.perf_counter()
+        percent = discount_percent(cols, scenario["rules"], movie_ids)
+        diskon = cols.total_price * percent // 100
+        final = cols.total_price - diskon
+        pendapatan = int(final.sum())
+        biaya_diskon = int(diskon.sum())
+        hasil.append({
+            "nama": scenario["nama"],
+            "pendapatan": pendapatan,
+            "biaya_diskon": biaya_diskon,
+            "order_berpromo": int((percent > 0).sum()),
+            "delta_pendapatan": pendapatan - aktual_pendapatan,
+            "delta_biaya_diskon": biaya_diskon - aktual_diskon,
+            "order_berubah_harga": int((final != cols.final_price).sum()),
+            "waktu_ms": round((time.perf_counter() - start) * 1000, 2),
+        })
+
+    return {"aktual": aktual, "skenario": hasil}
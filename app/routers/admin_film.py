@@ -3,6 +3,8 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from app.database import get_db
 from app.models import Movie, price, Membership, Studio
+from app.cache import now_playing_cache
+from app.seat_state import seat_states
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -70,6 +72,7 @@ def add_movie(item: MovieInput, db: Session = Depends(get_db)):
     db.add(movie)
     db.commit()
     db.refresh(movie)
+    now_playing_cache.invalidate()
 
     return {
         "message": "Film berhasil ditambahkan",
@@ -95,6 +98,8 @@ def update_movie(code: str, item: MovieInput, db: Session = Depends(get_db)):
 
     db.commit()
     db.refresh(movie)
+    now_playing_cache.invalidate()
+    seat_states.clear()
     return {
         "message": "Film berhasil diperbarui",
         "data": movie
@@ -110,6 +115,8 @@ def delete_movie(code: str, db: Session = Depends(get_db)):
 
     db.delete(movie)
     db.commit()
+    now_playing_cache.invalidate()
+    seat_states.clear()
     return {"status": f"Movie {code} berhasil dihapus"}
 
 # STUDIO
@@ -181,6 +188,7 @@ def update_studio(code: str, item: StudioInput, db: Session = Depends(get_db)):
 
     db.commit()
     db.refresh(studio)
+    seat_states.clear()
     return studio
 
 
@@ -193,6 +201,7 @@ def delete_studio(code: str, db: Session = Depends(get_db)):
 
     db.delete(studio)
     db.commit()
+    seat_states.clear()
     return {"status": f"Studio {code} berhasil dihapus"}
 
 # MEMBERSHIPS
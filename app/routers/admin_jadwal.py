@@ -1,7 +1,13 @@
-from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import Jadwal, Movie, Studio
+from app.occupancy import reconcile_occupancy
+from app.cache import now_playing_cache
+from app.seat_state import seat_states
+from app.cancellation import cancel_schedule, cancel_schedule_in_background
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/schedules")
@@ -22,6 +28,7 @@ class ScheduleOut(BaseModel):
     jam: str
     movie_title: str
     studio_name: str
+    cancelled_at: Optional[str] = None
 
     class Config:
         orm_mode = True
@@ -55,7 +62,8 @@ def get_schedules(db: Session = Depends(get_db)):
             tanggal=tanggal_str,
             jam=jam_str,
             movie_title=movie.title if movie else f"Unknown ({s.movie_code})",
-            studio_name=studio.name if studio else f"Unknown ({s.studio_code})"
+            studio_name=studio.name if studio else f"Unknown ({s.studio_code})",
+            cancelled_at=s.cancelled_at.isoformat() if s.cancelled_at else None
         ))
 
     return output
@@ -76,7 +84,9 @@ def add_schedule(item: ScheduleInput, db: Session = Depends(get_db)):
 
     schedule = Jadwal(
         code=new_code,
+        movie_id=movie.id,
         movie_code=item.movie_code,
+        studio_id=studio.id,
         studio_code=item.studio_code,
         tanggal=item.tanggal,
         jam=item.jam
@@ -85,6 +95,7 @@ def add_schedule(item: ScheduleInput, db: Session = Depends(get_db)):
     db.add(schedule)
     db.commit()
     db.refresh(schedule)
+    now_playing_cache.invalidate()
 
     return ScheduleOut(
         code=schedule.code,
@@ -103,6 +114,8 @@ def update_schedule(code: str, item: ScheduleInput, db: Session = Depends(get_db
     schedule = db.query(Jadwal).filter(Jadwal.code == code).first()
     if not schedule:
         raise HTTPException(404, "Jadwal tidak ditemukan")
+    if schedule.cancelled_at is not None:
+        raise HTTPException(400, f"Jadwal {code} sudah dibatalkan")
 
     movie = db.query(Movie).filter(Movie.code == item.movie_code).first()
     if not movie:
@@ -112,13 +125,17 @@ def update_schedule(code: str, item: ScheduleInput, db: Session = Depends(get_db
     if not studio:
         raise HTTPException(404, "Studio tidak ditemukan")
 
+    schedule.movie_id = movie.id
     schedule.movie_code = item.movie_code
+    schedule.studio_id = studio.id
     schedule.studio_code = item.studio_code
     schedule.tanggal = item.tanggal
     schedule.jam = item.jam
 
     db.commit()
     db.refresh(schedule)
+    now_playing_cache.invalidate()
+    seat_states.invalidate(schedule.id)
 
     return ScheduleOut(
         code=schedule.code,
@@ -134,11 +151,52 @@ def update_schedule(code: str, item: ScheduleInput, db: Session = Depends(get_db
 @router.delete("/{code}")
 def delete_schedule(code: str, db: Session = Depends(get_db)):
 
+    """
+    Hapus jadwal: sama dengan /cancel. Jadwal ditandai batal (tidak dihapus
+    dari tabel) supaya riwayat order dan refund-nya tetap bisa dilacak.
+    """
     schedule = db.query(Jadwal).filter(Jadwal.code == code).first()
     if not schedule:
         raise HTTPException(404, "Jadwal tidak ditemukan")
+    if schedule.cancelled_at is not None:
+        raise HTTPException(400, f"Jadwal {code} sudah dibatalkan")
 
-    db.delete(schedule)
-    db.commit()
+    result = cancel_schedule(db, schedule)
+
+    return {"status": f"Jadwal {code} berhasil dihapus", **result}
+
+
+@router.post("/{code}/cancel")
+def cancel_schedule_endpoint(
+    code: str,
+    background_tasks: BackgroundTasks,
+    background: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Batalkan jadwal: semua order di-refund, cart dibersihkan, lalu jadwal
+    ditandai batal, dalam satu transaksi. background=true untuk jadwal
+    yang sangat besar: response langsung kembali, proses jalan setelahnya.
+    """
+    schedule = db.query(Jadwal).filter(Jadwal.code == code).first()
+    if not schedule:
+        raise HTTPException(404, "Jadwal tidak ditemukan")
+    if schedule.cancelled_at is not None:
+        raise HTTPException(400, f"Jadwal {code} sudah dibatalkan")
+
+    if background:
+        background_tasks.add_task(cancel_schedule_in_background, db.get_bind(), schedule.id)
+        return {"status": f"Pembatalan jadwal {code} sedang diproses", "jadwal_code": code}
+
+    result = cancel_schedule(db, schedule)
 
-    return {"status": f"Jadwal {code} berhasil dihapus"}
\ No newline at end of file
+    return {"status": f"Jadwal {code} dibatalkan", **result}
+
+
+@router.post("/occupancy/reconcile")
+def reconcile_schedule_occupancy(fix: bool = True, db: Session = Depends(get_db)):
+    """
+    Hitung ulang counter okupansi (sold/held) semua jadwal dari tabel
+    order_seats & carts, laporkan selisihnya, dan perbaiki jika fix=true.
+    """
+    return reconcile_occupancy(db, fix=fix)
@@ -0,0 +1,102 @@
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Depends
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.models import PromoRule
+from app.promo import ensure_default_rules, promo_engine, rule_to_dict, simulate_orders, validate_rule
+
+router = APIRouter(prefix="/promos")
+
+
+class PromoRuleInput(BaseModel):
+    code: str
+    name: str
+    discount: int
+    priority: int = 0
+    min_seats: Optional[int] = None
+    tanggal: Optional[date] = None
+    day_of_month: Optional[int] = None
+    weekdays: Optional[str] = None
+    membership_codes: Optional[str] = None
+    movie_codes: Optional[str] = None
+    active: bool = True
+
+
+@router.get("")
+def get_promos(db: Session = Depends(get_db)):
+    """Daftar aturan promo, urut priority tertinggi dulu."""
+    rules = db.query(PromoRule).order_by(PromoRule.priority.desc(), PromoRule.code).all()
+    return {
+        "message": "Daftar aturan promo",
+        "data": [rule_to_dict(r) for r in rules]
+    }
+
+
+@router.post("")
+def add_promo(item: PromoRuleInput, db: Session = Depends(get_db)):
+    validate_rule(item)
+    # Selama tabel kosong engine memakai promo default; simpan dulu supaya
+    # aturan default tidak hilang saat aturan pertama ditambahkan.
+    ensure_default_rules(db)
+    if db.query(PromoRule).filter(PromoRule.code == item.code).first():
+        raise HTTPException(400, f"Promo dengan kode {item.code} sudah ada")
+
+    rule = PromoRule(**item.model_dump())
+    db.add(rule)
+    db.commit()
+    db.refresh(rule)
+    promo_engine.invalidate()
+
+    return {
+        "message": "Promo berhasil ditambahkan",
+        "data": rule_to_dict(rule)
+    }
+
+
+@router.put("/{code}")
+def update_promo(code: str, item: PromoRuleInput, db: Session = Depends(get_db)):
+    validate_rule(item)
+    rule = db.query(PromoRule).filter(PromoRule.code == code).first()
+    if not rule:
+        raise HTTPException(404, "Promo tidak ditemukan")
+    if item.code != code and db.query(PromoRule).filter(PromoRule.code == item.code).first():
+        raise HTTPException(400, f"Promo dengan kode {item.code} sudah ada")
+
+    for field, value in item.model_dump().items():
+        setattr(rule, field, value)
+    db.commit()
+    db.refresh(rule)
+    promo_engine.invalidate()
+
+    return {
+        "message": "Promo berhasil diupdate",
+        "data": rule_to_dict(rule)
+    }
+
+
+@router.delete("/{code}")
+def delete_promo(code: str, db: Session = Depends(get_db)):
+    ensure_default_rules(db)
+    rule = db.query(PromoRule).filter(PromoRule.code == code).first()
+    if not rule:
+        raise HTTPException(404, "Promo tidak ditemukan")
+
+    # Dinonaktifkan, bukan dihapus, supaya tabel tidak kosong lagi dan
+    # kembali ke promo default.
+    rule.active = False
+    db.commit()
+    promo_engine.invalidate()
+    return {"status": f"Promo {code} berhasil dinonaktifkan"}
+
+
+@router.get("/simulate")
+def simulate_promos(db: Session = Depends(get_db)):
+    """
+    Terapkan aturan promo aktif ke seluruh order historis (batch) untuk
+    melihat dampaknya dibanding promo yang tercatat.
+    """
+    return simulate_orders(db, promo_engine.get(db))
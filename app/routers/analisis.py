@@ -1,12 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Path
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, extract
+from sqlalchemy import case, func, desc, extract
 from datetime import date, datetime, timedelta
 from typing import Optional, List
 import calendar
 from app.database import get_db
 from sqlalchemy import text
-from app.models import Movie, Order, Membership, Jadwal
+from app.models import Movie, Order, OrderSeat, Membership, Jadwal
+from app.payments import ORDER_LUNAS, PAID
+from app.promo import validate_rule
+from app.promo_sim import order_columns, simulate_scenarios
 
 router = APIRouter()
 
@@ -15,6 +19,26 @@ MONTH_NAMES = {
     "juli": 7, "agustus": 8, "september": 9, "oktober": 10, "november": 11, "desember": 12
 }
 
+MINGGU_RANGES = [(1, 7), (8, 14), (15, 21), (22, 28), (29, 31)]
+
+
+def rentang_ke(kolom, ranges):
+    """
+    Nomor rentang (0, 1, ...) tempat tanggal berada, dihitung di database.
+    ranges berisi (hari_awal, hari_akhir, ...) yang berurutan dalam satu
+    bulan, jadi semua periode bisa diambil dengan satu query GROUP BY.
+    """
+    hari = extract("day", kolom)
+    return case(*[(hari <= r[1], i) for i, r in enumerate(ranges)])
+
+
+def per_rentang(rows, jumlah):
+    """Kelompokkan baris per nomor rentang; rentang tanpa transaksi jadi list kosong."""
+    hasil = [[] for _ in range(jumlah)]
+    for r in rows:
+        hasil[r["rentang"]].append(r)
+    return hasil
+
 
 # 1. Film paling populer
 @router.get("/analisis/filmpopuler")
@@ -47,40 +71,47 @@ def film_popular(
             FROM orders o
             JOIN jadwal j ON o.jadwal_id = j.id
             JOIN movies m ON j.movie_id = m.id
-            WHERE o.transaction_date = :tanggal
+            WHERE o.transaction_date = :tanggal AND (o.status IS NULL OR o.status = :paid)
             GROUP BY m.id, m.title
             ORDER BY total DESC;
         """)
 
-        data = db.execute(query, {"tanggal": tanggal}).mappings().all()
+        data = db.execute(query, {"tanggal": tanggal, "paid": PAID}).mappings().all()
 
         return {"periode": "harian", "tanggal": tanggal.isoformat(), "data": data}
 
     # MINGGUAN
     if periode == "mingguan":
-        minggu_ranges = [(1,7),(8,14),(15,21),(22,28),(29,31)]
-        hasil = []
+        rentang = rentang_ke(Order.transaction_date, MINGGU_RANGES)
+        total = func.count(Order.id)
 
-        for i,(s,e) in enumerate(minggu_ranges,start=1):
+        # Satu query untuk semua minggu, diurutkan per minggu lewat ROW_NUMBER.
+        rows = (
+            db.query(
+                rentang.label("rentang"), Movie.id, Movie.title, total.label("total"),
+                func.row_number().over(partition_by=rentang, order_by=(total.desc(), Movie.id)).label("peringkat")
+            )
+            .select_from(Order)
+            .join(Jadwal, Order.jadwal_id == Jadwal.id)
+            .join(Movie, Jadwal.movie_id == Movie.id)
+            .filter(Order.transaction_date.between(date(year, month, 1), date(year, month, MINGGU_RANGES[-1][1])))
+            .filter(ORDER_LUNAS)
+            .group_by(rentang, Movie.id, Movie.title)
+            .order_by("rentang", "peringkat")
+            .all()
+        )
+
+        hasil = []
+        per_minggu = per_rentang([r._mapping for r in rows], len(MINGGU_RANGES))
+        for i, ((s, e), data) in enumerate(zip(MINGGU_RANGES, per_minggu), start=1):
             start = date(year, month, s)
             end = date(year, month, e)
-
-            query = text("""
-                SELECT m.id, m.title, COUNT(o.id) AS total
-                FROM orders o
-                JOIN jadwal j ON o.jadwal_id = j.id
-                JOIN movies m ON j.movie_id = m.id
-                WHERE o.transaction_date BETWEEN :s AND :e
-                GROUP BY m.id, m.title
-                ORDER BY total DESC;
-            """)
-
-            rows = db.execute(query, {"s": start, "e": end}).mappings().all()
+            data = [{"id": r["id"], "title": r["title"], "total": r["total"]} for r in data]
             hasil.append({
                 "minggu_ke": i,
                 "periode": f"{start} s/d {end}",
-                "film_terlaris": rows[0] if rows else None,
-                "data": rows
+                "film_terlaris": data[0] if data else None,
+                "data": data
             })
 
         return {"periode": "mingguan", "data": hasil}
@@ -104,11 +135,12 @@ def film_popular(
             JOIN jadwal j ON o.jadwal_id = j.id
             JOIN movies m ON j.movie_id = m.id
             WHERE o.transaction_date >= :start AND o.transaction_date < :end
+              AND (o.status IS NULL OR o.status = :paid)
             GROUP BY m.id, m.title
             ORDER BY total DESC;
         """)
 
-        rows = db.execute(query, {"start": start, "end": end}).mappings().all()
+        rows = db.execute(query, {"start": start, "end": end, "paid": PAID}).mappings().all()
 
         return {
             "periode": "bulanan",
@@ -160,28 +192,39 @@ def jam_tayang_populer(
             FROM orders o
             JOIN jadwal j ON o.jadwal_id=j.id
             JOIN movies m ON j.movie_id=m.id
-            WHERE o.transaction_date=:t
+            WHERE o.transaction_date=:t AND (o.status IS NULL OR o.status=:paid)
             GROUP BY m.id,m.title,j.jam;
         """)
 
-        rows = db.execute(query, {"t": tanggal}).mappings().all()
+        rows = db.execute(query, {"t": tanggal, "paid": PAID}).mappings().all()
         return {"periode":"harian","tanggal":tanggal.isoformat(),"data":extract(rows)}
 
     if periode == "mingguan":
-        minggu_ranges=[(1,7),(8,14),(15,21),(22,28),(29,31)]
+        rentang = rentang_ke(Order.transaction_date, MINGGU_RANGES)
+        total = func.count(Order.id)
+        rows = (
+            db.query(
+                rentang.label("rentang"), Movie.id.label("movie_id"), Movie.title, Jadwal.jam,
+                total.label("total"),
+                func.row_number().over(
+                    partition_by=(rentang, Movie.id), order_by=(total.desc(), Jadwal.jam)
+                ).label("peringkat")
+            )
+            .select_from(Order)
+            .join(Jadwal, Order.jadwal_id == Jadwal.id)
+            .join(Movie, Jadwal.movie_id == Movie.id)
+            .filter(Order.transaction_date.between(date(year, month, 1), date(year, month, MINGGU_RANGES[-1][1])))
+            .filter(ORDER_LUNAS)
+            .group_by(rentang, Movie.id, Movie.title, Jadwal.jam)
+            .order_by("rentang", Movie.id, "peringkat")
+            .all()
+        )
+
         hasil=[]
-        for i,(s,e) in enumerate(minggu_ranges,1):
+        per_minggu = per_rentang([r._mapping for r in rows], len(MINGGU_RANGES))
+        for i,((s,e),data) in enumerate(zip(MINGGU_RANGES,per_minggu),1):
             start,end=date(year,month,s),date(year,month,e)
-            query=text("""
-                SELECT m.id movie_id,m.title,j.jam,COUNT(o.id) total
-                FROM orders o
-                JOIN jadwal j ON o.jadwal_id=j.id
-                JOIN movies m ON j.movie_id=m.id
-                WHERE o.transaction_date BETWEEN :s AND :e
-                GROUP BY m.id,m.title,j.jam;
-            """)
-            rows=db.execute(query,{"s":start,"e":end}).mappings().all()
-            hasil.append({"minggu_ke":i,"periode":f"{start}s/d{end}","data":extract(rows)})
+            hasil.append({"minggu_ke":i,"periode":f"{start}s/d{end}","data":extract(data)})
         return {"periode":"mingguan","data":hasil}
 
     if periode == "bulanan":
@@ -200,10 +243,11 @@ def jam_tayang_populer(
             JOIN jadwal j ON o.jadwal_id=j.id
             JOIN movies m ON j.movie_id=m.id
             WHERE o.transaction_date>=:s AND o.transaction_date<:e
+              AND (o.status IS NULL OR o.status=:paid)
             GROUP BY m.id,m.title,j.jam;
         """)
 
-        rows=db.execute(query,{"s":start,"e":end}).mappings().all()
+        rows=db.execute(query,{"s":start,"e":end,"paid":PAID}).mappings().all()
         return {"periode":"bulanan","bulan":bulan,"data":extract(rows)}
 
     return {"error": "periode salah"}
@@ -246,11 +290,12 @@ def analisis_efektivitas_promo(db: Session = Depends(get_db)):
             id,
             promo_name,
             final_price
-        FROM orders;
+        FROM orders
+        WHERE status IS NULL OR status = :paid;
     """)
 
     try:
-        rows = db.execute(query).mappings().all()
+        rows = db.execute(query, {"paid": PAID}).mappings().all()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gagal mengambil data orders mentah dari database: {e}")
 
@@ -312,6 +357,59 @@ def analisis_efektivitas_promo(db: Session = Depends(get_db)):
         "kesimpulan": hasil_kesimpulan(t_change, p_change, h_change)
     }
 
+class SimulasiRule(BaseModel):
+    name: str
+    code: Optional[str] = None
+    discount: int
+    priority: int = 0
+    min_seats: Optional[int] = None
+    tanggal: Optional[date] = None
+    day_of_month: Optional[int] = None
+    weekdays: Optional[str] = None
+    membership_codes: Optional[str] = None
+    movie_codes: Optional[str] = None
+
+
+class SimulasiSkenario(BaseModel):
+    nama: str
+    rules: List[SimulasiRule] = []
+
+
+class SimulasiPromoRequest(BaseModel):
+    skenario: List[SimulasiSkenario]
+
+
+MAX_SKENARIO = 20
+
+
+@router.post("/analisis/promo-simulasi")
+def simulasi_promo(
+    payload: SimulasiPromoRequest,
+    refresh: bool = Query(False, description="Muat ulang data order dari database"),
+    db: Session = Depends(get_db)
+):
+    """
+    What-if promo: harga ulang semua order PAID di bawah beberapa skenario
+    aturan promo (format sama dengan promo_rules) dan bandingkan pendapatan,
+    biaya diskon, dan jumlah order terdampak dengan data aktual.
+    Data order dimuat sekali ke array NumPy lalu dipakai ulang antar request.
+    """
+    if not payload.skenario:
+        raise HTTPException(400, "Minimal satu skenario")
+    if len(payload.skenario) > MAX_SKENARIO:
+        raise HTTPException(400, f"Maksimal {MAX_SKENARIO} skenario per simulasi")
+    for skenario in payload.skenario:
+        for rule in skenario.rules:
+            validate_rule(rule)
+
+    cols = order_columns.get(db, refresh=refresh)
+    scenarios = [
+        {"nama": s.nama, "rules": [r.model_dump() for r in s.rules]}
+        for s in payload.skenario
+    ]
+    return simulate_scenarios(db, cols, scenarios)
+
+
 # 4. Kursi paling populer
 @router.get("/analisis/kursipopuler/{mode}")
 def kursi_paling_populer(
@@ -362,7 +460,9 @@ def kursi_paling_populer(
                 COUNT(os.id) AS jumlah_pemesanan
             FROM order_seats os
             JOIN jadwal j ON os.jadwal_id = j.id -- PERBAIKAN 1: Gunakan 'jadwal' (tunggal)
+            JOIN orders o ON os.order_id = o.id
             WHERE j.tanggal BETWEEN :start_date AND :end_date -- PERBAIKAN 2: Gunakan kolom 'tanggal'
+              AND (o.status IS NULL OR o.status = :paid)
             GROUP BY kursi_kode
             ORDER BY jumlah_pemesanan DESC
             LIMIT 5;
@@ -370,7 +470,8 @@ def kursi_paling_populer(
         
         result = db.execute(query, {
             "start_date": start.isoformat(),
-            "end_date": end.isoformat()
+            "end_date": end.isoformat(),
+            "paid": PAID
         }).mappings().all()
 
         print("DB Result:", result)
@@ -432,25 +533,32 @@ def get_top_revenue_films(
     else:
         return {"pesan": "Periode salah. Pilih: hari, minggu, atau bulan."}
 
+    # Satu query untuk semua periode: pendapatan per (periode, film), lalu
+    # ROW_NUMBER per periode untuk mengambil film juaranya.
+    rentang = rentang_ke(Order.transaction_date, ranges)
+    revenue = func.sum(Order.final_price)
+    ranked = (
+        db.query(
+            rentang.label("rentang"),
+            Movie.title,
+            revenue.label("total_revenue"),
+            func.row_number().over(partition_by=rentang, order_by=(revenue.desc(), Movie.id)).label("peringkat")
+        )
+        .select_from(Movie)
+        .join(Jadwal, Movie.id == Jadwal.movie_id)
+        .join(Order, Jadwal.id == Order.jadwal_id)
+        .filter(Order.transaction_date >= date(2024, 12, ranges[0][0]))
+        .filter(Order.transaction_date <= date(2024, 12, ranges[-1][1]))
+        .filter(ORDER_LUNAS)
+        .group_by(rentang, Movie.id, Movie.title)
+        .subquery()
+    )
+    juara = {r.rentang: r for r in db.query(ranked).filter(ranked.c.peringkat == 1)}
+
     output_data = []
     
-    for start_day, end_day, label in ranges:
-        start_date = date(2024, 12, start_day)
-        end_date = date(2024, 12, end_day)
-        
-        top_film = (
-            db.query(
-                Movie.title,
-                func.sum(Order.final_price).label("total_revenue")
-            )
-            .join(Jadwal, Movie.id == Jadwal.movie_id)
-            .join(Order, Jadwal.id == Order.jadwal_id)
-            .filter(Order.transaction_date >= start_date)
-            .filter(Order.transaction_date <= end_date)
-            .group_by(Movie.id)
-            .order_by(desc("total_revenue"))
-            .first()
-        )
+    for i, (start_day, end_day, label) in enumerate(ranges):
+        top_film = juara.get(i)
         
         if top_film:
             output_data.append({
@@ -506,26 +614,30 @@ def get_top_customers(
     else:
         return {"pesan": "Periode salah. Pilih: minggu atau bulan."}
 
+    rentang = rentang_ke(Order.transaction_date, ranges)
+    jumlah = func.count(Order.id)
+    ranked = (
+        db.query(
+            rentang.label("rentang"),
+            Membership.code.label("member_code"),
+            Membership.nama,
+            jumlah.label("total_transaksi"),
+            func.row_number().over(partition_by=rentang, order_by=(jumlah.desc(), Membership.code)).label("peringkat")
+        )
+        .select_from(Membership)
+        .join(Order, Membership.code == Order.membership_code)
+        .filter(Order.transaction_date >= date(2024, 12, ranges[0][0]))
+        .filter(Order.transaction_date <= date(2024, 12, ranges[-1][1]))
+        .filter(ORDER_LUNAS)
+        .group_by(rentang, Membership.code, Membership.nama)
+        .subquery()
+    )
+    juara = {r.rentang: r for r in db.query(ranked).filter(ranked.c.peringkat == 1)}
+
     output_data = []
     
-    for start_day, end_day, label in ranges:
-        start_date = date(2024, 12, start_day)
-        end_date = date(2024, 12, end_day)
-
-
-        top_member = (
-            db.query(
-                Membership.code.label("member_code"),
-                Membership.nama,
-                func.count(Order.id).label("total_transaksi")
-            )
-            .join(Order, Membership.code == Order.membership_code)
-            .filter(Order.transaction_date >= start_date)
-            .filter(Order.transaction_date <= end_date)
-            .group_by(Membership.code, Membership.nama) 
-            .order_by(desc("total_transaksi"))
-            .first() 
-        )
+    for i, (start_day, end_day, label) in enumerate(ranges):
+        top_member = juara.get(i)
 
         if top_member:
             output_data.append({
@@ -570,6 +682,7 @@ def get_busiest_day(
             func.sum(Order.seat_count).label("total_tiket")
         )
         .filter(extract('month', Order.transaction_date) == bulan)
+        .filter(ORDER_LUNAS)
         .filter(extract('year', Order.transaction_date) == tahun)
         .group_by(Order.transaction_date)
         .order_by(desc("total_tiket"))
@@ -584,6 +697,7 @@ def get_busiest_day(
             func.sum(Order.seat_count).label("total_tiket")
         )
         .filter(extract('month', Order.transaction_date) == bulan)
+        .filter(ORDER_LUNAS)
         .filter(extract('year', Order.transaction_date) == tahun)
         .group_by("nama_hari")
         .order_by(desc("total_tiket")) 
@@ -670,39 +784,41 @@ def genre_populer(
             JOIN orders o ON os.order_id=o.id
             JOIN jadwal j ON o.jadwal_id=j.id
             JOIN movies m ON j.movie_id=m.id
-            WHERE o.transaction_date=:t
+            WHERE o.transaction_date=:t AND (o.status IS NULL OR o.status=:paid)
             GROUP BY m.genre
             ORDER BY total DESC;
         """)
-        rows=db.execute(q,{"t":tanggal}).mappings().all()
+        rows=db.execute(q,{"t":tanggal,"paid":PAID}).mappings().all()
         return {"periode":"harian","tanggal":tanggal.isoformat(),"data":persen(rows)}
 
     if periode == "mingguan":
 
-        minggu_ranges=[(1,7),(8,14),(15,21),(22,28),(29,31)]
+        rentang = rentang_ke(Order.transaction_date, MINGGU_RANGES)
+        total = func.count(OrderSeat.id)
+        rows = (
+            db.query(
+                rentang.label("rentang"), Movie.genre, total.label("total"),
+                func.row_number().over(partition_by=rentang, order_by=(total.desc(), Movie.genre)).label("peringkat")
+            )
+            .select_from(OrderSeat)
+            .join(Order, OrderSeat.order_id == Order.id)
+            .join(Jadwal, Order.jadwal_id == Jadwal.id)
+            .join(Movie, Jadwal.movie_id == Movie.id)
+            .filter(Order.transaction_date.between(date(year, month, 1), date(year, month, MINGGU_RANGES[-1][1])))
+            .filter(ORDER_LUNAS)
+            .group_by(rentang, Movie.genre)
+            .order_by("rentang", "peringkat")
+            .all()
+        )
+
         hasil=[]
-        for i,(s,e) in enumerate(minggu_ranges,1):
-            try:
-                start,end=date(year,month,s),date(year,month,e)
-            except ValueError:
-
-                continue 
-                
-            q=text("""
-                SELECT m.genre,COUNT(os.id) total
-                FROM order_seats os
-                JOIN orders o ON os.order_id=o.id
-                JOIN jadwal j ON o.jadwal_id=j.id
-                JOIN movies m ON j.movie_id=m.id
-                WHERE o.transaction_date BETWEEN :s AND :e
-                GROUP BY m.genre
-                ORDER BY total DESC;
-            """)
-            rows=db.execute(q,{"s":start,"e":end}).mappings().all()
+        per_minggu = per_rentang([r._mapping for r in rows], len(MINGGU_RANGES))
+        for i,((s,e),data) in enumerate(zip(MINGGU_RANGES,per_minggu),1):
+            start,end=date(year,month,s),date(year,month,e)
             hasil.append({
                 "minggu_ke":i,
                 "periode":f"{start} s/d {end}",
-                "data":persen(rows)
+                "data":persen({"genre": r["genre"], "total": r["total"]} for r in data)
             })
         return {"periode":"mingguan","data":hasil}
 
@@ -727,11 +843,12 @@ def genre_populer(
             JOIN jadwal j ON o.jadwal_id=j.id
             JOIN movies m ON j.movie_id=m.id
             WHERE o.transaction_date>=:s AND o.transaction_date<:e 
+              AND (o.status IS NULL OR o.status=:paid)
             GROUP BY m.genre
             ORDER BY total DESC;
         """)
 
-        rows=db.execute(q,{"s":start,"e":end}).mappings().all()
+        rows=db.execute(q,{"s":start,"e":end,"paid":PAID}).mappings().all()
         return {"periode":"bulanan","bulan":bulan,"data":persen(rows)}
 
     # Error jika periode yang dimasukkan bukan 'harian', 'mingguan', atau 'bulanan'
@@ -748,11 +865,14 @@ def metode_pembayaran(db: Session = Depends(get_db)):
         SELECT 
             payment_method,
             COUNT(id) AS penggunaan,
-            ROUND(COUNT(id) * 100.0 / (SELECT COUNT(*) FROM orders), 1) AS persentase
+            ROUND(COUNT(id) * 100.0 / (
+                SELECT COUNT(*) FROM orders WHERE status IS NULL OR status = :paid
+            ), 1) AS persentase
         FROM orders
+        WHERE status IS NULL OR status = :paid
         GROUP BY payment_method
         ORDER BY penggunaan DESC;
     """)
     
-    result = db.execute(query).mappings().all()
+    result = db.execute(query, {"paid": PAID}).mappings().all()
     return {"data": result}
\ No newline at end of file
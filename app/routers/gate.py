@@ -0,0 +1,119 @@
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.gate import gate_rosters
+from app.models import Order, OrderSeat
+from app.payments import ORDER_LUNAS, PAID
+
+router = APIRouter(prefix="/gate")
+
+
+class ScanRequest(BaseModel):
+    jadwal_code: str
+    order_code: str
+
+
+def duplicate_scan(order_code: str, checked_in_at: datetime) -> HTTPException:
+    return HTTPException(409, detail={
+        "message": f"Tiket {order_code} sudah dipakai",
+        "checked_in_at": checked_in_at.isoformat()
+    })
+
+
+# PRELOAD ROSTER
+@router.post("/{jadwal_code}/preload")
+def preload_gate(jadwal_code: str, db: Session = Depends(get_db)):
+    """
+    Muat ulang daftar tiket valid (order lunas + kursinya) untuk satu jadwal.
+    Dipanggil sebelum pintu studio dibuka supaya scan tidak perlu membaca DB.
+    """
+    gate_rosters.invalidate(jadwal_code)
+    roster = gate_rosters.get(db, jadwal_code)
+    if roster is None:
+        raise HTTPException(404, detail=f"Jadwal dengan kode {jadwal_code} tidak ditemukan")
+
+    return {
+        "jadwal_code": roster.jadwal_code,
+        "total_order": len(roster.orders),
+        "total_kursi": sum(len(seats) for _, seats in roster.orders.values()),
+        "sudah_check_in": len(roster.checked_in),
+        "loaded_at": roster.loaded_at.isoformat()
+    }
+
+
+# SCAN TICKET
+@router.post("/scan")
+def scan_ticket(item: ScanRequest, db: Session = Depends(get_db)):
+    """
+    Validasi kode order di pintu studio dan tandai tiketnya terpakai.
+
+    Validasi memakai roster di memori (O(1)). Penandaan check-in adalah
+    UPDATE bersyarat (checked_in_at IS NULL) di orders, jadi scan ganda
+    tetap terdeteksi walaupun dua scanner masuk ke worker yang berbeda.
+    """
+    roster = gate_rosters.get(db, item.jadwal_code)
+    if roster is None:
+        raise HTTPException(404, detail=f"Jadwal dengan kode {item.jadwal_code} tidak ditemukan")
+
+    checked_in_at = roster.checked_in.get(item.order_code)
+    if checked_in_at is not None:
+        raise duplicate_scan(item.order_code, checked_in_at)
+
+    entry = roster.orders.get(item.order_code)
+    if entry is None:
+        # Order dibeli setelah roster dimuat, salah jadwal, atau memang tidak ada.
+        order = (
+            db.query(Order.id, Order.jadwal_id, Order.status, Order.checked_in_at)
+            .filter(Order.code == item.order_code)
+            .first()
+        )
+        if order is None:
+            raise HTTPException(404, detail=f"Tiket {item.order_code} tidak valid")
+        if order.jadwal_id != roster.jadwal_id:
+            raise HTTPException(400, detail=f"Tiket {item.order_code} bukan untuk jadwal {item.jadwal_code}")
+        if order.status not in (None, PAID):
+            raise HTTPException(400, detail=f"Tiket {item.order_code} berstatus {order.status}")
+
+        seats = [
+            f"{row}-{col}" for row, col in
+            db.query(OrderSeat.row, OrderSeat.col)
+            .filter(OrderSeat.order_id == order.id)
+            .order_by(OrderSeat.row, OrderSeat.col)
+        ]
+        roster.add(order.id, item.order_code, seats, order.checked_in_at)
+        entry = roster.orders[item.order_code]
+        if order.checked_in_at is not None:
+            raise duplicate_scan(item.order_code, order.checked_in_at)
+
+    order_id, seats = entry
+    now = datetime.now().replace(microsecond=0)
+    result = db.execute(
+        update(Order)
+        .where(Order.id == order_id, ORDER_LUNAS, Order.checked_in_at.is_(None))
+        .values(checked_in_at=now)
+    )
+    db.commit()
+
+    if result.rowcount != 1:
+        # Kalah balapan dengan scanner lain, atau order dibatalkan setelah preload.
+        current = db.query(Order.status, Order.checked_in_at).filter(Order.id == order_id).first()
+        if current is not None and current.checked_in_at is not None:
+            roster.checked_in[item.order_code] = current.checked_in_at
+            raise duplicate_scan(item.order_code, current.checked_in_at)
+        roster.orders.pop(item.order_code, None)
+        raise HTTPException(400, detail=f"Tiket {item.order_code} sudah tidak berlaku")
+
+    roster.checked_in[item.order_code] = now
+
+    return {
+        "status": "VALID",
+        "order_code": item.order_code,
+        "jadwal_code": roster.jadwal_code,
+        "seats": seats,
+        "checked_in_at": now.isoformat()
+    }
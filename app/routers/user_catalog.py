@@ -1,9 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from datetime import date
-from typing import List
+from sqlalchemy import func
+from datetime import date, time
+import asyncio
+import json
+from typing import List, Optional
 from app.database import get_db
-from app.models import Movie, Jadwal, Studio, StudioSeat, OrderSeat, Cart
+from app.cache import now_playing_cache, etag_matches
+from app.seat_state import seat_states, render_seat_lines, find_best_block
+from app.seat_feed import seat_feed
+from app.models import Movie, Jadwal, JadwalOccupancy, Studio, StudioSeat
 
 router = APIRouter()
 
@@ -19,41 +27,151 @@ def movie_to_public_dict(m: Movie) -> dict:
     }
 
 
+def get_today() -> date:
+    """Tanggal hari ini. Di test bisa diganti lewat app.dependency_overrides."""
+    return date.today()
+
+
 # now playing
 @router.get("/now_playing")
-def now_playing(db: Session = Depends(get_db)):
-    """Menampilkan seluruh daftar film yang sedang tayang."""
-    today = date(2024, 12, 1) 
-
-    movies = (
-        db.query(Movie)
-        .join(Jadwal, Jadwal.movie_id == Movie.id)
-        .filter(Jadwal.tanggal >= today) 
-        .distinct()
-        .all()
+def now_playing(
+    if_none_match: Optional[str] = Header(None),
+    today: date = Depends(get_today),
+    db: Session = Depends(get_db),
+):
+    """
+    Menampilkan seluruh daftar film yang sedang tayang.
+    Response di-cache per tanggal dan diinvalidasi saat film/jadwal berubah.
+    Kirim header If-None-Match dengan ETag sebelumnya untuk mendapat 304.
+    """
+    entry, generation = now_playing_cache.get(today)
+
+    if entry is None:
+        movies = (
+            db.query(Movie)
+            .join(Jadwal, Jadwal.movie_id == Movie.id)
+            .filter(Jadwal.tanggal >= today, Jadwal.cancelled_at.is_(None))
+            .distinct()
+            .all()
+        )
+
+        if not movies:
+            payload = {"detail": "Tidak ada film yang sedang tayang."}
+            entry = now_playing_cache.store(today, payload, generation, status_code=404)
+        else:
+            data_ringkas = [movie_to_public_dict(m) for m in movies]
+            payload = {
+                "message": "Daftar film yang sedang tayang berhasil diambil",
+                "count": len(data_ringkas),
+                "data": data_ringkas
+            }
+            entry = now_playing_cache.store(today, payload, generation)
+
+    headers = {"ETag": entry.etag}
+    if entry.status_code == 200 and etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(
+        content=entry.body,
+        status_code=entry.status_code,
+        media_type="application/json",
+        headers=headers,
     )
 
-    if not movies:
-        raise HTTPException(
-            status_code=404,
-            detail="Tidak ada film yang sedang tayang."
+
+
+def schedule_availability_query(db: Session):
+    """
+    Query jadwal + studio beserta kapasitas, kursi terjual, dan kursi di cart.
+    Angka terjual/di cart dibaca dari counter jadwal_occupancy yang di-update
+    oleh transaksi cart/checkout (lihat app.occupancy).
+    """
+    kapasitas = func.coalesce(Studio.rows, 0) * func.coalesce(Studio.cols, 0)
+
+    return (
+        db.query(
+            Jadwal,
+            Studio.name.label("studio_name"),
+            kapasitas.label("kapasitas"),
+            func.coalesce(JadwalOccupancy.sold, 0).label("terjual"),
+            func.coalesce(JadwalOccupancy.held, 0).label("di_keranjang"),
         )
+        .join(Studio, Studio.id == Jadwal.studio_id)
+        .outerjoin(JadwalOccupancy, JadwalOccupancy.jadwal_id == Jadwal.id)
+        .filter(Jadwal.cancelled_at.is_(None))
+    )
+
 
-    data_ringkas = [movie_to_public_dict(m) for m in movies]
+def availability_to_dict(row) -> dict:
+    kapasitas = row.kapasitas or 0
+    terjual = row.terjual or 0
+    di_keranjang = row.di_keranjang or 0
+    sisa = max(kapasitas - terjual - di_keranjang, 0)
 
     return {
-        "message": "Daftar film yang sedang tayang berhasil diambil",
-        "count": len(data_ringkas),
-        "data": data_ringkas
+        "kapasitas": kapasitas,
+        "terjual": terjual,
+        "di_keranjang": di_keranjang,
+        "sisa_kursi": sisa,
+        "okupansi": round(terjual / kapasitas * 100, 1) if kapasitas else 0,
+        "sold_out": kapasitas > 0 and sisa == 0,
     }
 
 
+@router.get("/schedules/availability")
+def ketersediaan_harian(
+    tanggal: Optional[date] = Query(None, description="Tanggal tayang (YYYY-MM-DD). Default: hari ini."),
+    today: date = Depends(get_today),
+    db: Session = Depends(get_db)
+):
+    """
+    Ringkasan semua jadwal pada satu tanggal (semua film & studio) beserta
+    kapasitas, kursi terjual, dan kursi di keranjang. Satu query agregat.
+    """
+
+    tanggal = tanggal or today
+
+    rows = (
+        schedule_availability_query(db)
+        .join(Movie, Movie.id == Jadwal.movie_id)
+        .add_columns(Movie.code.label("movie_code"), Movie.title.label("title"))
+        .filter(Jadwal.tanggal == tanggal)
+        .order_by(Jadwal.jam, Studio.name)
+        .all()
+    )
+
+    data = []
+    for row in rows:
+        j = row.Jadwal
+        item = {
+            "jadwal_code": j.code,
+            "movie_code": row.movie_code,
+            "title": row.title,
+            "studio": row.studio_name,
+            "waktu": j.jam.strftime("%H:%M"),
+        }
+        item.update(availability_to_dict(row))
+        data.append(item)
+
+    return {
+        "tanggal": tanggal.isoformat(),
+        "count": len(data),
+        "data": data
+    }
+
 
 # now playing/{movie_code}/details
 @router.get("/now_playing/{movie_code}/details")
-def detail_film(movie_code: str, db: Session = Depends(get_db)):
+def detail_film(
+    movie_code: str,
+    tanggal_mulai: Optional[date] = Query(None, description="Filter jadwal mulai tanggal (YYYY-MM-DD)"),
+    tanggal_akhir: Optional[date] = Query(None, description="Filter jadwal sampai tanggal (YYYY-MM-DD)"),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db)
+):
     """
-    Menampilkan detail film + semua jadwal tayangnya.
+    Menampilkan detail film + jadwal tayangnya beserta sisa kursi per jadwal.
     Parameter diisi dengan movie code: MOVXXX (contoh: MOV001).
     """
 
@@ -64,26 +182,43 @@ def detail_film(movie_code: str, db: Session = Depends(get_db)):
             detail=f"Film dengan kode {movie_code} tidak ditemukan."
         )
 
-    rows = (
-        db.query(Jadwal, Studio)
+    filters = [Jadwal.movie_id == movie.id, Jadwal.cancelled_at.is_(None)]
+    if tanggal_mulai:
+        filters.append(Jadwal.tanggal >= tanggal_mulai)
+    if tanggal_akhir:
+        filters.append(Jadwal.tanggal <= tanggal_akhir)
+
+    total = (
+        db.query(func.count(Jadwal.id))
         .join(Studio, Studio.id == Jadwal.studio_id)
-        .filter(Jadwal.movie_id == movie.id)
+        .filter(*filters)
+        .scalar()
+    )
+    rows = (
+        schedule_availability_query(db)
+        .filter(*filters)
         .order_by(Jadwal.tanggal, Jadwal.jam)
+        .offset(offset)
+        .limit(limit)
         .all()
     )
 
     schedules: List[dict] = []
-    for j, st in rows:
-        schedules.append(
-            {
-                "jadwal_code": j.code,                   
-                "studio": st.name,                       
-                "tanggal": j.tanggal.isoformat(),        
-                "waktu": j.jam.strftime("%H:%M"),        
-            }
-        )
+    for row in rows:
+        j = row.Jadwal
+        item = {
+            "jadwal_code": j.code,
+            "studio": row.studio_name,
+            "tanggal": j.tanggal.isoformat(),
+            "waktu": j.jam.strftime("%H:%M"),
+        }
+        item.update(availability_to_dict(row))
+        schedules.append(item)
 
     result = movie_to_public_dict(movie)
+    result["total_schedules"] = total
+    result["offset"] = offset
+    result["limit"] = limit
     result["schedules"] = schedules
 
     return result
@@ -113,94 +248,266 @@ def build_seat_display(
     rows = sorted({s.row for s in studio_seats})
     cols = sorted({s.col for s in studio_seats})
 
-    if len(cols) <= 6:
-        aisle_after = len(cols) // 2
-    else:
-        aisle_after = 6
+    def symbol_at(ri: int, ci: int) -> str:
+        key = (rows[ri], cols[ci])
+        if key in booked:
+            return "X"
+        if key in in_cart:
+            return "~"
+        return "O"
 
-    lines: List[str] = []
+    return render_seat_lines(rows, cols, symbol_at)
 
-    lines.append("          SCREEN")
 
-    left_nums = [str(c) for c in cols if c <= aisle_after]
-    right_nums = [str(c) for c in cols if c > aisle_after]
-    left_str = " ".join(left_nums)
-    right_str = " ".join(right_nums)
-    lines.append(f"   {left_str}   {right_str}")
 
-    for r in rows:
-        left_syms = []
-        right_syms = []
-        for c in cols:
-            key = (r, c)
-            if key in booked:
-                sym = "X"
-            elif key in in_cart:
-                sym = "~"
-            else:
-                sym = "O"
+SEAT_MAP_FORMATS = ("display", "compact")
+MAX_BATCH_SEAT_MAPS = 50
 
-            if c <= aisle_after:
-                left_syms.append(sym)
-            else:
-                right_syms.append(sym)
 
-        L = " ".join(left_syms)
-        R = " ".join(right_syms)
-        lines.append(f"{r}  {L}   {R}")
+def seat_map_payload(state, format: str) -> dict:
+    payload = {
+        "jadwal_code": state.jadwal_code,
+        "movie_title": state.movie_title,
+        "studio": state.studio_name,
+    }
+    with seat_states.lock:
+        if format == "compact":
+            payload.update(state.compact())
+        else:
+            payload["display"] = state.display()
+    return payload
+
+
+@router.get("/schedules/seats/batch")
+def denah_kursi_batch(
+    jadwal_code: List[str] = Query(..., description="Ulangi parameter untuk tiap jadwal (maks. 50)"),
+    format: str = Query("display", description="display (teks) | compact (bitmap base64)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Menampilkan peta kursi banyak jadwal sekaligus.
+    Contoh: /schedules/seats/batch?jadwal_code=JAD0001&jadwal_code=JAD0002
+    """
+
+    if format not in SEAT_MAP_FORMATS:
+        raise HTTPException(status_code=400, detail="format harus: display | compact")
+
+    codes = list(dict.fromkeys(jadwal_code))
+    if len(codes) > MAX_BATCH_SEAT_MAPS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maksimal {MAX_BATCH_SEAT_MAPS} jadwal per request."
+        )
 
-    return lines
+    states, incomplete = seat_states.get_many(db, codes)
 
+    return {
+        "count": len(states),
+        "data": [seat_map_payload(states[c], format) for c in codes if c in states],
+        "not_found": [c for c in codes if c not in states and c not in incomplete],
+        "incomplete": incomplete,
+    }
 
 
 @router.get("/schedules/{jadwal_code}/seats")
-def denah_kursi(jadwal_code: str, db: Session = Depends(get_db)):
+def denah_kursi(
+    jadwal_code: str,
+    format: str = Query("display", description="display (teks) | compact (bitmap base64)"),
+    db: Session = Depends(get_db)
+):
     """
     Menampilkan peta kursi berdasarkan jadwal.
     Parameter diisi dengan jadwal code: JAD0XXX (contoh: JAD0001).
+    Status kursi dibaca dari cache bitmap (lihat app.seat_state).
     """
 
-    jadwal = db.query(Jadwal).filter(Jadwal.code == jadwal_code).first()
-    if not jadwal:
+    if format not in SEAT_MAP_FORMATS:
+        raise HTTPException(status_code=400, detail="format harus: display | compact")
+
+    try:
+        state = seat_states.get(db, jadwal_code)
+    except LookupError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if state is None:
         raise HTTPException(
             status_code=404,
             detail=f"Jadwal dengan kode {jadwal_code} tidak ditemukan."
         )
 
-    studio = db.query(Studio).filter(Studio.id == jadwal.studio_id).first()
-    movie = db.query(Movie).filter(Movie.id == jadwal.movie_id).first()
+    return seat_map_payload(state, format)
+
 
-    if not studio or not movie:
+@router.get("/schedules/{jadwal_code}/seats/best")
+def kursi_terbaik(
+    jadwal_code: str,
+    jumlah: int = Query(..., ge=1, le=20, description="Jumlah kursi bersebelahan yang dicari"),
+    db: Session = Depends(get_db)
+):
+    """
+    Mencari blok kursi bersebelahan terbaik untuk rombongan.
+    Prioritas: baris tengah, kolom tengah, tidak terpotong lorong.
+    """
+
+    try:
+        state = seat_states.get(db, jadwal_code)
+    except LookupError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if state is None:
         raise HTTPException(
-            status_code=500,
-            detail="Data studio atau film untuk jadwal ini tidak lengkap."
+            status_code=404,
+            detail=f"Jadwal dengan kode {jadwal_code} tidak ditemukan."
         )
 
-    studio_seats = (
-        db.query(StudioSeat)
-        .filter(StudioSeat.studio_id == studio.id)
-        .all()
-    )
+    with seat_states.lock:
+        block = find_best_block(state, jumlah)
 
-    booked_rows = (
-        db.query(OrderSeat)
-        .filter(OrderSeat.jadwal_id == jadwal.id)
-        .all()
-    )
-    booked_set = {(s.row, s.col) for s in booked_rows}
+    if block is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Tidak ada {jumlah} kursi bersebelahan yang tersedia."
+        )
 
-    cart_rows = (
-        db.query(Cart)
-        .filter(Cart.jadwal_id == jadwal.id)
-        .all()
-    )
-    cart_set = {(c.row, c.col) for c in cart_rows}
+    return {
+        "jadwal_code": jadwal_code,
+        "jumlah": jumlah,
+        "kursi": [f"{block['row']}-{c}" for c in block["cols"]],
+        **block
+    }
+
+
+@router.get("/now_playing/{movie_code}/group-seats")
+def cari_jadwal_rombongan(
+    movie_code: str,
+    jumlah: int = Query(..., ge=1, le=20, description="Jumlah kursi bersebelahan yang dicari"),
+    tanggal_mulai: Optional[date] = Query(None, description="Default: hari ini"),
+    tanggal_akhir: Optional[date] = Query(None, description="Default: sama dengan tanggal_mulai"),
+    jam_mulai: Optional[time] = Query(None, description="Contoh: 16:00"),
+    jam_akhir: Optional[time] = Query(None, description="Contoh: 21:00"),
+    today: date = Depends(get_today),
+    db: Session = Depends(get_db)
+):
+    """
+    Mencari jadwal film yang masih punya `jumlah` kursi bersebelahan.
+    Semua jadwal dalam rentang dimuat sekaligus (jumlah query tetap).
+    """
+
+    movie = db.query(Movie).filter(Movie.code == movie_code).first()
+    if not movie:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Film dengan kode {movie_code} tidak ditemukan."
+        )
+
+    mulai = tanggal_mulai or today
+    akhir = tanggal_akhir or mulai
 
-    display = build_seat_display(studio, studio_seats, booked_set, cart_set)
+    query = (
+        db.query(Jadwal)
+        .filter(Jadwal.movie_id == movie.id, Jadwal.cancelled_at.is_(None))
+        .filter(Jadwal.tanggal >= mulai, Jadwal.tanggal <= akhir)
+    )
+    if jam_mulai:
+        query = query.filter(Jadwal.jam >= jam_mulai)
+    if jam_akhir:
+        query = query.filter(Jadwal.jam <= jam_akhir)
+    jadwals = query.order_by(Jadwal.tanggal, Jadwal.jam).all()
+
+    states = seat_states.get_for_jadwals(db, jadwals)
+
+    hasil = []
+    with seat_states.lock:
+        for j in jadwals:
+            state = states.get(j.id)
+            if state is None:
+                continue
+            block = find_best_block(state, jumlah)
+            if block is None:
+                continue
+            hasil.append({
+                "jadwal_code": j.code,
+                "studio": state.studio_name,
+                "tanggal": j.tanggal.isoformat(),
+                "waktu": j.jam.strftime("%H:%M"),
+                "kursi": [f"{block['row']}-{c}" for c in block["cols"]],
+                "lintas_lorong": block["lintas_lorong"],
+            })
 
     return {
-        "jadwal_code": jadwal_code,
-        "movie_title": movie.title,
-        "studio": studio.name,
-        "display": display
-    }
\ No newline at end of file
+        "movie_code": movie.code,
+        "title": movie.title,
+        "jumlah": jumlah,
+        "tanggal_mulai": mulai.isoformat(),
+        "tanggal_akhir": akhir.isoformat(),
+        "jadwal_diperiksa": len(jadwals),
+        "count": len(hasil),
+        "data": hasil
+    }
+
+
+def sse_message(event: dict) -> str:
+    lines = []
+    if "version" in event:
+        lines.append(f"id: {event['version']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event)}")
+    return "\n".join(lines) + "\n\n"
+
+
+@router.get("/schedules/{jadwal_code}/seats/stream")
+async def stream_kursi(jadwal_code: str, request: Request, db: Session = Depends(get_db)):
+    """
+    Stream peta kursi (Server-Sent Events).
+    Event pertama 'snapshot' berisi display + version; setelah itu hanya
+    event 'diff' {row, col, state, version} saat kursi berubah.
+    Jika menerima event 'resync' atau version loncat, buka ulang stream.
+    """
+
+    def load_state():
+        # Teardown dependency baru jalan setelah stream selesai; tutup session
+        # sekarang supaya koneksinya kembali ke pool selama client tersambung.
+        try:
+            return seat_states.get(db, jadwal_code)
+        finally:
+            db.close()
+
+    try:
+        state = await run_in_threadpool(load_state)
+    except LookupError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if state is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Jadwal dengan kode {jadwal_code} tidak ditemukan."
+        )
+
+    # Subscribe dulu baru ambil snapshot, supaya tidak ada diff yang terlewat.
+    sub = seat_feed.subscribe(state.jadwal_id)
+    with seat_states.lock:
+        snapshot = state.snapshot()
+
+    async def events():
+        try:
+            yield sse_message(snapshot)
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if event["type"] == "diff" and event["version"] <= snapshot["version"]:
+                    continue
+                yield sse_message(event)
+                if event["type"] == "resync":
+                    break
+        finally:
+            seat_feed.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
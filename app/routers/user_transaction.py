@@ -1,12 +1,25 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response
 from sqlalchemy.orm import Session
+from sqlalchemy import String, cast, func, insert, tuple_
+from sqlalchemy.exc import IntegrityError, OperationalError
 from datetime import datetime
-import uuid
+import random
+import time
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from app.database import get_db
+from app.cache import order_cache
 from app.models import Cart, Jadwal, Order, OrderSeat, Membership, Movie, StudioSeat, Studio  
+from app.seat_state import seat_states, find_best_block
+from app.occupancy import bump_occupancy
+from app.holds import HOLD_MINUTES, active_hold, hold_expiry, hold_metrics
+from app.order_code import new_order_code
+from app.idempotency import IDEMPOTENCY_WAIT_SECONDS, checkout_idempotency
+from app.admission import admission
+from app.promo import promo_engine
+from app.payments import FAILED, PAID, PENDING, payment_processor
+from app.cancellation import CANCELLED, REFUNDED
 
 router = APIRouter()
 
@@ -21,6 +34,20 @@ class CartAddResponse(BaseModel):
     message: str
     data: CartAddItem  
 
+class CartSeat(BaseModel):
+    row: str
+    col: int
+
+class CartAddBatch(BaseModel):
+    membership_code: str
+    jadwal_code: str
+    seats: List[CartSeat]
+
+class CartAddBest(BaseModel):
+    membership_code: str
+    jadwal_code: str
+    jumlah: int = Field(ge=1, le=20)
+
 class CartItemResponse(BaseModel):
     cart_id: int
     movie_title: str
@@ -53,10 +80,54 @@ def check_seat_taken(db: Session, jadwal_id: int, row: str, col: int) -> bool:
     return taken is not None
 
 
-@router.post("/cart/add", response_model=CartAddResponse)
+def drop_expired_holds(db: Session, member_id: int, jadwal_id: int, now: datetime):
+    """
+    Hapus item cart member ini yang sudah kedaluwarsa untuk jadwal tsb.
+    (belum di-commit), supaya kursi yang sama bisa di-hold ulang.
+    """
+    deleted = (
+        db.query(Cart)
+        .filter(
+            Cart.membership_id == member_id,
+            Cart.jadwal_id == jadwal_id,
+            Cart.expires_at <= now
+        )
+        .delete(synchronize_session=False)
+    )
+    if deleted:
+        bump_occupancy(db, jadwal_id, held=-deleted)
+        hold_metrics.add("expired", deleted)
+
+
+# ADMISSION CONTROL
+QUEUE_TICKET_HEADER = "X-Queue-Ticket"
+
+
+async def admit_cart_add(item: CartAddItem, ticket: Optional[str] = Header(None, alias=QUEUE_TICKET_HEADER)):
+    async with admission.admit(item.jadwal_code, ticket):
+        yield
+
+
+async def admit_cart_batch(item: CartAddBatch, ticket: Optional[str] = Header(None, alias=QUEUE_TICKET_HEADER)):
+    async with admission.admit(item.jadwal_code, ticket):
+        yield
+
+
+async def admit_cart_best(item: CartAddBest, ticket: Optional[str] = Header(None, alias=QUEUE_TICKET_HEADER)):
+    async with admission.admit(item.jadwal_code, ticket):
+        yield
+
+
+async def admit_checkout(ticket: Optional[str] = Header(None, alias=QUEUE_TICKET_HEADER)):
+    # Isi cart bisa lintas jadwal dan tidak ada di body: cukup batas global.
+    async with admission.admit(None, ticket):
+        yield
+
+
+@router.post("/cart/add", response_model=CartAddResponse, dependencies=[Depends(admit_cart_add)])
 def add_to_cart(item: CartAddItem, db: Session = Depends(get_db)):
 
-    jadwal = db.query(Jadwal).filter(Jadwal.code == item.jadwal_code).first()
+    jadwal = db.query(Jadwal).filter(Jadwal.code == item.jadwal_code, Jadwal.cancelled_at.is_(None)).first()
     if not jadwal:
         raise HTTPException(404, detail=f"Jadwal dengan kode {item.jadwal_code} tidak ditemukan")
 
@@ -67,11 +138,13 @@ def add_to_cart(item: CartAddItem, db: Session = Depends(get_db)):
     if check_seat_taken(db, jadwal.id, item.row, item.col):
         raise HTTPException(400, detail="Kursi sudah terjual")
 
+    now = datetime.now()
     existing_cart = db.query(Cart).filter(
         Cart.membership_id == member.id,
         Cart.jadwal_id == jadwal.id,
         Cart.row == item.row,
-        Cart.col == item.col
+        Cart.col == item.col,
+        active_hold(now)
     ).first()
     
     if existing_cart:
@@ -83,6 +156,7 @@ def add_to_cart(item: CartAddItem, db: Session = Depends(get_db)):
     movie = db.query(Movie).filter(Movie.id == jadwal.movie_id).first()
     movie_price = movie.price if movie else 0
     
+    drop_expired_holds(db, member.id, jadwal.id, now)
 
     new_item = Cart(
         membership_id=member.id,       
@@ -94,54 +168,266 @@ def add_to_cart(item: CartAddItem, db: Session = Depends(get_db)):
         price=movie_price,             
         
         row=item.row,
-        col=item.col
+        col=item.col,
+        expires_at=hold_expiry(now)
     )
     
     db.add(new_item)
+    bump_occupancy(db, jadwal.id, held=1)
     db.commit()
     db.refresh(new_item) 
+    seat_states.hold(jadwal.id, item.row, item.col, new_item.expires_at)
+    hold_metrics.add("created")
     
     return {
         "message": "Tiket berhasil ditambahkan",
         "data": item
     }
 
+MAX_BATCH_SEATS = 20
+
+
+@router.post("/cart/add-batch", dependencies=[Depends(admit_cart_batch)])
+def add_batch_to_cart(item: CartAddBatch, db: Session = Depends(get_db)):
+    """
+    Tambah banyak kursi satu jadwal ke keranjang dalam satu request.
+    Semua kursi dicek dengan satu query kursi terjual dan satu query cart,
+    lalu di-insert sekaligus dengan satu commit.
+    Status per kursi: added | duplicate | sold.
+    """
+
+    if not item.seats:
+        raise HTTPException(400, detail="Daftar kursi kosong")
+    if len(item.seats) > MAX_BATCH_SEATS:
+        raise HTTPException(400, detail=f"Maksimal {MAX_BATCH_SEATS} kursi per request")
+
+    jadwal = db.query(Jadwal).filter(Jadwal.code == item.jadwal_code, Jadwal.cancelled_at.is_(None)).first()
+    if not jadwal:
+        raise HTTPException(404, detail=f"Jadwal dengan kode {item.jadwal_code} tidak ditemukan")
+
+    member = db.query(Membership).filter(Membership.code == item.membership_code).first()
+    if not member:
+        raise HTTPException(404, detail=f"Member dengan kode {item.membership_code} tidak ditemukan")
+
+    movie = db.query(Movie).filter(Movie.id == jadwal.movie_id).first()
+    movie_price = movie.price if movie else 0
+
+    seats = list(dict.fromkeys((s.row, s.col) for s in item.seats))
+    now = datetime.now()
+
+    sold = set(find_taken_seats(db, [(jadwal.id, r, c) for r, c in seats]))
+    in_cart = {
+        f"{r}-{c}"
+        for r, c in db.query(Cart.row, Cart.col).filter(
+            Cart.membership_id == member.id,
+            Cart.jadwal_id == jadwal.id,
+            tuple_(Cart.row, Cart.col).in_(seats),
+            active_hold(now)
+        )
+    }
+
+    hasil = []
+    to_add = []
+    for r, c in seats:
+        label = f"{r}-{c}"
+        if label in sold:
+            hasil.append({"seat": label, "status": "sold"})
+        elif label in in_cart:
+            hasil.append({"seat": label, "status": "duplicate"})
+        else:
+            hasil.append({"seat": label, "status": "added"})
+            to_add.append((r, c))
+
+    expires_at = hold_expiry(now)
+    if to_add:
+        try:
+            drop_expired_holds(db, member.id, jadwal.id, now)
+            db.execute(insert(Cart), [
+                {
+                    "membership_id": member.id,
+                    "membership_code": member.code,
+                    "jadwal_id": jadwal.id,
+                    "studio_id": jadwal.studio_id,
+                    "price": movie_price,
+                    "row": r,
+                    "col": c,
+                    "expires_at": expires_at
+                }
+                for r, c in to_add
+            ])
+            bump_occupancy(db, jadwal.id, held=len(to_add))
+            db.commit()
+        except IntegrityError:
+            # Batch identik yang berjalan bersamaan lolos pre-check lebih dulu.
+            db.rollback()
+            raise HTTPException(400, detail="Kursi sudah diambil, silakan cek keranjang")
+
+        for r, c in to_add:
+            seat_states.hold(jadwal.id, r, c, expires_at)
+        hold_metrics.add("created", len(to_add))
+
+    return {
+        "message": f"{len(to_add)} tiket berhasil ditambahkan",
+        "jadwal_code": jadwal.code,
+        "added": len(to_add),
+        "expires_at": expires_at.isoformat() if to_add else None,
+        "data": hasil
+    }
+
+
+CART_BEST_ATTEMPTS = 3
+
+
+@router.post("/cart/add-best", dependencies=[Depends(admit_cart_best)])
+def add_best_to_cart(item: CartAddBest, db: Session = Depends(get_db)):
+    """
+    Cari blok kursi bersebelahan terbaik lalu langsung masukkan ke keranjang.
+    Kursi ditandai di seat state sebelum insert, jadi request lain di proses
+    yang sama tidak akan mendapat blok yang sama. Seat state bisa tertinggal
+    dari proses lain, jadi blok yang dipilih dicek lagi ke order_seats di
+    dalam transaksi; kalau ada yang sudah terjual (atau insert cart bentrok),
+    seat state dibangun ulang dari DB lalu pencarian diulang, paling banyak
+    CART_BEST_ATTEMPTS kali.
+    """
+
+    jadwal = db.query(Jadwal).filter(Jadwal.code == item.jadwal_code, Jadwal.cancelled_at.is_(None)).first()
+    if not jadwal:
+        raise HTTPException(404, detail=f"Jadwal dengan kode {item.jadwal_code} tidak ditemukan")
+
+    member = db.query(Membership).filter(Membership.code == item.membership_code).first()
+    if not member:
+        raise HTTPException(404, detail=f"Member dengan kode {item.membership_code} tidak ditemukan")
+
+    movie = db.query(Movie).filter(Movie.id == jadwal.movie_id).first()
+    movie_price = movie.price if movie else 0
+
+    for _ in range(CART_BEST_ATTEMPTS):
+        try:
+            state = seat_states.get(db, jadwal.code)
+        except LookupError as e:
+            raise HTTPException(500, detail=str(e))
+
+        now = datetime.now()
+        expires_at = hold_expiry(now)
+
+        with seat_states.lock:
+            block = find_best_block(state, item.jumlah)
+            if block is None:
+                raise HTTPException(404, detail=f"Tidak ada {item.jumlah} kursi bersebelahan yang tersedia")
+            seats = [(block["row"], c) for c in block["cols"]]
+            for r, c in seats:
+                seat_states.hold(jadwal.id, r, c, expires_at)
+
+        conflict = False
+        try:
+            if find_taken_seats(db, [(jadwal.id, r, c) for r, c in seats]):
+                conflict = True
+            else:
+                drop_expired_holds(db, member.id, jadwal.id, now)
+                db.execute(insert(Cart), [
+                    {
+                        "membership_id": member.id,
+                        "membership_code": member.code,
+                        "jadwal_id": jadwal.id,
+                        "studio_id": jadwal.studio_id,
+                        "price": movie_price,
+                        "row": r,
+                        "col": c,
+                        "expires_at": expires_at
+                    }
+                    for r, c in seats
+                ])
+                bump_occupancy(db, jadwal.id, held=len(seats))
+                db.commit()
+        except IntegrityError:
+            conflict = True
+        except Exception:
+            db.rollback()
+            for r, c in seats:
+                seat_states.release(jadwal.id, r, c, expires_at)
+            raise
+
+        if conflict:
+            # Seat state basi atau blok diambil request lain: muat ulang dari DB.
+            db.rollback()
+            for r, c in seats:
+                seat_states.release(jadwal.id, r, c, expires_at)
+            seat_states.invalidate(jadwal.id)
+            continue
+
+        hold_metrics.add("created", len(seats))
+
+        return {
+            "message": "Tiket berhasil ditambahkan",
+            "jadwal_code": jadwal.code,
+            "kursi": [f"{r}-{c}" for r, c in seats],
+            "lintas_lorong": block["lintas_lorong"],
+            "total_price": movie_price * len(seats),
+            "expires_at": expires_at.isoformat()
+        }
+
+    raise HTTPException(409, detail="Kursi berubah saat diproses, silakan coba lagi")
+
 # READ MEMBERSHIP CART
 @router.get("/cart/{membership_code}")
 def get_cart(membership_code: str, db: Session = Depends(get_db)):
-    items = db.query(Cart).filter(Cart.membership_code == membership_code).all()
+    """
+    Isi keranjang member (satu query join), termasuk waktu kedaluwarsa
+    hold tiap kursi dan promo yang akan didapat saat checkout.
+    """
+    rows = (
+        db.query(
+            Cart.id, Cart.row, Cart.col, Cart.price, Cart.expires_at,
+            Jadwal.tanggal, Jadwal.jam, Jadwal.movie_id,
+            Movie.title.label("movie_title"),
+            Studio.name.label("studio_name")
+        )
+        .join(Jadwal, Jadwal.id == Cart.jadwal_id)
+        .outerjoin(Movie, Movie.id == Jadwal.movie_id)
+        .outerjoin(Studio, Studio.id == Jadwal.studio_id)
+        .filter(Cart.membership_code == membership_code)
+        .filter(active_hold(datetime.now()))
+        .order_by(Cart.id)
+        .all()
+    )
     
-    if not items:
+    if not rows:
         return {"message": "Keranjang kosong", "items": [], "total": 0}
 
+    # Order memakai jadwal item pertama, sama seperti saat checkout.
+    first = rows[0]
+    promo_name, discount = promo_engine.get(db).evaluate(
+        len(rows), first.tanggal, membership_code, first.movie_id
+    )
+    eligible = discount > 0
+
     result = []
     total = 0
     
-    for i in items:
-
-        jadwal = db.query(Jadwal).filter(Jadwal.id == i.jadwal_id).first()
-        if not jadwal: continue
-
-        movie = db.query(Movie).filter(Movie.id == jadwal.movie_id).first()
-        studio = db.query(Studio).filter(Studio.id == jadwal.studio_id).first()
-        
-        movie_title = movie.title if movie else "Unknown Movie"
-        studio_name = studio.name if studio else "Unknown Studio"
-        
-        dt_str = f"{jadwal.tanggal} {jadwal.jam}"
-        seat_str = f"{i.row}-{i.col}"
-        
+    for i in rows:
         result.append({
             "cart_id": i.id,
-            "movie_title": movie_title,
-            "studio_name": studio_name,
-            "date_time": dt_str,
-            "seat": seat_str,
-            "price": i.price
+            "movie_title": i.movie_title or "Unknown Movie",
+            "studio_name": i.studio_name or "Unknown Studio",
+            "date_time": f"{i.tanggal} {i.jam}",
+            "seat": f"{i.row}-{i.col}",
+            "price": i.price,
+            "expires_at": i.expires_at.isoformat() if i.expires_at else None,
+            "promo_eligible": eligible
         })
         total += i.price
 
-    return {"items": result, "total_price": total}
+    discount_amount = int(total * discount / 100)
+
+    return {
+        "items": result,
+        "total_price": total,
+        "promo": {
+            "promo_name": promo_name,
+            "discount": discount,
+            "final_price": total - discount_amount
+        }
+    }
 
 # DELETE CART ITEM
 @router.delete("/cart/remove/{cart_id}")
@@ -151,30 +437,110 @@ def remove_cart_item(cart_id: int, db: Session = Depends(get_db)):
         raise HTTPException(404, "Item cart tidak ditemukan")
     
     db.delete(item)
+    bump_occupancy(db, item.jadwal_id, held=-1)
     db.commit()
+    seat_states.release(item.jadwal_id, item.row, item.col, item.expires_at)
+    hold_metrics.add("released")
     return {"message": "Item dihapus dari keranjang"}
 
-@router.post("/checkout", response_model=OrderResponse)
-def checkout_cart(payload: CheckoutRequest, db: Session = Depends(get_db)):
+CHECKOUT_RETRIES = 5
+CHECKOUT_BACKOFF_SECONDS = 0.02
+
+
+def find_taken_seats(db: Session, seats: List[tuple]) -> List[str]:
+    """Cek semua kursi (jadwal_id, row, col) sekaligus; kembalikan yang sudah terjual."""
+    if not seats:
+        return []
+    taken = (
+        db.query(OrderSeat.row, OrderSeat.col)
+        .filter(tuple_(OrderSeat.jadwal_id, OrderSeat.row, OrderSeat.col).in_(seats))
+        .all()
+    )
+    return sorted(f"{r}-{c}" for r, c in taken)
+
+
+def seat_conflict(taken: List[str]) -> HTTPException:
+    return HTTPException(409, detail={
+        "message": f"Gagal: Kursi {', '.join(taken)} baru saja dibeli orang lain.",
+        "kursi_bentrok": taken
+    })
+
+
+def lock_jadwals(db: Session, jadwal_ids) -> set:
+    """Kunci bersama baris jadwal (urut id); 400 kalau ada yang sudah dibatalkan."""
+    if not jadwal_ids:
+        return set()
+    rows = (
+        db.query(Jadwal.id, Jadwal.cancelled_at)
+        .filter(Jadwal.id.in_(list(jadwal_ids)))
+        .order_by(Jadwal.id)
+        .with_for_update(read=True)
+        .all()
+    )
+    if any(cancelled_at is not None for _, cancelled_at in rows):
+        raise HTTPException(400, "Jadwal sudah dibatalkan")
+    return {jid for jid, _ in rows}
+
 
-    cart_items = db.query(Cart).filter(Cart.membership_code == payload.membership_code).all()
+def place_order(db: Session, payload: CheckoutRequest) -> dict:
+    """
+    Satu percobaan checkout dalam satu transaksi: kunci item cart member,
+    cek semua kursi dengan satu query, lalu insert order + kursi secara bulk.
+    Bentrok kursi yang lolos pengecekan tetap ditolak unique constraint
+    (jadwal_id, row, col) di order_seats dan ditangani oleh checkout_cart.
+
+    Pembayaran non-CASH tidak diproses di sini: kursi dikunci lewat order
+    PENDING, lalu worker pembayaran memindahkannya ke PAID / FAILED.
+    """
+
+    member = db.query(Membership).filter(Membership.code == payload.membership_code).first()
+    if not member:
+        raise HTTPException(404, detail=f"Member dengan kode {payload.membership_code} tidak ditemukan")
+
+    now = datetime.now()
+    # Jadwal dikunci bersama (FOR SHARE) sebelum cart, urutan yang sama dengan
+    # cancel_schedule (FOR UPDATE jadwal lalu hapus cart), supaya pembatalan
+    # menunggu checkout ini commit dan order barunya ikut direfund.
+    jadwal_ids = [
+        jid for (jid,) in
+        db.query(Cart.jadwal_id).filter(Cart.membership_id == member.id, active_hold(now)).distinct()
+    ]
+    locked = lock_jadwals(db, jadwal_ids)
+
+    # Kunci lewat membership_id (kolom pertama unique constraint carts) supaya
+    # yang terkunci hanya baris cart member ini, bukan seluruh tabel.
+    cart_items = (
+        db.query(Cart)
+        .filter(Cart.membership_id == member.id)
+        .filter(active_hold(now))
+        .with_for_update()
+        .all()
+    )
     if not cart_items:
         raise HTTPException(400, "Keranjang kosong")
+    # Item yang masuk setelah daftar jadwal di atas dibaca.
+    lock_jadwals(db, {i.jadwal_id for i in cart_items} - locked)
 
-    for item in cart_items:
-        if check_seat_taken(db, item.jadwal_id, item.row, item.col):
-             raise HTTPException(409, detail=f"Gagal: Kursi {item.row}-{item.col} baru saja dibeli orang lain.")
+    held_seats = [(i.jadwal_id, i.row, i.col, i.expires_at) for i in cart_items]
+    taken = find_taken_seats(db, [seat[:3] for seat in held_seats])
+    if taken:
+        raise seat_conflict(taken)
 
-    member = db.query(Membership).filter(Membership.code == payload.membership_code).first()
+    first_item = cart_items[0]
+
+    jadwal = db.query(Jadwal).filter(Jadwal.id == first_item.jadwal_id).first()
+    
+    if not jadwal:
+        raise HTTPException(404, "Data jadwal korup/hilang")
+    if jadwal.cancelled_at is not None:
+        raise HTTPException(400, "Jadwal sudah dibatalkan")
     
     total_price = sum(item.price for item in cart_items)
     seat_count = len(cart_items)
     
-    discount = 0
-    promo_name = "NO PROMO"
-    if seat_count >= 5:
-        promo_name = "BULK 5+"
-        discount = 20 
+    promo_name, discount = promo_engine.get(db).evaluate(
+        seat_count, jadwal.tanggal, member.code, jadwal.movie_id
+    )
     
     discount_amount = int(total_price * discount / 100)
     final_price = total_price - discount_amount
@@ -182,6 +548,7 @@ def checkout_cart(payload: CheckoutRequest, db: Session = Depends(get_db)):
     change = 0
     status_message = "Menunggu Pembayaran" 
     custom_message = "Transaksi Berhasil"  
+    cash_amount = payload.cash_amount
 
     if payload.payment_method.upper() == "CASH":
         user_cash = payload.cash_amount if payload.cash_amount else 0
@@ -197,24 +564,16 @@ def checkout_cart(payload: CheckoutRequest, db: Session = Depends(get_db)):
         else:
             custom_message = "Pembayaran Lunas. Uang Pas."
             
-        status_message = "PAID"
+        status_message = PAID
 
     else:
 
-        payload.cash_amount = final_price
+        cash_amount = final_price
         change = 0
-        custom_message = f"Pembayaran {payload.payment_method} Berhasil"
-        status_message = "PAID"
+        custom_message = f"Menunggu pembayaran {payload.payment_method}"
+        status_message = PENDING
 
-    first_item = cart_items[0]
-
-    jadwal = db.query(Jadwal).filter(Jadwal.id == first_item.jadwal_id).first()
-    
-    if not jadwal:
-        raise HTTPException(404, "Data jadwal korup/hilang")
-    
-    order_code_suffix = uuid.uuid4().hex[:6].upper()
-    order_code = f"ORD-{order_code_suffix}"
+    order_code = new_order_code(db.get_bind())
     
     days = ["Senin", "Selasa", "Rabu", "Kamis", "Jumat", "Sabtu", "Minggu"]
     today_day = days[datetime.now().weekday()]
@@ -233,29 +592,57 @@ def checkout_cart(payload: CheckoutRequest, db: Session = Depends(get_db)):
         discount=discount,
         total_price=total_price,
         final_price=final_price,
-        cash=payload.cash_amount,
+        cash=cash_amount,
         change=change,
         transaction_date=datetime.now().date(),
-        hari=today_day
+        hari=today_day,
+        status=status_message
     )
     db.add(new_order)
     db.flush() 
+    order_id = new_order.id
 
-    for item in cart_items:       
-        order_seat = OrderSeat(
-            order_id=new_order.id,
-            jadwal_id=item.jadwal_id,
-            studio_id=item.studio_id, 
-            row=item.row,
-            col=item.col
-        )
-        db.add(order_seat)
-    
-    for item in cart_items:
-        db.delete(item)
+    db.execute(insert(OrderSeat), [
+        {
+            "order_id": order_id,
+            "jadwal_id": item.jadwal_id,
+            "studio_id": item.studio_id,
+            "row": item.row,
+            "col": item.col
+        }
+        for item in cart_items
+    ])
+
+    db.query(Cart).filter(Cart.id.in_([item.id for item in cart_items])).delete(synchronize_session=False)
+
+    per_jadwal = {}
+    for jadwal_id, _, _, _ in held_seats:
+        per_jadwal[jadwal_id] = per_jadwal.get(jadwal_id, 0) + 1
+
+    for jadwal_id, n in per_jadwal.items():
+        bump_occupancy(db, jadwal_id, sold=n, held=-n)
 
     db.commit()
 
+    for jadwal_id, row, col, expires_at in held_seats:
+        seat_states.release(jadwal_id, row, col, expires_at)
+        seat_states.mark_sold(jadwal_id, row, col)
+    hold_metrics.add("converted", seat_count)
+
+    # Client langsung polling tiketnya: isi cache sebelum worker pembayaran
+    # sempat mengubah status (perubahan status meng-invalidate entry ini).
+    order_cache.put(order_code, {
+        "order_code": order_code,
+        "total_seat": seat_count,
+        "final_price": final_price,
+        "change": change,
+        "status": status_message,
+        "payment_method": payload.payment_method
+    })
+
+    if status_message == PENDING:
+        payment_processor.submit(db.get_bind(), order_id)
+
     return {
         "order_code": order_code,
         "total_seat": seat_count,
@@ -265,32 +652,231 @@ def checkout_cart(payload: CheckoutRequest, db: Session = Depends(get_db)):
         "message": custom_message   
     }
 
+
+def run_checkout(db: Session, payload: CheckoutRequest) -> dict:
+    """
+    Checkout seluruh isi keranjang member.
+    Kursi yang keburu dibeli orang lain menghasilkan 409 berisi daftar
+    kursi yang bentrok. Deadlock/lock timeout di DB dicoba ulang dengan backoff.
+    """
+
+    for attempt in range(CHECKOUT_RETRIES):
+        try:
+            return place_order(db, payload)
+
+        except IntegrityError:
+            db.rollback()
+            seats = [
+                (i.jadwal_id, i.row, i.col)
+                for i in db.query(Cart)
+                .join(Membership, Membership.id == Cart.membership_id)
+                .filter(Membership.code == payload.membership_code)
+                .filter(active_hold(datetime.now()))
+            ]
+            taken = find_taken_seats(db, seats)
+            if taken:
+                raise seat_conflict(taken)
+            # Bukan bentrok kursi (mis. kode order kembar): ulangi.
+
+        except OperationalError:
+            # Deadlock / lock wait timeout: ulangi dengan backoff.
+            db.rollback()
+            time.sleep(CHECKOUT_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random()))
+
+    raise HTTPException(503, "Sistem sedang sibuk, silakan coba checkout lagi")
+
+
+@router.post("/checkout", response_model=OrderResponse, dependencies=[Depends(admit_checkout)])
+def checkout_cart(
+    payload: CheckoutRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db)
+):
+    """
+    Checkout keranjang. Dengan header Idempotency-Key, retry dari client
+    mendapat response pertama apa adanya tanpa menjalankan checkout lagi;
+    request kembar yang datang bersamaan menunggu request yang sedang jalan.
+    """
+    if not idempotency_key:
+        return run_checkout(db, payload)
+
+    key = (payload.membership_code, idempotency_key)
+    fingerprint = (payload.payment_method, payload.cash_amount)
+
+    while True:
+        entry, owner = checkout_idempotency.begin(key, fingerprint)
+        if owner:
+            break
+        if entry.fingerprint != fingerprint:
+            raise HTTPException(422, "Idempotency-Key sudah dipakai untuk request checkout yang berbeda")
+        if not entry.done.wait(IDEMPOTENCY_WAIT_SECONDS):
+            raise HTTPException(409, "Checkout dengan Idempotency-Key ini masih diproses")
+        if entry.abandoned:
+            # Request pertama gagal tanpa hasil: coba jadi pemilik baru.
+            continue
+        if entry.status_code != 200:
+            raise HTTPException(entry.status_code, entry.body, headers={"Idempotent-Replayed": "true"})
+        response.headers["Idempotent-Replayed"] = "true"
+        return entry.body
+
+    try:
+        result = run_checkout(db, payload)
+    except HTTPException as e:
+        # Error klien (keranjang kosong, kursi bentrok) disimpan; 5xx boleh dicoba lagi.
+        if e.status_code < 500:
+            checkout_idempotency.complete(key, entry, e.status_code, e.detail)
+        else:
+            checkout_idempotency.abandon(key, entry)
+        raise
+    except BaseException:
+        checkout_idempotency.abandon(key, entry)
+        raise
+
+    checkout_idempotency.complete(key, entry, 200, result)
+    return result
+
 @router.get("/order/{order_code}", response_model=OrderResponse)
 def get_order(order_code: str, db: Session = Depends(get_db)):  
-    order = db.query(Order).filter(Order.code == order_code).first()
-    if not order:
-        raise HTTPException(404, "Order tidak ditemukan")
+    """Detail order; order yang baru dibuat/dibaca dilayani dari order_cache."""
+    data = order_cache.get(order_code)
+    if data is None:
+        since = order_cache.begin()
+        order = db.query(
+            Order.code, Order.seat_count, Order.final_price, Order.change,
+            Order.status, Order.payment_method
+        ).filter(Order.code == order_code).first()
+        if not order:
+            raise HTTPException(404, "Order tidak ditemukan")
+        data = {
+            "order_code": order.code,
+            "total_seat": order.seat_count,
+            "final_price": order.final_price,
+            "change": order.change if order.change else 0,
+            "status": order.status or PAID,
+            "payment_method": order.payment_method
+        }
+        order_cache.put(order_code, data, since)
     
+    status = data["status"]
     msg = "Transaksi Berhasil"
-    if order.change and order.change > 0:
-        msg = f"Kembalian: Rp {order.change}"
+    if status == PENDING:
+        msg = f"Menunggu pembayaran {data['payment_method']}"
+    elif status == FAILED:
+        msg = "Pembayaran gagal, kursi sudah dilepas"
+    elif status == REFUNDED:
+        msg = "Jadwal dibatalkan, pembayaran dikembalikan"
+    elif status == CANCELLED:
+        msg = "Jadwal dibatalkan"
+    elif data["change"] > 0:
+        msg = f"Kembalian: Rp {data['change']}"
     
     return {
-        "order_code": order.code,
-        "total_seat": order.seat_count,
-        "final_price": order.final_price,
-        "change": order.change if order.change else 0, 
-        "status": "PAID", 
+        "order_code": data["order_code"],
+        "total_seat": data["total_seat"],
+        "final_price": data["final_price"],
+        "change": data["change"], 
+        "status": status, 
         "message": msg
     }
 
-# DELETE CART ITEM
-@router.delete("/cart/remove/{cart_id}")
-def remove_cart_item(cart_id: int, db: Session = Depends(get_db)):
-    item = db.query(Cart).filter(Cart.id == cart_id).first()
-    if not item:
-        raise HTTPException(404, "Pesanan tidak ditemukan")
-    
-    db.delete(item)
-    db.commit()
-    return {"message": "Item cart berhasil dihapus"}        
+
+MAX_HISTORY_PAGE = 100
+
+
+def seat_sort_key(seat: str):
+    row, _, col = seat.partition("-")
+    return (row, int(col) if col.isdigit() else 0)
+
+
+# MEMBER ORDER HISTORY
+@router.get("/members/{membership_code}/orders")
+def member_orders(
+    membership_code: str,
+    limit: int = Query(20, ge=1, le=MAX_HISTORY_PAGE),
+    cursor: Optional[int] = Query(None, description="next_cursor dari halaman sebelumnya"),
+    db: Session = Depends(get_db)
+):
+    """
+    Riwayat order member, terbaru dulu. Paging memakai cursor (id order
+    terakhir) pada index (membership_id, id), jadi halaman berikutnya
+    tetap cepat walaupun member punya ribuan order.
+    """
+    member_id = db.query(Membership.id).filter(Membership.code == membership_code).scalar()
+    if member_id is None:
+        raise HTTPException(404, detail=f"Member dengan kode {membership_code} tidak ditemukan")
+
+    page = db.query(Order.id).filter(Order.membership_id == member_id)
+    if cursor is not None:
+        page = page.filter(Order.id < cursor)
+    page = page.order_by(Order.id.desc()).limit(limit + 1).subquery()
+
+    seats = func.group_concat(OrderSeat.row + "-" + cast(OrderSeat.col, String))
+    rows = (
+        db.query(
+            Order.id, Order.code, Order.status, Order.payment_method,
+            Order.seat_count, Order.final_price, Order.transaction_date,
+            Jadwal.code.label("jadwal_code"), Jadwal.tanggal, Jadwal.jam,
+            Movie.title.label("movie_title"),
+            seats.label("seats")
+        )
+        .select_from(page)
+        .join(Order, Order.id == page.c.id)
+        .outerjoin(Jadwal, Jadwal.id == Order.jadwal_id)
+        .outerjoin(Movie, Movie.id == Jadwal.movie_id)
+        .outerjoin(OrderSeat, OrderSeat.order_id == Order.id)
+        .group_by(
+            Order.id, Order.code, Order.status, Order.payment_method,
+            Order.seat_count, Order.final_price, Order.transaction_date,
+            Jadwal.code, Jadwal.tanggal, Jadwal.jam, Movie.title
+        )
+        .order_by(Order.id.desc())
+        .all()
+    )
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    data = []
+    for r in rows:
+        data.append({
+            "order_code": r.code,
+            "status": r.status or PAID,
+            "movie_title": r.movie_title or "Unknown Movie",
+            "jadwal_code": r.jadwal_code,
+            "date_time": f"{r.tanggal} {r.jam}" if r.tanggal else None,
+            "seats": sorted(r.seats.split(","), key=seat_sort_key) if r.seats else [],
+            "total_seat": r.seat_count,
+            "final_price": r.final_price,
+            "payment_method": r.payment_method,
+            "transaction_date": r.transaction_date.isoformat() if r.transaction_date else None
+        })
+
+    return {
+        "membership_code": membership_code,
+        "count": len(data),
+        "data": data,
+        "next_cursor": rows[-1].id if has_more else None
+    }
+
+
+@router.get("/metrics/orders")
+def get_order_cache_metrics():
+    """Statistik cache order (hit rate get_order)."""
+    return order_cache.stats()
+
+
+@router.get("/metrics/admission")
+def get_admission_metrics():
+    """Slot aktif, panjang antrean, dan jumlah request yang diterima/ditolak."""
+    return admission.stats()
+
+
+@router.get("/metrics/holds")
+def get_hold_metrics():
+    """Jumlah hold kursi yang dibuat, dilepas, kedaluwarsa, dan berhasil dibeli."""
+    return {
+        "hold_minutes": HOLD_MINUTES,
+        **hold_metrics.snapshot()
+    }
+
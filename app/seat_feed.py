@@ -0,0 +1,75 @@
+import asyncio
+import threading
+from typing import Dict, Set
+
+QUEUE_SIZE = 256
+
+
+class Subscriber:
+    """Satu koneksi stream: queue asyncio milik event loop yang membacanya."""
+
+    def __init__(self, jadwal_id: int, loop: asyncio.AbstractEventLoop):
+        self.jadwal_id = jadwal_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+
+def _deliver(sub: Subscriber, event: dict):
+    # Dipanggil di event loop subscriber. Kalau client terlalu lambat,
+    # buang antrean dan minta client resync dari snapshot baru.
+    if sub.queue.full():
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait({"type": "resync", "jadwal_id": sub.jadwal_id})
+        return
+    sub.queue.put_nowait(event)
+
+
+class SeatFeed:
+    """
+    Publisher perubahan kursi per jadwal. Endpoint cart/checkout berjalan di
+    threadpool, jadi event dikirim ke tiap subscriber lewat
+    loop.call_soon_threadsafe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: Dict[int, Set[Subscriber]] = {}
+
+    def subscribe(self, jadwal_id: int) -> Subscriber:
+        sub = Subscriber(jadwal_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subs.setdefault(jadwal_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            subs = self._subs.get(sub.jadwal_id)
+            if subs is None:
+                return
+            subs.discard(sub)
+            if not subs:
+                del self._subs[sub.jadwal_id]
+
+    def subscriber_count(self, jadwal_id: int) -> int:
+        with self._lock:
+            return len(self._subs.get(jadwal_id, ()))
+
+    def publish(self, jadwal_id: int, event: dict):
+        with self._lock:
+            subs = list(self._subs.get(jadwal_id, ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(_deliver, sub, event)
+            except RuntimeError:
+                # Event loop subscriber sudah ditutup.
+                self.unsubscribe(sub)
+
+    def publish_all(self, event: dict):
+        with self._lock:
+            jadwal_ids = list(self._subs)
+        for jadwal_id in jadwal_ids:
+            self.publish(jadwal_id, dict(event, jadwal_id=jadwal_id))
+
+
+seat_feed = SeatFeed()
@@ -0,0 +1,543 @@
+import base64
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models import Cart, Jadwal, Movie, OrderSeat, Studio, StudioSeat
+from app.seat_feed import seat_feed
+from app.holds import active_hold
+from app.occupancy import occupancy_versions
+
+SEAT_STATE_CHECK_SECONDS = float(os.getenv("SEAT_STATE_CHECK_SECONDS", "1"))
+
+SOLD = "X"
+HELD = "~"
+FREE = "O"
+
+STATE_NAMES = {SOLD: "sold", HELD: "held", FREE: "free"}
+
+_seed_lock = threading.Lock()
+_last_seed = 0
+
+
+def version_seed() -> int:
+    """
+    Version awal state yang baru dibangun: mikrodetik epoch, dan selalu
+    lebih besar dari seed sebelumnya. Setelah rebuild (invalidate/evict)
+    version tetap naik, jadi client bisa memakainya sebagai kursor resync.
+    """
+    global _last_seed
+    with _seed_lock:
+        _last_seed = max(time.time_ns() // 1000, _last_seed + 1)
+        return _last_seed
+
+
+def aisle_after(cols: List[int]) -> int:
+    """Nomor kursi terakhir di sisi kiri lorong."""
+    if len(cols) <= 6:
+        return len(cols) // 2
+    return 6
+
+
+def render_seat_lines(rows: List[str], cols: List[int], symbol_at: Callable[[int, int], str]) -> List[str]:
+    """
+    Bikin list string tampilan kursi. symbol_at(row_index, col_index)
+    mengembalikan simbol kursi (O / X / ~).
+    """
+    if not rows or not cols:
+        return ["NO SEATS"]
+
+    aisle = aisle_after(cols)
+
+    lines: List[str] = []
+    lines.append("          SCREEN")
+
+    left_nums = [str(c) for c in cols if c <= aisle]
+    right_nums = [str(c) for c in cols if c > aisle]
+    lines.append(f"   {' '.join(left_nums)}   {' '.join(right_nums)}")
+
+    for ri, r in enumerate(rows):
+        left_syms = []
+        right_syms = []
+        for ci, c in enumerate(cols):
+            sym = symbol_at(ri, ci)
+            if c <= aisle:
+                left_syms.append(sym)
+            else:
+                right_syms.append(sym)
+
+        L = " ".join(left_syms)
+        R = " ".join(right_syms)
+        lines.append(f"{r}  {L}   {R}")
+
+    return lines
+
+
+class SeatState:
+    """
+    Status kursi satu jadwal dalam bentuk bitmap.
+
+    sold[i] / held[i] adalah bitmask untuk baris ke-i; bit ke-j mewakili
+    kolom ke-j (urutan self.cols). Satu kursi bisa ada di cart lebih dari
+    satu member, jadi tiap hold per kursi dicatat di _holds beserta waktu
+    kedaluwarsanya (None = tidak kedaluwarsa).
+    """
+
+    def __init__(self, jadwal_id: int, jadwal_code: str, movie_title: str,
+                 studio_name: str, rows: List[str], cols: List[int]):
+        self.jadwal_id = jadwal_id
+        self.jadwal_code = jadwal_code
+        self.movie_title = movie_title
+        self.studio_name = studio_name
+        self.rows = rows
+        self.cols = cols
+        self.row_index = {r: i for i, r in enumerate(rows)}
+        self.col_index = {c: i for i, c in enumerate(cols)}
+        self.sold = [0] * len(rows)
+        self.held = [0] * len(rows)
+        self._holds: Dict[Tuple[int, int], List[Optional[datetime]]] = {}
+        self.next_expiry: Optional[datetime] = None
+        self.version = 0
+        # Versi jadwal_occupancy saat state dibangun, dan kapan terakhir dicek.
+        self.db_version = 0
+        self.checked_at = 0.0
+        self._display: Optional[Tuple[int, List[str]]] = None
+        self._compact: Optional[Tuple[int, dict]] = None
+
+    def _locate(self, row: str, col: int) -> Optional[Tuple[int, int]]:
+        ri = self.row_index.get(row)
+        ci = self.col_index.get(col)
+        if ri is None or ci is None:
+            return None
+        return ri, ci
+
+    def symbol(self, ri: int, ci: int) -> str:
+        bit = 1 << ci
+        if self.sold[ri] & bit:
+            return SOLD
+        if self.held[ri] & bit:
+            return HELD
+        return FREE
+
+    def mark_sold(self, row: str, col: int) -> bool:
+        pos = self._locate(row, col)
+        if pos is None:
+            return False
+        ri, ci = pos
+        self.sold[ri] |= 1 << ci
+        self.version += 1
+        return True
+
+    def mark_free(self, row: str, col: int) -> bool:
+        """Kebalikan mark_sold, mis. saat pembayaran order gagal."""
+        pos = self._locate(row, col)
+        if pos is None:
+            return False
+        ri, ci = pos
+        self.sold[ri] &= ~(1 << ci)
+        self.version += 1
+        return True
+
+    def hold(self, row: str, col: int, expires_at: Optional[datetime] = None) -> bool:
+        pos = self._locate(row, col)
+        if pos is None:
+            return False
+        ri, ci = pos
+        self._holds.setdefault(pos, []).append(expires_at)
+        self.held[ri] |= 1 << ci
+        if expires_at is not None and (self.next_expiry is None or expires_at < self.next_expiry):
+            self.next_expiry = expires_at
+        self.version += 1
+        return True
+
+    def release(self, row: str, col: int, expires_at: Optional[datetime] = None) -> bool:
+        pos = self._locate(row, col)
+        if pos is None or expires_at not in self._holds.get(pos, ()):
+            # Hold sudah hilang (mis. sudah kedaluwarsa di memori).
+            return False
+        ri, ci = pos
+        self._holds[pos].remove(expires_at)
+        if not self._holds[pos]:
+            del self._holds[pos]
+            self.held[ri] &= ~(1 << ci)
+        self.version += 1
+        return True
+
+    def expire(self, now: datetime) -> List[Tuple[str, int]]:
+        """Buang hold yang sudah kedaluwarsa. Mengembalikan kursi yang berubah."""
+        if self.next_expiry is None or self.next_expiry > now:
+            return []
+
+        changed = []
+        next_expiry = None
+        for pos in list(self._holds):
+            alive = [e for e in self._holds[pos] if e is None or e > now]
+            if len(alive) != len(self._holds[pos]):
+                ri, ci = pos
+                if alive:
+                    self._holds[pos] = alive
+                else:
+                    del self._holds[pos]
+                    self.held[ri] &= ~(1 << ci)
+                self.version += 1
+                changed.append((self.rows[ri], self.cols[ci]))
+            for e in alive:
+                if e is not None and (next_expiry is None or e < next_expiry):
+                    next_expiry = e
+        self.next_expiry = next_expiry
+        return changed
+
+    def display(self) -> List[str]:
+        if self._display is None or self._display[0] != self.version:
+            self._display = (self.version, render_seat_lines(self.rows, self.cols, self.symbol))
+        return self._display[1]
+
+    def compact(self) -> dict:
+        """
+        Format ringkas untuk client mobile. sold/held adalah bitmap base64:
+        tiap baris row_stride byte little-endian, bit ke-j = kolom cols[j].
+        Kursi terjual tidak ikut ditandai di held.
+        """
+        if self._compact is None or self._compact[0] != self.version:
+            stride = (len(self.cols) + 7) // 8
+
+            def pack(masks: List[int]) -> str:
+                raw = b"".join(m.to_bytes(stride, "little") for m in masks)
+                return base64.b64encode(raw).decode("ascii")
+
+            held_only = [h & ~s for h, s in zip(self.held, self.sold)]
+            self._compact = (self.version, {
+                "rows": self.rows,
+                "cols": self.cols,
+                "aisle_after": aisle_after(self.cols),
+                "encoding": "bitmap-base64-le",
+                "row_stride": stride,
+                "sold": pack(self.sold),
+                "held": pack(held_only),
+                "version": self.version,
+            })
+        return self._compact[1]
+
+    def seat_event(self, row: str, col: int) -> dict:
+        ri, ci = self._locate(row, col)
+        return {
+            "type": "diff",
+            "jadwal_id": self.jadwal_id,
+            "version": self.version,
+            "row": row,
+            "col": col,
+            "state": STATE_NAMES[self.symbol(ri, ci)],
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "type": "snapshot",
+            "jadwal_code": self.jadwal_code,
+            "version": self.version,
+            "movie_title": self.movie_title,
+            "studio": self.studio_name,
+            "display": self.display(),
+        }
+
+
+AISLE_PENALTY = 3.0
+ROW_WEIGHT = 1.5
+
+
+def find_best_block(state: SeatState, size: int) -> Optional[dict]:
+    """
+    Cari blok `size` kursi bersebelahan yang kosong (tidak terjual, tidak di
+    cart). Skor lebih kecil lebih baik: dekat baris tengah, dekat kolom
+    tengah, dan tidak terpotong lorong.
+    Dipanggil dengan seat_states.lock dipegang.
+    """
+    n_cols = len(state.cols)
+    n_rows = len(state.rows)
+    if size < 1 or size > n_cols:
+        return None
+
+    full = (1 << n_cols) - 1
+    aisle = aisle_after(state.cols)
+    left_count = sum(1 for c in state.cols if c <= aisle)
+    mid_row = (n_rows - 1) / 2
+    mid_col = (n_cols - 1) / 2
+
+    best = None
+    # Baris diperiksa dari tengah ke luar; berhenti kalau jarak barisnya
+    # saja sudah lebih buruk dari skor terbaik.
+    for ri in sorted(range(n_rows), key=lambda i: abs(i - mid_row)):
+        if best is not None and abs(ri - mid_row) * ROW_WEIGHT >= best[0]:
+            break
+        free = ~(state.sold[ri] | state.held[ri]) & full
+        starts = free
+        for k in range(1, size):
+            starts &= free >> k
+
+        while starts:
+            low = starts & -starts
+            start = low.bit_length() - 1
+            starts ^= low
+
+            crosses = 0 < left_count and start < left_count < start + size
+            score = (
+                abs(ri - mid_row) * ROW_WEIGHT
+                + abs(start + (size - 1) / 2 - mid_col)
+                + (AISLE_PENALTY if crosses else 0)
+            )
+            if best is None or score < best[0]:
+                best = (score, ri, start, crosses)
+
+    if best is None:
+        return None
+
+    score, ri, start, crosses = best
+    return {
+        "row": state.rows[ri],
+        "cols": state.cols[start:start + size],
+        "lintas_lorong": crosses,
+        "skor": round(score, 2),
+    }
+
+
+class SeatStateCache:
+    """
+    Cache SeatState per jadwal. Transaksi cart/checkout meng-update state
+    yang sudah ada di cache; jadwal yang belum ada dibangun ulang dari DB
+    saat pertama dibaca.
+
+    Update langsung itu hanya terjadi di proses yang menangani transaksi.
+    Setiap check_interval detik, sebelum dipakai, versi state dibandingkan
+    dengan jadwal_occupancy.version; state yang berbeda (kursi diubah proses
+    lain) dibuang lalu dibangun ulang.
+    """
+
+    def __init__(self, check_interval: float = SEAT_STATE_CHECK_SECONDS):
+        self.check_interval = check_interval
+        self.lock = threading.RLock()
+        self._by_id: Dict[int, SeatState] = {}
+        self._id_by_code: Dict[str, int] = {}
+        self._epochs: Dict[int, int] = {}
+
+    def lookup(self, jadwal_code: str) -> Optional[SeatState]:
+        with self.lock:
+            jadwal_id = self._id_by_code.get(jadwal_code)
+            state = self._by_id.get(jadwal_id) if jadwal_id is not None else None
+            if state is not None:
+                self._expire(state, datetime.now())
+            return state
+
+    def _expire(self, state: SeatState, now: datetime):
+        for row, col in state.expire(now):
+            seat_feed.publish(state.jadwal_id, state.seat_event(row, col))
+
+    def expire(self, jadwal_id: int, now: Optional[datetime] = None):
+        """Buang hold kedaluwarsa dari state jadwal ini (dipakai sweeper)."""
+        with self.lock:
+            state = self._by_id.get(jadwal_id)
+            if state is not None:
+                self._expire(state, now or datetime.now())
+
+    def get(self, db: Session, jadwal_code: str) -> Optional[SeatState]:
+        """Ambil state dari cache, atau bangun dari DB. None jika jadwal tidak ada."""
+        states, incomplete = self.get_many(db, [jadwal_code])
+        if incomplete:
+            raise LookupError("Data studio atau film untuk jadwal ini tidak lengkap.")
+        return states.get(jadwal_code)
+
+    def get_many(self, db: Session, jadwal_codes: List[str]) -> Tuple[Dict[str, SeatState], List[str]]:
+        """
+        Ambil state banyak jadwal sekaligus. Jadwal yang belum ada di cache
+        dimuat bersama dengan satu query IN per tabel.
+        Mengembalikan (state per kode, kode jadwal yang data studio/filmnya tidak lengkap).
+        """
+        found: Dict[str, SeatState] = {}
+        missing: List[str] = []
+        for code in jadwal_codes:
+            state = self.lookup(code)
+            if state is not None:
+                found[code] = state
+            else:
+                missing.append(code)
+
+        for state in self._drop_stale(db, list(found.values())):
+            del found[state.jadwal_code]
+            missing.append(state.jadwal_code)
+
+        if not missing:
+            return found, []
+
+        jadwals = db.query(Jadwal).filter(Jadwal.code.in_(missing), Jadwal.cancelled_at.is_(None)).all()
+        if not jadwals:
+            return found, []
+
+        loaded = self._load(db, jadwals)
+
+        incomplete = []
+        for j in jadwals:
+            if j.id in loaded:
+                found[j.code] = loaded[j.id]
+            else:
+                incomplete.append(j.code)
+        return found, incomplete
+
+    def get_for_jadwals(self, db: Session, jadwals: List[Jadwal]) -> Dict[int, SeatState]:
+        """Sama seperti get_many, tapi untuk baris Jadwal yang sudah di-query."""
+        found: Dict[int, SeatState] = {}
+        missing: List[Jadwal] = []
+        with self.lock:
+            now = datetime.now()
+            for j in jadwals:
+                state = self._by_id.get(j.id)
+                if state is not None:
+                    self._expire(state, now)
+                    found[j.id] = state
+                else:
+                    missing.append(j)
+
+        stale = {state.jadwal_id for state in self._drop_stale(db, list(found.values()))}
+        for j in jadwals:
+            if j.id in stale:
+                del found[j.id]
+                missing.append(j)
+
+        if missing:
+            found.update(self._load(db, missing))
+        return found
+
+    def _drop_stale(self, db: Session, states: List[SeatState]) -> List[SeatState]:
+        """Buang dari cache state yang versinya tertinggal dari DB; kembalikan yang dibuang."""
+        now = time.monotonic()
+        due = [s for s in states if now - s.checked_at >= self.check_interval]
+        if not due:
+            return []
+
+        versions = occupancy_versions(db, [s.jadwal_id for s in due])
+        stale = []
+        for state in due:
+            if versions[state.jadwal_id] == state.db_version:
+                state.checked_at = now
+            else:
+                stale.append(state)
+        for state in stale:
+            self.invalidate(state.jadwal_id)
+        return stale
+
+    def _load(self, db: Session, jadwals: List[Jadwal]) -> Dict[int, SeatState]:
+        with self.lock:
+            epochs = {j.id: self._epochs.get(j.id, 0) for j in jadwals}
+
+        # Versi dibaca sebelum kursi: perubahan di antaranya membuat state
+        # tampak basi pada pengecekan berikutnya, bukan sebaliknya.
+        versions = occupancy_versions(db, [j.id for j in jadwals])
+        checked_at = time.monotonic()
+        loaded = load_seat_states(db, jadwals)
+        for state in loaded.values():
+            state.db_version = versions[state.jadwal_id]
+            state.checked_at = checked_at
+
+        with self.lock:
+            for state in loaded.values():
+                # Ada perubahan kursi selama query berjalan: jangan simpan
+                # hasil yang mungkin sudah basi.
+                if epochs[state.jadwal_id] == self._epochs.get(state.jadwal_id, 0):
+                    self._by_id[state.jadwal_id] = state
+                    self._id_by_code[state.jadwal_code] = state.jadwal_id
+        return loaded
+
+    def _apply(self, jadwal_id: int, action: str, row: str, col: int, *args):
+        with self.lock:
+            self._epochs[jadwal_id] = self._epochs.get(jadwal_id, 0) + 1
+            state = self._by_id.get(jadwal_id)
+            if state is not None and getattr(state, action)(row, col, *args):
+                seat_feed.publish(jadwal_id, state.seat_event(row, col))
+
+    def hold(self, jadwal_id: int, row: str, col: int, expires_at: Optional[datetime] = None):
+        self._apply(jadwal_id, "hold", row, col, expires_at)
+
+    def release(self, jadwal_id: int, row: str, col: int, expires_at: Optional[datetime] = None):
+        self._apply(jadwal_id, "release", row, col, expires_at)
+
+    def mark_sold(self, jadwal_id: int, row: str, col: int):
+        self._apply(jadwal_id, "mark_sold", row, col)
+
+    def mark_free(self, jadwal_id: int, row: str, col: int):
+        self._apply(jadwal_id, "mark_free", row, col)
+
+    def invalidate(self, jadwal_id: int):
+        with self.lock:
+            self._epochs[jadwal_id] = self._epochs.get(jadwal_id, 0) + 1
+            state = self._by_id.pop(jadwal_id, None)
+            if state is not None:
+                self._id_by_code.pop(state.jadwal_code, None)
+        seat_feed.publish(jadwal_id, {"type": "resync", "jadwal_id": jadwal_id})
+
+    def clear(self):
+        with self.lock:
+            for jadwal_id in self._by_id:
+                self._epochs[jadwal_id] = self._epochs.get(jadwal_id, 0) + 1
+            self._by_id.clear()
+            self._id_by_code.clear()
+        seat_feed.publish_all({"type": "resync"})
+
+
+def load_seat_states(db: Session, jadwals: List[Jadwal]) -> Dict[int, SeatState]:
+    """
+    Bangun SeatState untuk banyak jadwal: satu query IN per tabel, lalu
+    dikelompokkan di memori. Jadwal tanpa studio/film tidak ikut dikembalikan.
+    """
+    jadwal_ids = [j.id for j in jadwals]
+    studio_ids = {j.studio_id for j in jadwals}
+    movie_ids = {j.movie_id for j in jadwals}
+
+    studios = {s.id: s for s in db.query(Studio).filter(Studio.id.in_(studio_ids))}
+    movies = {m.id: m for m in db.query(Movie).filter(Movie.id.in_(movie_ids))}
+
+    layout: Dict[int, Tuple[set, set]] = {sid: (set(), set()) for sid in studios}
+    seat_rows = (
+        db.query(StudioSeat.studio_id, StudioSeat.row, StudioSeat.col)
+        .filter(StudioSeat.studio_id.in_(list(studios)))
+    )
+    for sid, r, c in seat_rows:
+        layout[sid][0].add(r)
+        layout[sid][1].add(c)
+
+    states: Dict[int, SeatState] = {}
+    for j in jadwals:
+        studio = studios.get(j.studio_id)
+        movie = movies.get(j.movie_id)
+        if not studio or not movie:
+            continue
+        rows, cols = layout[studio.id]
+        states[j.id] = SeatState(
+            jadwal_id=j.id,
+            jadwal_code=j.code,
+            movie_title=movie.title,
+            studio_name=studio.name,
+            rows=sorted(rows),
+            cols=sorted(cols),
+        )
+
+    sold = db.query(OrderSeat.jadwal_id, OrderSeat.row, OrderSeat.col).filter(OrderSeat.jadwal_id.in_(jadwal_ids))
+    for jid, r, c in sold:
+        if jid in states:
+            states[jid].mark_sold(r, c)
+
+    held = (
+        db.query(Cart.jadwal_id, Cart.row, Cart.col, Cart.expires_at)
+        .filter(Cart.jadwal_id.in_(jadwal_ids))
+        .filter(active_hold(datetime.now()))
+    )
+    for jid, r, c, expires_at in held:
+        if jid in states:
+            states[jid].hold(r, c, expires_at)
+
+    for state in states.values():
+        state.version = version_seed()
+    return states
+
+
+seat_states = SeatStateCache()
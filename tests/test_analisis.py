@@ -188,6 +188,22 @@ def test_tiff_top_revenue_daily(seed_data_tiff):
     assert hasil["film_juara"] == "Action Movie"
     assert float(hasil["pendapatan"]) == 150000.0
 
+def test_tiff_top_revenue_weekly_fills_empty(seed_data_tiff):
+    res = client.get("/analisis/top-revenue-films?period=minggu")
+    assert res.status_code == 200
+
+    hasil = res.json()["hasil_analisis"]
+    assert len(hasil) == 5
+    assert hasil[0]["film_juara"] == "Action Movie"
+    assert all(x["film_juara"] == "Tidak ada transaksi" for x in hasil[1:])
+
+def test_filmpopuler_weekly_per_minggu(seed_data):
+    res = client.get("/analisis/filmpopuler?periode=mingguan")
+    data = res.json()["data"]
+    assert [w["minggu_ke"] for w in data] == [1, 2, 3, 4, 5]
+    assert data[0]["film_terlaris"]["title"] == "Film A"
+    assert data[1]["data"] == []
+
 def test_tiff_top_customers_monthly(seed_data_tiff):
     res = client.get("/analisis/top-customers?period=bulan")
     assert res.status_code == 200
@@ -197,6 +213,28 @@ def test_tiff_top_customers_monthly(seed_data_tiff):
     assert bulan_des["pelanggan_juara"] == "Tester"
     assert bulan_des["jumlah_transaksi"] == 3
 
+def test_tiff_failed_order_excluded(seed_data_tiff):
+    db = TestingSessionLocal()
+    jd2 = db.query(Jadwal).filter(Jadwal.code == "JD2").first()
+    mem = db.query(Membership).filter(Membership.code == "MM1").first()
+    for code, status in [("ORF", "FAILED"), ("ORP", "PENDING"), ("ORR", "REFUNDED")]:
+        db.add(Order(code=code, membership_id=mem.id, membership_code="MM1", jadwal_id=jd2.id,
+                     payment_method="QRIS", seat_count=5, final_price=500000,
+                     transaction_date=datetime.date(2024, 12, 1), status=status))
+    db.commit()
+    db.close()
+
+    res = client.get("/analisis/top-revenue-films?period=hari")
+    hasil = next(x for x in res.json()["hasil_analisis"] if x["periode"].startswith("Tanggal 1 "))
+    assert hasil["film_juara"] == "Action Movie"
+    assert float(hasil["pendapatan"]) == 150000.0
+
+    res = client.get("/analisis/top-customers?period=bulan")
+    assert res.json()["hasil_analisis"][0]["jumlah_transaksi"] == 3
+
+    res = client.get("/analisis/filmpopuler?periode=harian&hari=1")
+    assert sum(r["total"] for r in res.json()["data"]) == 3
+
 def test_tiff_most_busiest_day(seed_data_tiff):
 
     res = client.get("/analisis/most-busiest-day?bulan=12&tahun=2024")
@@ -237,4 +275,46 @@ def test_kursipopuler_bulanan(seed_data):
     response = client.get("/analisis/kursipopuler/bulanan?tanggal=2024-12-05")
     assert response.status_code == 200
     data = response.json()
-    assert data["mode"] == "bulanan"
\ No newline at end of file
+    assert data["mode"] == "bulanan"
+
+def test_promo_simulasi_tie_break_matches_checkout():
+    import pandas as pd
+    from app.promo import CompiledPromos
+    from app.promo_sim import OrderColumns, discount_percent
+
+    rules = [
+        {"code": "B1", "name": "Alpha", "discount": 10, "priority": 5, "min_seats": 1},
+        {"code": "A1", "name": "Zeta", "discount": 25, "priority": 5, "min_seats": 1},
+    ]
+    cols = OrderColumns(pd.DataFrame([{
+        "seat_count": 2, "total_price": 100000, "final_price": 100000, "promo_name": None,
+        "membership_code": "MEM001", "tanggal": datetime.date(2024, 12, 15), "movie_id": 1,
+    }]))
+    checkout = CompiledPromos(rules, {}).evaluate(2, datetime.date(2024, 12, 15), "MEM001", 1)
+    assert checkout == ("Zeta", 25)
+    assert discount_percent(cols, rules, {}).tolist() == [25]
+
+
+def test_tiff_promo_simulasi(seed_data_tiff):
+
+    payload = {"skenario": [
+        {"nama": "BULK 2+", "rules": [{"name": "BULK 2+", "discount": 10, "min_seats": 2}]},
+        {"nama": "DRAMA", "rules": [{"name": "DRAMA", "discount": 20, "movie_codes": "MV2"}]}
+    ]}
+    response = client.post("/analisis/promo-simulasi?refresh=true", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["aktual"]["jumlah_order"] == 3
+    assert data["aktual"]["pendapatan"] == 190000
+
+    bulk, drama = data["skenario"]
+    assert bulk["biaya_diskon"] == 10000
+    assert bulk["delta_pendapatan"] == -10000
+    assert bulk["order_berubah_harga"] == 1
+    assert drama["pendapatan"] == 182000
+    assert drama["order_berpromo"] == 1
+
+    response = client.post("/analisis/promo-simulasi", json={"skenario": [
+        {"nama": "X", "rules": [{"name": "X", "discount": 150}]}
+    ]})
+    assert response.status_code == 400
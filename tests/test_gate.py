@@ -0,0 +1,153 @@
+import pytest
+from fastapi.testclient import TestClient
+from datetime import date, time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.main import app
+from app.database import Base, get_db
+from app.models import Membership, Movie, Studio, Jadwal, Order, OrderSeat
+from app.gate import gate_rosters
+
+
+engine = create_engine(
+    "sqlite://",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+
+TestingSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=engine
+)
+
+Base.metadata.create_all(bind=engine)
+
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+app.dependency_overrides[get_db] = override_get_db
+client = TestClient(app)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed_data():
+    db = TestingSessionLocal()
+    member = Membership(code="MEM001", nama="Tester")
+    movie = Movie(code="MOV001", title="Avatar", genre="Action",
+                  durasi=120, price=50000, rating="SU", director="James")
+    studio = Studio(name="Studio 1")
+    db.add_all([member, movie, studio])
+    db.commit()
+
+    jadwals = [
+        Jadwal(code=code, movie_id=movie.id, studio_id=studio.id,
+               tanggal=date(2024, 12, 15), jam=time(19, 0))
+        for code in ("GATE01", "GATE02")
+    ]
+    db.add_all(jadwals)
+    db.commit()
+
+    for i, (status, jadwal) in enumerate([
+        ("PAID", jadwals[0]), ("PAID", jadwals[0]), ("PENDING", jadwals[0]), ("PAID", jadwals[1]),
+        (None, jadwals[0])   # order lama sebelum ada kolom status
+    ]):
+        order = Order(code=f"ORD-GATE{i}", membership_id=member.id, membership_code="MEM001",
+                      jadwal_id=jadwal.id, jadwal_code=jadwal.code, payment_method="QRIS",
+                      seat_count=2, final_price=100000, status=status)
+        db.add(order)
+        db.flush()
+        db.add_all([
+            OrderSeat(order_id=order.id, jadwal_id=jadwal.id, row="A", col=2 * i + 1),
+            OrderSeat(order_id=order.id, jadwal_id=jadwal.id, row="A", col=2 * i + 2),
+        ])
+    db.commit()
+    db.close()
+    gate_rosters.clear()
+
+
+def scan(order_code, jadwal_code="GATE01"):
+    return client.post("/gate/scan", json={"jadwal_code": jadwal_code, "order_code": order_code})
+
+
+def test_preload_roster():
+    res = client.post("/gate/GATE01/preload")
+    assert res.status_code == 200
+    assert res.json()["total_order"] == 3
+    assert res.json()["total_kursi"] == 6
+    assert client.post("/gate/NOPE/preload").status_code == 404
+
+
+def test_scan_valid_then_duplicate():
+    res = scan("ORD-GATE0")
+    assert res.status_code == 200
+    assert res.json()["status"] == "VALID"
+    assert res.json()["seats"] == ["A-1", "A-2"]
+
+    dup = scan("ORD-GATE0")
+    assert dup.status_code == 409
+    assert dup.json()["detail"]["checked_in_at"] == res.json()["checked_in_at"]
+
+    db = TestingSessionLocal()
+    order = db.query(Order).filter(Order.code == "ORD-GATE0").first()
+    db.close()
+    assert order.checked_in_at.isoformat() == res.json()["checked_in_at"]
+
+
+def test_scan_accepts_legacy_order_without_status():
+    res = scan("ORD-GATE4")
+    assert res.status_code == 200
+    assert res.json()["seats"] == ["A-9", "A-10"]
+
+    # Order lama yang belum ada di roster (dicek langsung ke DB) juga valid.
+    db = TestingSessionLocal()
+    jadwal = db.query(Jadwal).filter(Jadwal.code == "GATE01").first()
+    db.add(Order(code="ORD-GATE8", membership_id=1, membership_code="MEM001",
+                 jadwal_id=jadwal.id, jadwal_code="GATE01", payment_method="CASH",
+                 seat_count=0, final_price=0, status=None))
+    db.commit()
+    db.close()
+    assert scan("ORD-GATE8").status_code == 200
+
+
+def test_scan_rejects_invalid_tickets():
+    assert scan("ORD-NOTHING").status_code == 404
+    assert scan("ORD-GATE3").status_code == 400   # jadwal lain
+    assert scan("ORD-GATE2").status_code == 400   # belum dibayar
+
+
+def test_duplicate_detected_across_workers():
+    # Worker lain sudah check-in order ini langsung di DB; roster di
+    # worker ini belum tahu, tapi UPDATE bersyarat tetap menolaknya.
+    db = TestingSessionLocal()
+    db.query(Order).filter(Order.code == "ORD-GATE1").update({"checked_in_at": date(2024, 12, 15)})
+    db.commit()
+    db.close()
+
+    res = scan("ORD-GATE1")
+    assert res.status_code == 409
+
+
+def test_concurrent_scans_admit_once():
+    db = TestingSessionLocal()
+    jadwal = db.query(Jadwal).filter(Jadwal.code == "GATE02").first()
+    order = Order(code="ORD-GATE9", membership_id=1, membership_code="MEM001",
+                  jadwal_id=jadwal.id, jadwal_code="GATE02", payment_method="CASH",
+                  seat_count=1, final_price=50000, status="PAID")
+    db.add(order)
+    db.commit()
+    db.close()
+
+    client.post("/gate/GATE02/preload")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(lambda _: scan("ORD-GATE9", "GATE02"), range(16)))
+
+    statuses = [r.status_code for r in responses]
+    assert statuses.count(200) == 1
+    assert statuses.count(409) == 15
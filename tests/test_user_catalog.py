@@ -1,10 +1,17 @@
+import base64
+import time
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 from datetime import date
 from app.database import SessionLocal
 from app.models import Movie, Jadwal, Studio, StudioSeat, OrderSeat, Cart
+from app.routers.user_catalog import get_today
+from app.cache import NowPlayingCache, now_playing_cache
+from app.seat_state import SeatState, find_best_block, seat_states
+from app.occupancy import bump_occupancy
 
+app.dependency_overrides[get_today] = lambda: date(2024, 12, 1)
 client = TestClient(app)
 
 
@@ -88,8 +95,39 @@ def test_now_playing(db):
     json = response.json()
     assert "data" in json
     assert json["count"] >= 1
+    assert "etag" in response.headers
 
 
+def test_now_playing_etag_not_modified():
+    first = client.get("/now_playing")
+    etag = first.headers["etag"]
+
+    response = client.get("/now_playing", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_now_playing_rebuilt_after_invalidate():
+    first = client.get("/now_playing")
+
+    now_playing_cache.invalidate()
+    second = client.get("/now_playing")
+
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers["etag"] == first.headers["etag"]
+
+
+
+def test_now_playing_cache_expires_after_ttl():
+    # Penulisan di worker lain tidak meng-invalidate cache proses ini.
+    cache = NowPlayingCache(ttl=0.05)
+    entry, generation = cache.get(date(2024, 12, 1))
+    assert entry is None
+    cache.store(date(2024, 12, 1), {"count": 1}, generation)
+    assert cache.get(date(2024, 12, 1))[0] is not None
+    time.sleep(0.1)
+    assert cache.get(date(2024, 12, 1))[0] is None
+
 
 def test_movie_details(db):
     movie = db.query(Movie).first()
@@ -101,6 +139,23 @@ def test_movie_details(db):
     assert json["code"] == movie.code
     assert "schedules" in json
     assert len(json["schedules"]) >= 1
+    assert "sisa_kursi" in json["schedules"][0]
+    assert "okupansi" in json["schedules"][0]
+
+
+def test_movie_details_date_window(db):
+    movie = db.query(Movie).first()
+
+    response = client.get(
+        f"/now_playing/{movie.code}/details",
+        params={"tanggal_mulai": "2099-01-01"}
+    )
+    assert response.status_code == 200
+    assert response.json()["total_schedules"] == 0
+    assert response.json()["schedules"] == []
+
+    response = client.get(f"/now_playing/{movie.code}/details", params={"limit": 1})
+    assert len(response.json()["schedules"]) <= 1
 
 
 def test_movie_details_not_found():
@@ -109,6 +164,18 @@ def test_movie_details_not_found():
 
 
 
+def test_availability_by_date():
+    response = client.get("/schedules/availability", params={"tanggal": "2024-12-01"})
+    assert response.status_code == 200
+
+    json = response.json()
+    assert json["count"] >= 1
+    assert {"title", "studio", "kapasitas", "terjual", "di_keranjang"} <= set(json["data"][0])
+
+    response = client.get("/schedules/availability", params={"tanggal": "2099-01-01"})
+    assert response.json()["count"] == 0
+
+
 def test_seat_map(db):
     jadwal = db.query(Jadwal).first()
 
@@ -121,6 +188,55 @@ def test_seat_map(db):
     assert len(json["display"]) >= 1
 
 
+def test_seat_map_invalid_format(db):
+    jadwal = db.query(Jadwal).first()
+
+    response = client.get(f"/schedules/{jadwal.code}/seats", params={"format": "xml"})
+    assert response.status_code == 400
+
+
+def test_seat_map_batch(db):
+    jadwal = db.query(Jadwal).first()
+
+    response = client.get(
+        "/schedules/seats/batch",
+        params=[("jadwal_code", jadwal.code), ("jadwal_code", "JAD999"), ("format", "compact")]
+    )
+    assert response.status_code == 200
+
+    json = response.json()
+    assert json["count"] == 1
+    assert json["data"][0]["jadwal_code"] == jadwal.code
+    assert "sold" in json["data"][0]
+    assert json["not_found"] == ["JAD999"]
+
+
+def test_find_best_block_prefers_center():
+    rows = ["A", "B", "C", "D", "E"]
+    state = SeatState(1, "JADX", "Film", "Studio", rows, list(range(1, 9)))
+
+    block = find_best_block(state, 2)
+    assert block["row"] == "C"
+    assert block["cols"] == [4, 5]
+    assert block["lintas_lorong"] is False
+
+    state.mark_sold("C", 4)
+    block = find_best_block(state, 2)
+    assert block["row"] != "C" or 4 not in block["cols"]
+
+    assert find_best_block(state, 9) is None
+
+
+def test_best_seats_not_found():
+    response = client.get("/schedules/JAD999/seats/best", params={"jumlah": 2})
+    assert response.status_code == 404
+
+
+def test_group_seats_movie_not_found():
+    response = client.get("/now_playing/MOV999/group-seats", params={"jumlah": 3})
+    assert response.status_code == 404
+
+
 def test_seat_map_not_found():
     response = client.get("/schedules/JAD999/seats")
     assert response.status_code == 404
@@ -200,6 +316,25 @@ def test_seat_status_booked_and_cart(db):
     assert "X" in disp 
     assert "~" in disp
 
+    compact = client.get(f"/schedules/{jadwal.code}/seats", params={"format": "compact"}).json()
+    assert compact["rows"] == ["A"]
+    assert compact["cols"] == [1, 2]
+    assert base64.b64decode(compact["sold"]) == bytes([0b01])
+    assert base64.b64decode(compact["held"]) == bytes([0b10])
+    assert "display" not in compact
+
+    # Data di atas ditulis langsung ke DB, jadi counter okupansi perlu direkonsiliasi.
+    report = client.post("/schedules/occupancy/reconcile").json()
+    assert report["jumlah_drift"] >= 1
+
+    detail = client.get(f"/now_playing/{movie_code}/details").json()
+    jadwal_info = detail["schedules"][0]
+    assert jadwal_info["kapasitas"] == 2
+    assert jadwal_info["terjual"] == 1
+    assert jadwal_info["di_keranjang"] == 1
+    assert jadwal_info["sisa_kursi"] == 0
+    assert jadwal_info["sold_out"] is True
+
 
     db.delete(order_seat)
     db.delete(cart_item)
@@ -208,4 +343,23 @@ def test_seat_status_booked_and_cart(db):
     db.delete(jadwal)
     db.delete(studio)
     db.delete(movie)
-    db.commit()
\ No newline at end of file
+    db.commit()
+
+def test_seat_map_sees_seats_sold_by_another_process(db, monkeypatch):
+    jadwal = db.query(Jadwal).filter(Jadwal.code == "JAD001").first()
+    first = client.get("/schedules/JAD001/seats", params={"format": "compact"}).json()
+
+    # Proses lain menjual kursi: DB berubah, seat state di cache proses ini tidak.
+    order_seat = OrderSeat(jadwal_id=jadwal.id, row="C", col=4)
+    db.add(order_seat)
+    bump_occupancy(db, jadwal.id, sold=1)
+    db.commit()
+
+    monkeypatch.setattr(seat_states, "check_interval", 0)
+    second = client.get("/schedules/JAD001/seats", params={"format": "compact"}).json()
+    assert second["sold"] != first["sold"]
+    assert second["version"] > first["version"]
+
+    db.delete(order_seat)
+    bump_occupancy(db, jadwal.id, sold=-1)
+    db.commit()
@@ -1,11 +1,26 @@
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
-from datetime import date, time
+from datetime import date, datetime, time, timedelta
 from app.main import app
 from app.database import Base, get_db
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from app.models import Membership, Movie, Studio, Jadwal, StudioSeat, Cart, OrderSeat
+from app.models import Membership, Movie, Studio, Jadwal, StudioSeat, Cart, Order, OrderSeat, OrderWorker
+from app.seat_feed import seat_feed
+from app.seat_state import seat_states
+from app.hold_sweeper import sweep_expired_holds
+from app import holds
+from app.order_code import OrderCodeGenerator, WorkerLease, parse_order_code
+from app.payments import PaymentProcessor, PaymentResult, SimulatedGateway, payment_processor, set_gateway
+from app.cache import OrderCache, order_cache
+from app.admission import AdmissionController, admission
+from app.cancellation import cancel_schedule
+from app.promo import DEFAULT_RULES, NO_PROMO, SEED_RULES, CompiledPromos, PromoEngine, promo_engine
+import asyncio
+import threading
+import time as timer
+from concurrent.futures import ThreadPoolExecutor
 
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./app.db"
@@ -33,6 +48,7 @@ def override_get_db():
 
 app.dependency_overrides[get_db] = override_get_db
 client = TestClient(app)
+set_gateway(SimulatedGateway(latency=0, failure_rate=0))
 
 
 
@@ -96,6 +112,22 @@ def test_get_cart_items():
     assert data["total_price"] == 50000 
     assert len(data["items"]) == 1
     assert data["items"][0]["movie_title"] == "Avatar"
+    assert data["items"][0]["expires_at"] is not None
+    assert data["items"][0]["promo_eligible"] is False
+    assert data["promo"]["final_price"] == 50000
+
+
+def test_get_cart_single_query():
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        res = client.get("/cart/MEM001")
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert res.status_code == 200
+    assert len(statements) == 1
 
 
 global created_order_code
@@ -143,4 +175,805 @@ def test_get_order_detail():
     
     assert res.status_code == 200
 
-    assert res.json()["order_code"] == created_order_code
\ No newline at end of file
+    assert res.json()["order_code"] == created_order_code
+
+
+def test_seat_map_follows_cart_changes():
+    res = client.get("/schedules/JAD001/seats")
+    assert res.status_code == 200
+    assert res.json()["display"][-1] == "A  X O   O O"
+
+    payload = {"membership_code": "MEM001", "jadwal_code": "JAD001", "row": "A", "col": 2}
+    client.post("/cart/add", json=payload)
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        res = client.get("/schedules/JAD001/seats")
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert statements == []
+    assert res.json()["display"][-1] == "A  X ~   O O"
+
+    cart_id = client.get("/cart/MEM001").json()["items"][0]["cart_id"]
+    client.delete(f"/cart/remove/{cart_id}")
+
+    res = client.get("/schedules/JAD001/seats")
+    assert res.json()["display"][-1] == "A  X O   O O"
+
+
+def test_seat_feed_pushes_diff_to_subscribers():
+    state = seat_states.get(TestingSessionLocal(), "JAD001")
+    payload = {"membership_code": "MEM001", "jadwal_code": "JAD001", "row": "A", "col": 3}
+
+    async def listen():
+        subs = [seat_feed.subscribe(state.jadwal_id) for _ in range(2)]
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, lambda: client.post("/cart/add", json=payload))
+        events = [await asyncio.wait_for(s.queue.get(), timeout=5) for s in subs]
+        for s in subs:
+            seat_feed.unsubscribe(s)
+        return events
+
+    events = asyncio.run(listen())
+
+    for event in events:
+        assert event["type"] == "diff"
+        assert (event["row"], event["col"], event["state"]) == ("A", 3, "held")
+    assert events[0]["version"] == state.version
+
+    cart_id = client.get("/cart/MEM001").json()["items"][0]["cart_id"]
+    client.delete(f"/cart/remove/{cart_id}")
+
+
+def test_seat_stream_not_found():
+    res = client.get("/schedules/JAD999/seats/stream")
+    assert res.status_code == 404
+
+
+def test_seat_state_version_keeps_increasing_after_rebuild():
+    db = TestingSessionLocal()
+    before = seat_states.get(db, "JAD001")
+    before.version += 1  # perubahan kursi setelah state dibangun
+    seat_states.invalidate(before.jadwal_id)
+    after = seat_states.get(db, "JAD001")
+    db.close()
+    assert after is not before
+    assert after.version > before.version
+
+
+def test_best_seats_and_add_best_to_cart():
+    res = client.get("/schedules/JAD001/seats/best", params={"jumlah": 2})
+    assert res.status_code == 200
+    assert res.json()["kursi"] == ["A-3", "A-4"]
+
+    res = client.get("/schedules/JAD001/seats/best", params={"jumlah": 4})
+    assert res.status_code == 404
+
+    payload = {"membership_code": "MEM001", "jadwal_code": "JAD001", "jumlah": 2}
+    res = client.post("/cart/add-best", json=payload)
+    assert res.status_code == 200
+    assert res.json()["kursi"] == ["A-3", "A-4"]
+
+    items = client.get("/cart/MEM001").json()["items"]
+    assert sorted(i["seat"] for i in items) == ["A-3", "A-4"]
+    assert client.get("/schedules/JAD001/seats").json()["display"][-1] == "A  X O   ~ ~"
+
+    for i in items:
+        client.delete(f"/cart/remove/{i['cart_id']}")
+
+
+def test_add_best_retries_when_another_process_took_the_block(monkeypatch):
+    payload = {"membership_code": "MEM001", "jadwal_code": "JAD001", "jumlah": 21}
+    assert client.post("/cart/add-best", json=payload).status_code == 422
+
+    best = client.get("/schedules/JAD001/seats/best", params={"jumlah": 1}).json()["kursi"]
+    row, col = best[0].split("-")
+    # Seat state di cache proses ini tidak tahu penjualan di bawah.
+    monkeypatch.setattr(seat_states, "check_interval", 3600)
+    db = TestingSessionLocal()
+    seat_states.get(db, "JAD001")
+    jadwal = db.query(Jadwal).filter(Jadwal.code == "JAD001").first()
+    jadwal_id = jadwal.id
+    other = Membership(code="BEST002", nama="Best")
+    db.add(other)
+    db.flush()
+    order = Order(code="ORD-BEST2", membership_id=other.id, membership_code="BEST002",
+                  jadwal_id=jadwal_id, jadwal_code="JAD001", payment_method="CASH",
+                  seat_count=1, final_price=50000, status="PAID")
+    db.add(order)
+    db.flush()
+    order_id = order.id
+    db.add(OrderSeat(order_id=order_id, jadwal_id=jadwal_id, row=row, col=int(col)))
+    db.commit()
+    db.close()
+
+    payload["jumlah"] = 1
+    res = client.post("/cart/add-best", json=payload)
+    assert res.status_code == 200
+    assert res.json()["kursi"] != best
+
+    for i in client.get("/cart/MEM001").json()["items"]:
+        client.delete(f"/cart/remove/{i['cart_id']}")
+    db = TestingSessionLocal()
+    db.query(OrderSeat).filter(OrderSeat.order_id == order_id).delete()
+    db.query(Order).filter(Order.code == "ORD-BEST2").delete()
+    db.query(Membership).filter(Membership.code == "BEST002").delete()
+    db.commit()
+    db.close()
+    seat_states.invalidate(jadwal_id)
+
+
+def test_group_seat_search_across_showtimes():
+    params = {"jumlah": 2, "tanggal_mulai": "2024-12-15", "jam_mulai": "18:00"}
+    res = client.get("/now_playing/MOV001/group-seats", params=params)
+    assert res.status_code == 200
+    body = res.json()
+    assert body["jadwal_diperiksa"] == 1
+    assert [j["jadwal_code"] for j in body["data"]] == ["JAD001"]
+
+    params["jumlah"] = 4
+    res = client.get("/now_playing/MOV001/group-seats", params=params)
+    assert res.json()["count"] == 0
+
+    params["jam_mulai"] = "20:00"
+    res = client.get("/now_playing/MOV001/group-seats", params=params)
+    assert res.json()["jadwal_diperiksa"] == 0
+
+
+def test_occupancy_counters_follow_cart_and_checkout():
+    def counters():
+        data = client.get("/schedules/availability", params={"tanggal": "2024-12-15"}).json()["data"]
+        return data[0]["terjual"], data[0]["di_keranjang"]
+
+    assert counters() == (1, 0)
+
+    payload = {"membership_code": "MEM001", "jadwal_code": "JAD001", "row": "A", "col": 2}
+    client.post("/cart/add", json=payload)
+    assert counters() == (1, 1)
+
+    client.post("/checkout", json={"membership_code": "MEM001", "payment_method": "CASH", "cash_amount": 50000})
+    assert counters() == (2, 0)
+
+    report = client.post("/schedules/occupancy/reconcile", params={"fix": False}).json()
+    assert report["jumlah_drift"] == 0
+
+
+def test_expired_hold_ignored_then_swept(monkeypatch):
+    monkeypatch.setattr(holds, "HOLD_MINUTES", -1)
+    before = client.get("/metrics/holds").json()
+
+    payload = {"membership_code": "MEM001", "jadwal_code": "JAD001", "row": "A", "col": 3}
+    assert client.post("/cart/add", json=payload).status_code == 200
+
+    assert client.get("/cart/MEM001").json()["items"] == []
+    assert client.get("/schedules/JAD001/seats").json()["display"][-1] == "A  X X   O O"
+    res = client.post("/checkout", json={"membership_code": "MEM001", "payment_method": "QRIS"})
+    assert res.status_code == 400
+
+    db = TestingSessionLocal()
+    assert sweep_expired_holds(db) == 1
+    assert db.query(Cart).count() == 0
+    db.close()
+
+    after = client.get("/metrics/holds").json()
+    assert after["created"] == before["created"] + 1
+    assert after["expired"] == before["expired"] + 1
+    report = client.post("/schedules/occupancy/reconcile", params={"fix": False}).json()
+    assert report["jumlah_drift"] == 0
+
+
+def test_parallel_checkout_same_seat_no_double_booking():
+    n_members = 200
+    db = TestingSessionLocal()
+    members = [Membership(code=f"STRESS{i:03d}", nama=f"Stress {i}") for i in range(n_members)]
+    db.add_all(members)
+    db.commit()
+    codes = [m.code for m in members]
+    db.close()
+
+    for code in codes:
+        payload = {"membership_code": code, "jadwal_code": "JAD001", "row": "A", "col": 4}
+        assert client.post("/cart/add", json=payload).status_code == 200
+
+    def checkout(code):
+        return client.post("/checkout", json={"membership_code": code, "payment_method": "QRIS"})
+
+    start = timer.perf_counter()
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        responses = list(pool.map(checkout, codes))
+    elapsed = timer.perf_counter() - start
+    # Checkout hanya mengunci cart member sendiri, jadi 200 checkout paralel
+    # tidak boleh antre satu per satu sampai puluhan detik.
+    assert elapsed < 20
+
+    statuses = [r.status_code for r in responses]
+    assert statuses.count(200) == 1
+    assert statuses.count(409) == n_members - 1
+    conflict = next(r for r in responses if r.status_code == 409).json()["detail"]
+    assert conflict["kursi_bentrok"] == ["A-4"]
+
+    db = TestingSessionLocal()
+    jadwal_id = db.query(Jadwal.id).filter(Jadwal.code == "JAD001").scalar()
+    assert db.query(OrderSeat).filter_by(jadwal_id=jadwal_id, row="A", col=4).count() == 1
+
+    db.query(Cart).filter(Cart.membership_code.in_(codes)).delete(synchronize_session=False)
+    db.commit()
+    db.close()
+    seat_states.invalidate(jadwal_id)
+    client.post("/schedules/occupancy/reconcile")
+
+
+def test_add_batch_to_cart_reports_each_seat():
+    payload = {
+        "membership_code": "MEM001",
+        "jadwal_code": "JAD001",
+        "seats": [{"row": "A", "col": 1}, {"row": "A", "col": 3}, {"row": "A", "col": 3}]
+    }
+    res = client.post("/cart/add-batch", json=payload)
+    assert res.status_code == 200
+    assert res.json()["data"] == [
+        {"seat": "A-1", "status": "sold"},
+        {"seat": "A-3", "status": "added"},
+    ]
+
+    res = client.post("/cart/add-batch", json=payload)
+    assert res.json()["added"] == 0
+    assert res.json()["data"][1] == {"seat": "A-3", "status": "duplicate"}
+
+    items = client.get("/cart/MEM001").json()["items"]
+    assert [i["seat"] for i in items] == ["A-3"]
+    client.delete(f"/cart/remove/{items[0]['cart_id']}")
+
+
+def test_add_batch_to_cart_lost_race_returns_400(monkeypatch):
+    import app.routers.user_transaction as ut
+    original = ut.drop_expired_holds
+
+    def racing_drop_expired_holds(*args):
+        # Batch identik lain meng-commit kursi yang sama setelah pre-check.
+        other = TestingSessionLocal()
+        jadwal = other.query(Jadwal).filter(Jadwal.code == "JAD001").first()
+        member = other.query(Membership).filter(Membership.code == "MEM001").first()
+        other.add(Cart(membership_id=member.id, membership_code="MEM001", jadwal_id=jadwal.id,
+                       studio_id=jadwal.studio_id, price=0, row="A", col=3,
+                       expires_at=datetime.now() + timedelta(minutes=5)))
+        other.commit()
+        other.close()
+        return original(*args)
+
+    monkeypatch.setattr(ut, "drop_expired_holds", racing_drop_expired_holds)
+    payload = {"membership_code": "MEM001", "jadwal_code": "JAD001", "seats": [{"row": "A", "col": 3}]}
+    res = client.post("/cart/add-batch", json=payload)
+    assert res.status_code == 400
+    assert "sudah diambil" in res.json()["detail"]
+
+    monkeypatch.setattr(ut, "drop_expired_holds", original)
+    items = client.get("/cart/MEM001").json()["items"]
+    assert [i["seat"] for i in items] == ["A-3"]
+    db = TestingSessionLocal()
+    db.query(Cart).filter(Cart.membership_code == "MEM001").delete()
+    db.commit()
+    db.close()
+
+
+
+def test_checkout_idempotency_key_replays_first_response():
+    db = TestingSessionLocal()
+    db.add(Membership(code="IDEM001", nama="Idempotent"))
+    db.commit()
+    db.close()
+
+    assert client.post("/cart/add", json={
+        "membership_code": "IDEM001", "jadwal_code": "JAD001", "row": "A", "col": 3
+    }).status_code == 200
+
+    payload = {"membership_code": "IDEM001", "payment_method": "QRIS"}
+    headers = {"Idempotency-Key": "retry-abc"}
+
+    def checkout(_):
+        return client.post("/checkout", json=payload, headers=headers)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(checkout, range(8)))
+
+    assert [r.status_code for r in responses] == [200] * 8
+    codes = {r.json()["order_code"] for r in responses}
+    assert len(codes) == 1
+    assert sum(r.headers.get("Idempotent-Replayed") == "true" for r in responses) == 7
+
+    # Retry belakangan tetap dapat response yang sama, bukan "Keranjang kosong".
+    replay = client.post("/checkout", json=payload, headers=headers)
+    assert replay.status_code == 200
+    assert replay.json()["order_code"] in codes
+    assert replay.headers["Idempotent-Replayed"] == "true"
+
+    db = TestingSessionLocal()
+    member_id = db.query(Membership.id).filter(Membership.code == "IDEM001").scalar()
+    assert db.query(Order).filter(Order.membership_id == member_id).count() == 1
+    db.close()
+
+    mismatch = client.post("/checkout", json=dict(payload, payment_method="CASH", cash_amount=1), headers=headers)
+    assert mismatch.status_code == 422
+
+    fresh = client.post("/checkout", json=payload, headers={"Idempotency-Key": "retry-def"})
+    assert fresh.status_code == 400
+    again = client.post("/checkout", json=payload, headers={"Idempotency-Key": "retry-def"})
+    assert again.status_code == 400
+    assert again.headers["Idempotent-Replayed"] == "true"
+
+
+def test_order_code_generator_unique_and_ordered():
+    gen = OrderCodeGenerator(worker_id=7)
+    n = 200_000
+    start = timer.perf_counter()
+    codes = [gen.next_code() for _ in range(n)]
+    assert timer.perf_counter() - start < 10
+
+    assert len(set(codes)) == n
+    assert codes == sorted(codes)
+    assert all(len(c) == 17 and c.startswith("ORD-") for c in codes)
+    assert parse_order_code(codes[0])["worker_id"] == 7
+
+    # Worker berbeda di milidetik yang sama tetap menghasilkan kode berbeda.
+    fixed = lambda: 1734220800.0
+    a = OrderCodeGenerator(worker_id=1, clock=fixed)
+    b = OrderCodeGenerator(worker_id=2, clock=fixed)
+    assert {a.next_code() for _ in range(5000)}.isdisjoint({b.next_code() for _ in range(5000)})
+
+    # Jam mundur atau sequence habis tidak membuat kode mundur.
+    ticks = iter([1734220800.0, 1734220799.0] + [1734220799.0] * 5000)
+    c = OrderCodeGenerator(worker_id=3, clock=lambda: next(ticks))
+    seq = [c.next_code() for _ in range(5002)]
+    assert seq == sorted(seq) and len(set(seq)) == len(seq)
+
+
+def test_order_worker_lease_gives_unique_ids():
+    a = WorkerLease(engine, lease_seconds=60)
+    b = WorkerLease(engine, lease_seconds=60)
+    try:
+        assert a.claim() != b.claim()
+
+        # Lease a habis (proses macet): slotnya boleh diambil proses lain,
+        # dan a tahu lease-nya hilang saat memperpanjang.
+        db = TestingSessionLocal()
+        db.query(OrderWorker).filter(OrderWorker.worker_id == a.worker_id).update(
+            {OrderWorker.lease_until: datetime.now() - timedelta(seconds=1)}
+        )
+        db.commit()
+        db.close()
+        c = WorkerLease(engine, lease_seconds=60)
+        assert c.claim() == a.worker_id
+        assert a.renew() is False and a.lost
+        assert b.renew() is True
+        c.release()
+    finally:
+        a.release()
+        b.release()
+
+
+def test_payment_pending_then_failed_releases_seat():
+    db = TestingSessionLocal()
+    studio_id = db.query(Jadwal.studio_id).filter(Jadwal.code == "JAD001").scalar()
+    jadwal_id = db.query(Jadwal.id).filter(Jadwal.code == "JAD001").scalar()
+    db.add(StudioSeat(studio_id=studio_id, row="B", col=1))
+    db.commit()
+    db.close()
+    seat_states.invalidate(jadwal_id)
+
+    cart = {"membership_code": "MEM001", "jadwal_code": "JAD001", "row": "B", "col": 1}
+    pay = {"membership_code": "MEM001", "payment_method": "QRIS"}
+
+    set_gateway(SimulatedGateway(latency=0, failure_rate=1))
+    try:
+        assert client.post("/cart/add", json=cart).status_code == 200
+        res = client.post("/checkout", json=pay)
+        assert res.status_code == 200
+        assert res.json()["status"] == "PENDING"
+        code = res.json()["order_code"]
+
+        assert payment_processor.wait_idle(5)
+        order = client.get(f"/order/{code}").json()
+        assert order["status"] == "FAILED"
+        # Kursi kembali kosong dan bisa masuk keranjang lagi.
+        assert client.post("/cart/add", json=cart).status_code == 200
+    finally:
+        set_gateway(SimulatedGateway(latency=0, failure_rate=0))
+
+    report = client.post("/schedules/occupancy/reconcile", params={"fix": False}).json()
+    assert report["jumlah_drift"] == 0
+
+    # Kursi yang dilepas bisa dibeli lagi dan kali ini pembayarannya sukses.
+    res = client.post("/checkout", json=pay)
+    assert res.json()["status"] == "PENDING"
+    assert payment_processor.wait_idle(5)
+    assert client.get(f"/order/{res.json()['order_code']}").json()["status"] == "PAID"
+
+
+def test_resume_pending_charges_each_order_once_across_workers():
+    class CountingGateway:
+        def __init__(self):
+            self.calls = []
+            self._lock = threading.Lock()
+
+        def charge(self, order_code, amount, method):
+            timer.sleep(0.05)
+            with self._lock:
+                self.calls.append(order_code)
+            return PaymentResult(True, reference="REF-" + order_code)
+
+    db = TestingSessionLocal()
+    jadwal = db.query(Jadwal).filter(Jadwal.code == "JAD001").first()
+    db.add(Order(code="ORD-RESUME", membership_id=1, membership_code="MEM001",
+                 jadwal_id=jadwal.id, jadwal_code="JAD001", payment_method="QRIS",
+                 seat_count=1, final_price=50000, status="PENDING"))
+    db.commit()
+    db.close()
+
+    gateway = CountingGateway()
+    # Dua proses yang start bersamaan, masing-masing dengan pool sendiri.
+    workers = [PaymentProcessor(gateway, workers=2) for _ in range(2)]
+    try:
+        for worker in workers:
+            worker.resume_pending(TestingSessionLocal)
+        for worker in workers:
+            assert worker.wait_idle(5)
+    finally:
+        for worker in workers:
+            worker.shutdown()
+
+    assert gateway.calls == ["ORD-RESUME"]
+    assert client.get("/order/ORD-RESUME").json()["status"] == "PAID"
+
+
+def test_member_order_history_keyset_pages():
+    db = TestingSessionLocal()
+    member = Membership(code="HIST001", nama="History")
+    db.add(member)
+    db.commit()
+    jadwal = db.query(Jadwal).filter(Jadwal.code == "JAD001").first()
+    for i in range(5):
+        order = Order(code=f"ORD-HIST{i}", membership_id=member.id, membership_code="HIST001",
+                      jadwal_id=jadwal.id, jadwal_code="JAD001", payment_method="CASH",
+                      seat_count=2, final_price=100000, status="PAID")
+        db.add(order)
+        db.flush()
+        db.add(OrderSeat(order_id=order.id, jadwal_id=jadwal.id, row="H", col=10 + i))
+        if i == 0:
+            db.add(OrderSeat(order_id=order.id, jadwal_id=jadwal.id, row="H", col=2))
+    db.commit()
+    db.close()
+
+    first = client.get("/members/HIST001/orders", params={"limit": 2}).json()
+    assert [o["order_code"] for o in first["data"]] == ["ORD-HIST4", "ORD-HIST3"]
+    assert first["data"][0]["movie_title"] == "Avatar"
+    assert first["data"][0]["seats"] == ["H-14"]
+
+    codes = [o["order_code"] for o in first["data"]]
+    cursor = first["next_cursor"]
+    while cursor is not None:
+        page = client.get("/members/HIST001/orders", params={"limit": 2, "cursor": cursor}).json()
+        codes += [o["order_code"] for o in page["data"]]
+        last = page
+        cursor = page["next_cursor"]
+
+    assert codes == [f"ORD-HIST{i}" for i in range(4, -1, -1)]
+    assert last["data"][-1]["seats"] == ["H-2", "H-10"]
+    assert client.get("/members/NOPE/orders").status_code == 404
+
+
+def test_get_order_served_from_cache_after_checkout():
+    def count_queries(fn):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            fn()
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        return len(statements)
+
+    before = client.get("/metrics/orders").json()
+    read = lambda: client.get(f"/order/{created_order_code}")
+
+    # Entry dari checkout di test sebelumnya sudah lewat TTL (2 detik):
+    # baca pertama query sekali, berikutnya dari cache.
+    order_cache.invalidate(created_order_code)
+    assert count_queries(read) == 1
+    assert count_queries(read) == 0
+    assert count_queries(read) == 0
+    assert read().json()["status"] == "PAID"
+
+    after = client.get("/metrics/orders").json()
+    assert after["hits"] - before["hits"] == 3
+    assert after["misses"] - before["misses"] == 1
+
+
+def test_order_cache_rejects_stale_fill_and_evicts_lru():
+    cache = OrderCache(max_size=2, ttl=60)
+    since = cache.begin()
+    cache.invalidate("ORD-A")
+    cache.put("ORD-A", {"status": "PENDING"}, since)
+    assert cache.get("ORD-A") is None
+
+    cache.put("ORD-A", {"status": "PAID"})
+    cache.put("ORD-B", {"status": "PAID"})
+    cache.get("ORD-A")
+    cache.put("ORD-C", {"status": "PAID"})
+    assert cache.get("ORD-B") is None
+    assert cache.get("ORD-A") == {"status": "PAID"}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_order_cache_entries_expire_for_every_status():
+    # Status bisa diubah worker/proses lain (bayar, refund, batal).
+    cache = OrderCache(max_size=10, ttl=0.05)
+    cache.put("ORD-P", {"status": "PENDING"})
+    cache.put("ORD-Q", {"status": "PAID"})
+    assert cache.get("ORD-Q") == {"status": "PAID"}
+    timer.sleep(0.1)
+    assert cache.get("ORD-P") is None
+    assert cache.get("ORD-Q") is None
+
+
+def test_cancel_schedule_refunds_orders_and_clears_carts():
+    db = TestingSessionLocal()
+    base = db.query(Jadwal).filter(Jadwal.code == "JAD001").first()
+    jadwal = Jadwal(code="JADX01", movie_id=base.movie_id, studio_id=base.studio_id,
+                    tanggal=date(2024, 12, 16), jam=time(19, 0))
+    db.add(jadwal)
+    db.commit()
+    member = db.query(Membership).filter(Membership.code == "MEM001").first()
+    for i, status in enumerate(["PAID", "PAID", "PENDING", "FAILED"]):
+        order = Order(code=f"ORD-CNL{i}", membership_id=member.id, membership_code="MEM001",
+                      jadwal_id=jadwal.id, jadwal_code="JADX01", payment_method="QRIS",
+                      seat_count=1, final_price=40000 + i, status=status)
+        db.add(order)
+        db.flush()
+        if status != "FAILED":
+            db.add(OrderSeat(order_id=order.id, jadwal_id=jadwal.id, row="A", col=i + 1))
+    db.add(Cart(membership_code="MEM001", membership_id=member.id, jadwal_id=jadwal.id,
+                studio_id=base.studio_id, row="A", col=4, price=50000))
+    db.commit()
+    jadwal_id = jadwal.id
+    db.close()
+
+    client.get("/order/ORD-CNL0")  # isi order_cache
+    res = client.post("/schedules/JADX01/cancel")
+    assert res.status_code == 200
+    body = res.json()
+    assert body["order_direfund"] == 2
+    assert body["order_dibatalkan"] == 1
+    assert body["total_refund"] == 40000 + 40001
+    assert body["kursi_dilepas"] == 3
+    assert body["cart_dihapus"] == 1
+
+    assert client.get("/order/ORD-CNL0").json()["status"] == "REFUNDED"
+    assert client.get("/order/ORD-CNL2").json()["status"] == "CANCELLED"
+    assert client.get("/order/ORD-CNL3").json()["status"] == "FAILED"
+
+    # Jadwal & kursi tetap ada sebagai jejak refund; jadwalnya hanya ditandai batal.
+    db = TestingSessionLocal()
+    assert db.query(OrderSeat).filter(OrderSeat.jadwal_id == jadwal_id).count() == 3
+    assert db.query(Cart).filter(Cart.jadwal_id == jadwal_id).count() == 0
+    assert db.query(Jadwal).filter(Jadwal.id == jadwal_id).one().cancelled_at is not None
+    db.close()
+    assert client.post("/schedules/JADX01/cancel").status_code == 400
+
+    # Pembatalan kedua yang membaca jadwal sebelum yang pertama commit.
+    db = TestingSessionLocal()
+    stale = Jadwal(id=jadwal_id, code="JADX01")
+    with pytest.raises(HTTPException) as again:
+        cancel_schedule(db, stale)
+    assert again.value.status_code == 400
+    db.close()
+
+    res = client.post("/cart/add", json={"membership_code": "MEM001", "jadwal_code": "JADX01",
+                                         "row": "B", "col": 1})
+    assert res.status_code == 404
+
+    history = client.get("/members/MEM001/orders", params={"limit": 100}).json()["data"]
+    refunded = next(o for o in history if o["order_code"] == "ORD-CNL0")
+    assert refunded["movie_title"] == "Avatar"
+
+
+def test_cancel_schedule_background_mode():
+    db = TestingSessionLocal()
+    base = db.query(Jadwal).filter(Jadwal.code == "JAD001").first()
+    db.add(Jadwal(code="JADX02", movie_id=base.movie_id, studio_id=base.studio_id,
+                  tanggal=date(2024, 12, 16), jam=time(21, 0)))
+    db.commit()
+    db.close()
+
+    res = client.post("/schedules/JADX02/cancel", params={"background": True})
+    assert res.status_code == 200
+    assert "diproses" in res.json()["status"]
+
+    db = TestingSessionLocal()
+    assert db.query(Jadwal).filter(Jadwal.code == "JADX02").one().cancelled_at is not None
+    db.close()
+
+
+def test_admission_queue_admits_in_ticket_order():
+    ctl = AdmissionController(global_limit=1, showtime_limit=1, wait_seconds=0)
+    acquire = lambda *args: asyncio.run(ctl.acquire_async(*args))
+    acquire("JAD001")
+    start = timer.monotonic()
+
+    with pytest.raises(HTTPException) as first:
+        acquire("JAD001")
+    with pytest.raises(HTTPException) as second:
+        acquire("JAD001")
+    assert first.value.status_code == 429
+    assert first.value.detail["posisi"] == 1
+    assert second.value.detail["posisi"] == 2
+    ticket_1 = first.value.detail["ticket"]
+    ticket_2 = second.value.detail["ticket"]
+
+    ctl.release("JAD001", start)
+    # Slot kosong, tapi tiket pertama yang berhak masuk duluan.
+    with pytest.raises(HTTPException):
+        acquire("JAD001", ticket_2)
+    # Jadwal lain punya antrean sendiri, tapi tetap kena batas global.
+    with pytest.raises(HTTPException) as other:
+        acquire("JAD002")
+    assert other.value.detail["posisi"] == 1
+    acquire("JAD001", ticket_1)
+    ctl.release("JAD001", start)
+    acquire("JAD001", ticket_2)
+    ctl.release("JAD001", start)
+    assert ctl.stats()["antrean"] == 1  # tiket JAD002 belum diulang
+
+
+def test_admission_abandoned_head_ticket_stops_blocking():
+    ctl = AdmissionController(global_limit=1, showtime_limit=1, wait_seconds=0, ticket_grace=0)
+
+    async def scenario():
+        await ctl.acquire_async("JAD001")
+        start = timer.monotonic()
+        with pytest.raises(HTTPException) as abandoned:
+            await ctl.acquire_async("JAD001")
+        with pytest.raises(HTTPException) as waiting:
+            await ctl.acquire_async("JAD001")
+        ctl.release("JAD001", start)
+
+        # Kepala antrean tidak kembali dalam Retry-After + grace; tiket
+        # berikutnya yang sedang menunggu masuk begitu tiket itu gugur.
+        ctl.wait_seconds = 5
+        await ctl.acquire_async("JAD001", waiting.value.detail["ticket"])
+        return timer.monotonic() - start, int(abandoned.value.headers["Retry-After"])
+
+    elapsed, retry_after = asyncio.run(scenario())
+    assert retry_after <= elapsed < retry_after + 1
+    assert ctl.stats()["antrean"] == 0
+
+
+def test_admission_async_waiter_gets_released_slot():
+    ctl = AdmissionController(global_limit=1, showtime_limit=1, wait_seconds=2)
+
+    async def scenario():
+        await ctl.acquire_async("JAD001")
+        start = timer.monotonic()
+        waiter = asyncio.create_task(ctl.acquire_async("JAD001"))
+        await asyncio.sleep(0.05)
+        assert not waiter.done() and ctl.stats()["antrean"] == 1
+        ctl.release("JAD001", start)
+        await asyncio.wait_for(waiter, 1)
+        return timer.monotonic() - start
+
+    assert asyncio.run(scenario()) < 1
+    assert ctl.stats()["aktif"] == 1 and ctl.stats()["antrean"] == 0
+
+
+def test_cart_add_returns_429_with_queue_ticket():
+    limits = (admission.showtime_limit, admission.wait_seconds)
+    admission.showtime_limit, admission.wait_seconds = 1, 0
+    asyncio.run(admission.acquire_async("JAD001"))
+    start = timer.monotonic()
+    try:
+        payload = {"membership_code": "MEM001", "jadwal_code": "JAD001", "row": "A", "col": 1}
+        res = client.post("/cart/add", json=payload)
+        assert res.status_code == 429
+        assert int(res.headers["Retry-After"]) >= 1
+        ticket = res.headers["X-Queue-Ticket"]
+        assert res.json()["detail"]["ticket"] == ticket
+    finally:
+        admission.release("JAD001", start)
+        admission.showtime_limit, admission.wait_seconds = limits
+
+    res = client.post("/cart/add", json=payload, headers={"X-Queue-Ticket": ticket})
+    assert res.status_code == 400  # masuk, lalu ditolak karena A1 sudah terjual
+    assert client.get("/metrics/admission").json()["aktif"] == 0
+
+
+def test_compiled_promos_pick_highest_priority():
+    # Default checkout hanya BULK 5+: tanggal 12 tidak otomatis diskon.
+    assert CompiledPromos(DEFAULT_RULES, {}).evaluate(1, date(2024, 12, 12), "MEM001", 1) == NO_PROMO
+    assert CompiledPromos(DEFAULT_RULES, {}).evaluate(5, date(2024, 12, 12), "MEM001", 1) == ("BULK 5+", 20)
+
+    promos = CompiledPromos(SEED_RULES + [
+        {"code": "WEEKEND", "name": "WEEKEND AVATAR", "discount": 10, "priority": 5,
+         "weekdays": "5,6", "movie_codes": "MOV001"},
+    ], {"MOV001": 1})
+
+    assert promos.evaluate(5, date(2024, 12, 12), "MEM001", 1) == ("SUPER 12.12", 30)
+    assert promos.evaluate(5, date(2024, 12, 11), "MEM001", 1) == ("BULK 5+", 20)
+    assert promos.evaluate(1, date(2024, 12, 14), "MEM001", 1) == ("WEEKEND AVATAR", 10)  # Sabtu
+    assert promos.evaluate(1, date(2024, 12, 14), "MEM001", 2) == ("NO PROMO", 0)
+    assert promos.evaluate_many([(9, date(2024, 12, 10), None, None)]) == [("BULK 5+", 20)]
+
+
+def test_admin_promo_rule_applies_to_cart():
+    res = client.post("/promos", json={
+        "code": "MEMBER15", "name": "MEMBER SETIA", "discount": 15, "priority": 30,
+        "membership_codes": "MEM001", "movie_codes": "MOV001"
+    })
+    assert res.status_code == 200
+    codes = [r["code"] for r in client.get("/promos").json()["data"]]
+    assert codes == ["MEMBER15", "BULK5"]
+    assert client.post("/promos", json={"code": "X", "name": "X", "discount": 0}).status_code == 400
+
+    try:
+        db = TestingSessionLocal()
+        studio_id = db.query(Jadwal.studio_id).filter(Jadwal.code == "JAD001").scalar()
+        jadwal_id = db.query(Jadwal.id).filter(Jadwal.code == "JAD001").scalar()
+        db.add(StudioSeat(studio_id=studio_id, row="B", col=2))
+        db.commit()
+        db.close()
+        seat_states.invalidate(jadwal_id)
+
+        cart = {"membership_code": "MEM001", "jadwal_code": "JAD001", "row": "B", "col": 2}
+        assert client.post("/cart/add", json=cart).status_code == 200
+        data = client.get("/cart/MEM001").json()
+        assert data["promo"]["promo_name"] == "MEMBER SETIA"
+        assert data["promo"]["final_price"] == 42500
+        assert data["items"][0]["promo_eligible"] is True
+
+        report = client.get("/promos/simulate").json()
+        assert report["jumlah_order"] > 0
+        assert sum(p["jumlah_order"] for p in report["per_promo"].values()) == report["jumlah_order"]
+
+        client.delete(f"/cart/remove/{data['items'][0]['cart_id']}")
+    finally:
+        assert client.delete("/promos/MEMBER15").status_code == 200
+
+    db = TestingSessionLocal()
+    assert promo_engine.get(db).codes == ["BULK5"]
+    db.close()
+
+
+def test_promo_engine_picks_up_changes_from_other_workers():
+    # Engine "worker lain": tidak pernah menerima invalidate() dari admin.
+    other = PromoEngine(check_interval=0)
+    stale = PromoEngine(check_interval=3600)
+    db = TestingSessionLocal()
+    other.get(db)
+    stale.get(db)
+    db.close()
+
+    assert client.post("/promos", json={
+        "code": "FLASH", "name": "FLASH SALE", "discount": 5, "priority": 1
+    }).status_code == 200
+    try:
+        db = TestingSessionLocal()
+        assert "FLASH" in other.get(db).codes
+        assert "FLASH" not in stale.get(db).codes
+        db.close()
+
+        assert client.put("/promos/FLASH", json={
+            "code": "FLASH", "name": "FLASH SALE", "discount": 7, "priority": 1
+        }).status_code == 200
+        db = TestingSessionLocal()
+        assert other.get(db).evaluate(1, date(2024, 12, 15), "MEM001", 1) == ("FLASH SALE", 7)
+        db.close()
+
+        res = client.put("/promos/FLASH", json={"code": "BULK5", "name": "X", "discount": 7})
+        assert res.status_code == 400
+    finally:
+        assert client.delete("/promos/FLASH").status_code == 200
+
+    db = TestingSessionLocal()
+    assert "FLASH" not in other.get(db).codes
+    db.close()